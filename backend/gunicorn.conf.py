@@ -0,0 +1,24 @@
+# backend/gunicorn.conf.py
+#
+# SERVER_MODE=wsgi (default): classic sync workers.
+# SERVER_MODE=asgi: uvicorn workers; scan uploads await inference on a
+# bounded thread pool (INFERENCE_WORKERS) so the worker keeps serving
+# dashboards, alerts and auth in the meantime.
+import os
+
+server_mode = os.environ.get('SERVER_MODE', 'wsgi')
+
+if server_mode == 'asgi':
+    wsgi_app = 'pulmoscanpro.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'pulmoscanpro.wsgi:application'
+    worker_class = 'sync'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+if workers > 1:
+    # Live events published by one worker must reach streams held by the others
+    os.environ.setdefault('EVENTS_FANOUT', 'unix')
+# Uploads plus inference can take a while on small instances
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
@@ -0,0 +1,176 @@
+# backend/loadtest/common.py
+"""
+Helpers shared by the load-test scripts: a stdlib HTTP client, synthetic
+X-rays, token handling, percentile summaries and a throwaway gunicorn
+server.
+"""
+import base64
+import io
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def synthetic_xray(size=2048):
+    """
+    PNG bytes of a noisy radiograph-like image, different on every call so
+    uploads are not deduplicated.
+    """
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng()
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)
+    body = 180 * np.exp(-(((x - size / 2) / (size / 3)) ** 2 + ((y - size / 2) / (size / 2.5)) ** 2))
+    pixels = np.clip(body + rng.normal(0, 10, size=(size, size)) + 30, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def fetch(base_url, method, path, token=None, body=None, content_type=None, headers=None):
+    """
+    (status, seconds, body bytes, response headers) for one HTTP request.
+    Status is 0 when the server could not be reached.
+    """
+    headers = {'Accept': 'application/json', **(headers or {})}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    if content_type:
+        headers['Content-Type'] = content_type
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(base_url + path, data=body, headers=headers, method=method), timeout=300) as response:
+            payload = response.read()
+            status, response_headers = response.status, response.headers
+    except urllib.error.HTTPError as e:
+        payload, status, response_headers = e.read(), e.code, e.headers
+    except (urllib.error.URLError, OSError):
+        return 0, time.perf_counter() - started, b'', {}
+    return status, time.perf_counter() - started, payload, response_headers
+
+
+def request(base_url, method, path, token=None, body=None, content_type=None):
+    """
+    (status, seconds, parsed JSON or None) for one HTTP request.
+    """
+    status, elapsed, payload, _ = fetch(base_url, method, path, token, body, content_type)
+    try:
+        return status, elapsed, json.loads(payload)
+    except ValueError:
+        return status, elapsed, None
+
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def obtain_tokens(base_url, username, password):
+    body = json.dumps({'username': username, 'password': password}).encode()
+    status, _, data = request(base_url, 'POST', '/api/auth/token/', body=body, content_type='application/json')
+    if status != 200:
+        raise RuntimeError(f'Could not log in as {username}: HTTP {status}')
+    return data['access'], data['refresh']
+
+
+def token_expiry(token):
+    """
+    The `exp` claim of a JWT (seconds since the epoch), read without
+    verifying the signature.
+    """
+    payload = token.split('.')[1]
+    return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp']
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        'count': len(ordered),
+        'p50_ms': round(pick(0.50) * 1000, 1),
+        'p95_ms': round(pick(0.95) * 1000, 1),
+        'p99_ms': round(pick(0.99) * 1000, 1),
+        'max_ms': round(ordered[-1] * 1000, 1),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 1),
+    }
+
+
+class Server:
+    """
+    gunicorn in the given mode with the default users from
+    `create_initial_users`, on a fresh SQLite database and media directory
+    unless `database_url` points at an existing database (e.g. a local
+    Postgres), which is migrated in place.
+    """
+
+    def __init__(self, mode, database_url=None, workers=1):
+        self.mode = mode
+        self.port = free_port()
+        self.directory = tempfile.mkdtemp(prefix=f'pulmoscan-{mode}-')
+        self.env = {
+            **os.environ,
+            'SERVER_MODE': mode,
+            'PORT': str(self.port),
+            'WEB_CONCURRENCY': str(workers),
+            'DATABASE_URL': database_url or f"sqlite:///{os.path.join(self.directory, 'db.sqlite3')}",
+            'MEDIA_ROOT': os.path.join(self.directory, 'media'),
+            'SECRET_KEY': os.environ.get('SECRET_KEY', 'loadtest-secret-key'),
+            'RENDER_EXTERNAL_HOSTNAME': '127.0.0.1',
+        }
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def __enter__(self):
+        for command in (['migrate', '--noinput'], ['create_initial_users']):
+            subprocess.run([sys.executable, 'manage.py', *command], cwd=BACKEND_DIR, env=self.env, check=True, capture_output=True)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{self.port}'],
+            cwd=BACKEND_DIR, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if request(self.base_url, 'GET', '/api/')[0]:
+                return self
+            time.sleep(0.2)
+        raise RuntimeError(f'{self.mode} server did not start')
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,99 @@
+# backend/loadtest/compare_modes.py
+"""
+Compares the WSGI and ASGI deployment modes under scan-upload load.
+
+For each mode a fresh gunicorn server (gunicorn.conf.py, one worker) is
+started on a throwaway SQLite database and media directory. While
+UPLOADERS clients keep posting synthetic X-rays to /api/scan-reports/, a
+probe client polls the lightweight endpoints (doctor dashboard, medicine
+alerts, token refresh) and records their latency. In WSGI mode the probes queue behind
+inference; in ASGI mode they should not.
+
+    cd backend
+    python loadtest/compare_modes.py --duration 30 --uploaders 4
+
+Prints a JSON summary per mode. Only the standard library (plus the
+project's own dependencies) is needed.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+
+from common import Server, multipart, obtain_tokens, percentiles, request, synthetic_xray
+
+PROBE_PATHS = ('/api/dashboard/doctor-summary/', '/api/medicines/alerts/')
+REFRESH_PATH = '/api/auth/token/refresh/'
+
+
+def run_mode(mode, duration, uploaders):
+    with Server(mode) as server:
+        access, refresh = obtain_tokens(server.base_url, 'doctoruser', 'doctorpass')
+        images = [synthetic_xray() for _ in range(4)]
+        stop = threading.Event()
+        timings = {path: [] for path in ('/api/scan-reports/',) + PROBE_PATHS + (REFRESH_PATH,)}
+        errors = []
+
+        def record(path, status, elapsed, expected=200):
+            if status == expected:
+                timings[path].append(elapsed)
+            else:
+                errors.append((path, status))
+
+        def upload_loop(index):
+            n = 0
+            while not stop.is_set():
+                # Bytes after the PNG end chunk change the content hash (so
+                # no deduplication) but not the decoded image
+                image = images[n % len(images)] + uuid.uuid4().bytes
+                body, content_type = multipart({'patient_name': f'load-{index}-{n}'}, {'scan_image': ('xray.png', image, 'image/png')})
+                status, elapsed, _ = request(server.base_url, 'POST', '/api/scan-reports/', access, body, content_type)
+                record('/api/scan-reports/', status, elapsed, expected=201)
+                n += 1
+
+        def probe_loop():
+            nonlocal refresh
+            while not stop.is_set():
+                for path in PROBE_PATHS:
+                    status, elapsed, _ = request(server.base_url, 'GET', path, access)
+                    record(path, status, elapsed)
+                body = json.dumps({'refresh': refresh}).encode()
+                status, elapsed, data = request(server.base_url, 'POST', REFRESH_PATH, body=body, content_type='application/json')
+                record(REFRESH_PATH, status, elapsed)
+                if status == 200:
+                    # Refresh tokens rotate; the old one is blacklisted
+                    refresh = data.get('refresh', refresh)
+                time.sleep(0.1)
+
+        threads = [threading.Thread(target=upload_loop, args=(i,)) for i in range(uploaders)]
+        threads.append(threading.Thread(target=probe_loop))
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    uploads = timings.pop('/api/scan-reports/')
+    return {
+        'mode': mode,
+        'uploads': {**percentiles(uploads), 'per_second': round(len(uploads) / duration, 2)},
+        'probes': {path: percentiles(samples) for path, samples in timings.items()},
+        'errors': {f'{path} {status}': errors.count((path, status)) for path, status in sorted(set(errors))},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load per mode.')
+    parser.add_argument('--uploaders', type=int, default=4, help='Concurrent scan-uploading clients.')
+    parser.add_argument('--modes', default='wsgi,asgi', help='Comma-separated modes to run.')
+    options = parser.parse_args()
+
+    results = [run_mode(mode, options.duration, options.uploaders) for mode in options.modes.split(',')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
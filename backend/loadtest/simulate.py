@@ -0,0 +1,399 @@
+# backend/loadtest/simulate.py
+"""
+End-to-end load generator simulating doctors and pharmacists.
+
+Each virtual user logs in, renews its access token shortly before it
+expires (every ~20 s with the default ACCESS_TOKEN_LIFETIME) and then
+loops over a weighted mix of what the React app does, with a random think
+time between actions:
+
+    doctor      dashboard polling, patient-name searches, report detail,
+                scan uploads (synthetic X-rays)
+    pharmacist  stock dashboard and alert polling, FEFO sales, restocking
+
+Dashboards are polled like a browser would, revalidating with the last
+ETag. Before the run a pharmacist seeds a few well-stocked medicines for
+the sales to draw on.
+
+Against a server that is already running (runserver, gunicorn, SQLite or
+Postgres; the default users from `create_initial_users` must exist):
+
+    cd backend
+    python loadtest/simulate.py --url http://127.0.0.1:8000 --doctors 8 --pharmacists 4 \\
+        --duration 120 --json load.json --html load.html
+
+Or let it start gunicorn itself, on a throwaway SQLite database or on a
+local Postgres (migrated in place):
+
+    python loadtest/simulate.py --spawn asgi --workers 2 --duration 60
+    python loadtest/simulate.py --spawn wsgi --database-url postgres://localhost/pulmoscan_load
+
+With --baseline, the run is compared with an earlier JSON report and the
+exit status is 1 if any endpoint's p95 latency or error rate regressed.
+Only the standard library (plus numpy/Pillow for the X-rays) is needed.
+"""
+import argparse
+import html
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from common import Server, fetch, multipart, obtain_tokens, percentiles, synthetic_xray, token_expiry
+
+# Renew the access token this long before it expires
+REFRESH_MARGIN_SECONDS = 2
+# Stock given to each seeded medicine, so sales do not run dry
+SEED_QUANTITY = 1_000_000
+FIRST_NAMES = ('Asha', 'Ravi', 'Meera', 'Arjun', 'Lena', 'Omar', 'Sara', 'Yusuf', 'Nina', 'Karan')
+LAST_NAMES = ('Patel', 'Iyer', 'Khan', 'Singh', 'Das', 'Rao', 'Fernandes', 'Menon', 'Gupta', 'Shah')
+
+# (action, weight) per role; see VirtualUser.<action>
+DOCTOR_MIX = (('dashboard', 4), ('search', 3), ('detail', 2), ('upload', 1))
+PHARMACIST_MIX = (('stock_dashboard', 4), ('alerts', 2), ('sale', 3), ('restock', 1))
+
+
+class Recorder:
+    """
+    Latency and status of every request, grouped by endpoint label, plus
+    per-second totals for the timeline.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = defaultdict(int)
+        self.timeline = defaultdict(lambda: [0, 0])  # second -> [requests, errors]
+        self._lock = threading.Lock()
+
+    def record(self, label, status, elapsed, expected):
+        ok = status in expected
+        second = int(time.monotonic() - self.started)
+        with self._lock:
+            self.statuses[label][str(status)] += 1
+            self.timeline[second][0] += 1
+            if ok:
+                self.latencies[label].append(elapsed)
+            else:
+                self.errors[label] += 1
+                self.timeline[second][1] += 1
+        return ok
+
+    def report(self, duration):
+        endpoints = {}
+        for label in sorted(self.statuses):
+            count = sum(self.statuses[label].values())
+            endpoints[label] = {
+                **percentiles(self.latencies[label]),
+                'count': count,
+                'errors': self.errors[label],
+                'error_rate': round(self.errors[label] / count, 4),
+                'throughput_rps': round(count / duration, 2),
+                'statuses': dict(self.statuses[label]),
+            }
+        requests = sum(e['count'] for e in endpoints.values())
+        errors = sum(e['errors'] for e in endpoints.values())
+        return {
+            'totals': {
+                'requests': requests,
+                'errors': errors,
+                'error_rate': round(errors / requests, 4) if requests else 0.0,
+                'throughput_rps': round(requests / duration, 2),
+            },
+            'endpoints': endpoints,
+            'timeline': [
+                {'second': second, 'requests': counts[0], 'errors': counts[1]}
+                for second, counts in sorted(self.timeline.items())
+            ],
+        }
+
+
+class VirtualUser(threading.Thread):
+    """
+    One simulated doctor or pharmacist session.
+    """
+
+    def __init__(self, run, role, username, password):
+        super().__init__(daemon=True)
+        self.run_state = run
+        self.role = role
+        self.username = username
+        self.password = password
+        self.rng = random.Random()
+        self.access = self.refresh = None
+        self.refresh_at = 0
+        self.etags = {}
+        self.scan_ids = []
+        mix = DOCTOR_MIX if role == 'doctor' else PHARMACIST_MIX
+        self.actions = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+
+    # --- HTTP ---
+    def call(self, label, method, path, body=None, content_type=None, expected=(200,), headers=None, token=True):
+        status, elapsed, payload, response_headers = fetch(
+            self.run_state.base_url, method, path, self.access if token else None, body, content_type, headers,
+        )
+        self.run_state.recorder.record(label, status, elapsed, expected)
+        try:
+            data = json.loads(payload) if payload else None
+        except ValueError:
+            data = None
+        return status, data, response_headers
+
+    def poll(self, label, path):
+        # Browser-style revalidation: 304 while nothing changed
+        headers = {'If-None-Match': self.etags[path]} if path in self.etags else None
+        status, _, response_headers = self.call(label, 'GET', path, expected=(200, 304), headers=headers)
+        if status == 200 and response_headers.get('ETag'):
+            self.etags[path] = response_headers['ETag']
+
+    def login(self):
+        body = json.dumps({'username': self.username, 'password': self.password}).encode()
+        status, data, _ = self.call('POST token', 'POST', '/api/auth/token/', body, 'application/json', token=False)
+        if status != 200:
+            return False
+        self.set_tokens(data['access'], data['refresh'])
+        return True
+
+    def set_tokens(self, access, refresh):
+        self.access, self.refresh = access, refresh
+        self.refresh_at = token_expiry(access) - REFRESH_MARGIN_SECONDS
+
+    def renew(self):
+        body = json.dumps({'refresh': self.refresh}).encode()
+        status, data, _ = self.call('POST token/refresh', 'POST', '/api/auth/token/refresh/', body, 'application/json', token=False)
+        if status == 200:
+            # Refresh tokens rotate; the old one is blacklisted
+            self.set_tokens(data['access'], data.get('refresh', self.refresh))
+        else:
+            self.login()
+
+    # --- Doctor actions ---
+    def dashboard(self):
+        self.poll('GET dashboard/doctor-summary', '/api/dashboard/doctor-summary/')
+
+    def search(self):
+        self.call('GET scan-reports?patient_name', 'GET', f'/api/scan-reports/?patient_name={self.rng.choice(LAST_NAMES)}')
+
+    def detail(self):
+        if not self.scan_ids:
+            return self.dashboard()
+        self.call('GET scan-reports/{id}', 'GET', f'/api/scan-reports/{self.rng.choice(self.scan_ids)}/')
+
+    def upload(self):
+        # Bytes after the PNG end chunk change the content hash (so no
+        # deduplication) but not the decoded image
+        image = self.rng.choice(self.run_state.images) + uuid.uuid4().bytes
+        patient = f'{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}'
+        body, content_type = multipart({'patient_name': patient}, {'scan_image': ('xray.png', image, 'image/png')})
+        status, data, _ = self.call('POST scan-reports', 'POST', '/api/scan-reports/', body, content_type, expected=(201,))
+        if status == 201 and data:
+            self.scan_ids.append(data['id'])
+
+    # --- Pharmacist actions ---
+    def stock_dashboard(self):
+        self.poll('GET dashboard/stock-summary', '/api/dashboard/stock-summary/')
+
+    def alerts(self):
+        self.poll('GET medicines/alerts', '/api/medicines/alerts/')
+
+    def sale(self):
+        name, _ = self.rng.choice(self.run_state.medicines)
+        body = json.dumps({'name': name, 'quantity': self.rng.randint(1, 5)}).encode()
+        self.call('POST inventory-transactions/fefo-sale', 'POST', '/api/inventory-transactions/fefo-sale/', body, 'application/json', expected=(201,))
+
+    def restock(self):
+        _, medicine_id = self.rng.choice(self.run_state.medicines)
+        body = json.dumps({'medicine': medicine_id, 'transaction_type': 'purchase', 'quantity': self.rng.randint(10, 50)}).encode()
+        self.call('POST inventory-transactions', 'POST', '/api/inventory-transactions/', body, 'application/json', expected=(201,))
+
+    def run(self):
+        stop = self.run_state.stop
+        while not stop.is_set() and not self.login():
+            stop.wait(1)
+        while not stop.is_set():
+            if time.time() >= self.refresh_at:
+                self.renew()
+            getattr(self, self.rng.choices(self.actions, self.weights)[0])()
+            stop.wait(self.rng.expovariate(1 / self.run_state.think_time))
+
+
+class LoadRun:
+    def __init__(self, base_url, options):
+        self.base_url = base_url
+        self.options = options
+        self.think_time = options.think
+        self.stop = threading.Event()
+        self.recorder = Recorder()
+        self.images = []
+        self.medicines = []  # (name, id)
+
+    def seed(self):
+        access, _ = obtain_tokens(self.base_url, *self.options.pharmacist.split(':', 1))
+        run_id = uuid.uuid4().hex[:8]
+        for i in range(self.options.medicines):
+            name = f'Load Medicine {i:03d}'
+            body = json.dumps({
+                'name': name, 'batch_number': f'LOAD-{run_id}-{i:03d}',
+                'expiry_date': (date.today() + timedelta(days=365)).isoformat(),
+                'quantity': SEED_QUANTITY, 'price': '12.50', 'supplier': 'Load Test Pharma',
+            }).encode()
+            status, _, payload, _ = fetch(self.base_url, 'POST', '/api/medicines/', access, body, 'application/json')
+            if status != 201:
+                raise RuntimeError(f'Could not seed medicines: HTTP {status} {payload[:200]!r}')
+            self.medicines.append((name, json.loads(payload)['id']))
+        if self.options.doctors:
+            self.images = [synthetic_xray(self.options.image_size) for _ in range(4)]
+
+    def execute(self):
+        self.seed()
+        users = [
+            VirtualUser(self, 'doctor', *self.options.doctor.split(':', 1)) for _ in range(self.options.doctors)
+        ] + [
+            VirtualUser(self, 'pharmacist', *self.options.pharmacist.split(':', 1)) for _ in range(self.options.pharmacists)
+        ]
+        random.shuffle(users)
+        started_at = datetime.now(timezone.utc)
+        self.recorder = Recorder()
+        for index, user in enumerate(users):
+            # Spread logins over the ramp-up instead of one burst
+            if self.options.ramp and index:
+                time.sleep(self.options.ramp / len(users))
+            user.start()
+        remaining = self.options.duration - (time.monotonic() - self.recorder.started)
+        if remaining > 0:
+            time.sleep(remaining)
+        self.stop.set()
+        for user in users:
+            user.join(timeout=300)
+        duration = time.monotonic() - self.recorder.started
+        return {
+            'target': self.base_url,
+            'started_at': started_at.isoformat(),
+            'duration_s': round(duration, 1),
+            'users': {'doctors': self.options.doctors, 'pharmacists': self.options.pharmacists},
+            'think_time_s': self.think_time,
+            **self.recorder.report(duration),
+        }
+
+
+# --- Reports ---
+def compare(report, baseline, tolerance):
+    """
+    Regressions of `report` against `baseline`: endpoints whose p95 grew by
+    more than `tolerance` (a fraction) or whose error rate rose by more than
+    one percentage point.
+    """
+    regressions = []
+    for label, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(label)
+        if not previous:
+            continue
+        if previous.get('p95_ms') and current.get('p95_ms', 0) > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if current['error_rate'] > previous['error_rate'] + 0.01:
+            regressions.append(f"{label}: error rate {previous['error_rate']:.2%} -> {current['error_rate']:.2%}")
+    return regressions
+
+
+def render_html(report):
+    columns = ('count', 'throughput_rps', 'error_rate', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    rows = ''.join(
+        '<tr><td>{}</td>{}<td>{}</td></tr>'.format(
+            html.escape(label),
+            ''.join(
+                f"<td>{stats.get(column, '')}</td>" if column != 'error_rate' else f"<td>{stats['error_rate']:.2%}</td>"
+                for column in columns
+            ),
+            html.escape(', '.join(f'{status}: {n}' for status, n in sorted(stats['statuses'].items()))),
+        )
+        for label, stats in report['endpoints'].items()
+    )
+    timeline = report['timeline']
+    peak = max((point['requests'] for point in timeline), default=1) or 1
+    width = max(len(timeline), 1) * 6
+    bars = ''.join(
+        f'<rect x="{point["second"] * 6}" y="{100 - 100 * point["requests"] / peak:.1f}" width="5" '
+        f'height="{100 * point["requests"] / peak:.1f}" fill="#4a90d9"><title>{point["second"]} s: '
+        f'{point["requests"]} requests, {point["errors"]} errors</title></rect>'
+        + (f'<rect x="{point["second"] * 6}" y="{100 - 100 * point["errors"] / peak:.1f}" width="5" '
+           f'height="{100 * point["errors"] / peak:.1f}" fill="#d9534f"/>' if point['errors'] else '')
+        for point in timeline
+    )
+    totals = report['totals']
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>PulmoScan load test</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; color: #222; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 10px; text-align: right; }}
+th:first-child, td:first-child, td:last-child {{ text-align: left; }}
+</style></head><body>
+<h1>PulmoScan load test</h1>
+<p>{html.escape(report['target'])}, started {html.escape(report['started_at'])}, {report['duration_s']} s,
+{report['users']['doctors']} doctors and {report['users']['pharmacists']} pharmacists
+(think time {report['think_time_s']} s).</p>
+<p><b>{totals['requests']}</b> requests, <b>{totals['throughput_rps']}</b> req/s,
+error rate <b>{totals['error_rate']:.2%}</b>.</p>
+<table><tr><th>Endpoint</th><th>Requests</th><th>req/s</th><th>Errors</th><th>p50 ms</th><th>p95 ms</th>
+<th>p99 ms</th><th>max ms</th><th>Statuses</th></tr>{rows}</table>
+<h2>Requests per second</h2>
+<svg width="{width}" height="100" style="border-bottom: 1px solid #999">{bars}</svg>
+</body></html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--url', help='Base URL of a running server, e.g. http://127.0.0.1:8000')
+    target.add_argument('--spawn', choices=('wsgi', 'asgi'), help='Start gunicorn in this mode for the run.')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers with --spawn.')
+    parser.add_argument('--database-url', help='Database for --spawn (default: a throwaway SQLite file).')
+    parser.add_argument('--doctors', type=int, default=4, help='Concurrent doctor sessions.')
+    parser.add_argument('--pharmacists', type=int, default=2, help='Concurrent pharmacist sessions.')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of load, ramp-up included.')
+    parser.add_argument('--ramp', type=float, default=5, help='Seconds over which sessions start.')
+    parser.add_argument('--think', type=float, default=1.0, help='Mean pause between actions, in seconds.')
+    parser.add_argument('--medicines', type=int, default=20, help='Medicines seeded for sales.')
+    parser.add_argument('--image-size', type=int, default=1024, help='Side of the synthetic X-rays, in pixels.')
+    parser.add_argument('--doctor', default='doctoruser:doctorpass', help='Doctor credentials, user:password.')
+    parser.add_argument('--pharmacist', default='pharmacistuser:pharmacistpass', help='Pharmacist credentials, user:password.')
+    parser.add_argument('--json', help='Write the JSON report here (default: stdout).')
+    parser.add_argument('--html', help='Also write an HTML report here.')
+    parser.add_argument('--baseline', help='Earlier JSON report to check for regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth against --baseline.')
+    options = parser.parse_args()
+
+    if options.spawn:
+        with Server(options.spawn, options.database_url, options.workers) as server:
+            report = LoadRun(server.base_url, options).execute()
+        report['server'] = {'mode': options.spawn, 'workers': options.workers}
+    else:
+        report = LoadRun(options.url.rstrip('/'), options).execute()
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if options.html:
+        with open(options.html, 'w') as f:
+            f.write(render_html(report))
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(report, json.load(f), options.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
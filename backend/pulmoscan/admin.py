@@ -1,10 +1,162 @@
+import io
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+
+from .imaging import ScanImageError, load_scan_image
+from .inventory import record_opening_stock
 from .models import *
-# Register your models here.
-admin.site.register(UserProfile)
-admin.site.register(Medicine)
-admin.site.register(InventoryTransaction)
-admin.site.register(ScanReport)
 
+# Side of the scan thumbnails in the admin
+THUMBNAIL_SIZE = 96
+# Below this many rows the exact count is cheap enough to run
+ESTIMATE_COUNT_ABOVE = 100_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for very large tables. An unfiltered changelist on
+    PostgreSQL takes its total from the planner statistics (pg_class.reltuples,
+    kept fresh by autovacuum/ANALYZE) instead of a COUNT(*) that reads the
+    whole table; filtered lists and other databases count exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [connection.ops.quote_name(queryset.model._meta.db_table)],
+                )
+                row = cursor.fetchone()
+            if row and row[0] > ESTIMATE_COUNT_ABOVE:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Defaults for tables with millions of rows: estimated totals and no
+    second full-table count for the "x of y selected" line. Subclasses
+    also show foreign keys as raw id inputs (`raw_id_fields`) rather than
+    <select>s listing every row.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class DiagnosisFilter(admin.SimpleListFilter):
+    # Fixed choices: the default filter for a free-text field would run
+    # SELECT DISTINCT over the whole table on every page load
+    title = 'diagnosis'
+    parameter_name = 'diagnosis'
+
+    def lookups(self, request, model_admin):
+        return (('Normal', 'Normal'), ('Pneumonia', 'Pneumonia'), ('failed', 'Analysis failed'))
+
+    def queryset(self, request, queryset):
+        if self.value() == 'failed':
+            return queryset.filter(diagnosis__startswith='Analysis Failed')
+        if self.value():
+            return queryset.filter(diagnosis=self.value())
+        return queryset
+
+
+@admin.register(ScanReport)
+class ScanReportAdmin(LargeTableAdmin):
+    list_display = ('id', 'thumbnail', 'patient_name', 'diagnosis', 'confidence', 'confirmed_diagnosis', 'date_uploaded', 'user')
+    list_display_links = ('id', 'patient_name')
+    list_filter = (DiagnosisFilter, 'confirmed_diagnosis')
+    list_select_related = ('user',)
+    date_hierarchy = 'date_uploaded'
+    ordering = ('-date_uploaded',)
+    search_fields = ('^patient_name',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('preview', 'normal_logit', 'pneumonia_logit', 'date_uploaded')
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/thumbnail/', self.admin_site.admin_view(self.thumbnail_view, cacheable=True),
+                 name='pulmoscan_scanreport_thumbnail'),
+        ] + super().get_urls()
+
+    def thumbnail_url(self, obj):
+        # The content-addressed file name changes with the image, so the
+        # thumbnail can be cached for good under a URL carrying it
+        url = reverse('admin:pulmoscan_scanreport_thumbnail', args=[obj.pk])
+        return f"{url}?v={obj.scan_image.name.rsplit('/', 1)[-1][:16]}"
+
+    @admin.display(description='Scan')
+    def thumbnail(self, obj):
+        if not obj.scan_image:
+            return '-'
+        return format_html('<img src="{}" width="{}" height="{}" loading="lazy" style="object-fit: contain;">',
+                           self.thumbnail_url(obj), THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+
+    @admin.display(description='Preview')
+    def preview(self, obj):
+        if not obj.pk or not obj.scan_image:
+            return '-'
+        return format_html('<img src="{}" style="max-width: 400px;">', self.thumbnail_url(obj) + '&size=400')
+
+    def thumbnail_view(self, request, pk):
+        """
+        Small JPEG of a scan, decoded at reduced scale (see
+        load_scan_image), so a changelist page does not pull a hundred
+        full-resolution radiographs.
+        """
+        if not self.has_view_permission(request):
+            raise Http404
+        report = get_object_or_404(ScanReport.objects.only('scan_image'), pk=pk)
+        size = 400 if request.GET.get('size') == '400' else THUMBNAIL_SIZE
+        try:
+            image = load_scan_image(report.scan_image.path, size=size)
+        except (OSError, ScanImageError):
+            raise Http404
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=80)
+        response = HttpResponse(buffer.getvalue(), content_type='image/jpeg')
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+
+@admin.register(InventoryTransaction)
+class InventoryTransactionAdmin(LargeTableAdmin):
+    list_display = ('id', 'date', 'transaction_type', 'medicine', 'quantity', 'user')
+    list_filter = ('transaction_type',)
+    # __str__ reads medicine.name: joined here instead of one query per row
+    list_select_related = ('medicine', 'user')
+    date_hierarchy = 'date'
+    ordering = ('-date',)
+    raw_id_fields = ('medicine', 'user')
+
+
+@admin.register(Medicine)
+class MedicineAdmin(LargeTableAdmin):
+    list_display = ('name', 'batch_number', 'expiry_date', 'quantity', 'price', 'supplier')
+    ordering = ('name', 'expiry_date')
+    search_fields = ('^name', '=batch_number')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            record_opening_stock(obj, user=request.user)
 
 
+@admin.register(UserProfile)
+class UserProfileAdmin(admin.ModelAdmin):
+    list_display = ('user', 'role')
+    list_filter = ('role',)
+    list_select_related = ('user',)
+    search_fields = ('^user__username',)
+    raw_id_fields = ('user',)
@@ -0,0 +1,222 @@
+# pulmoscan/admission.py
+import asyncio
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+LANES = ('urgent', 'routine')
+# Share of the waiting queue routine uploads may fill, so an urgent scan
+# still finds room during a routine burst
+ROUTINE_QUEUE_SHARE = 0.75
+# Weight of the newest sample in the moving average of analysis time
+SERVICE_TIME_SMOOTHING = 0.2
+MAX_RETRY_AFTER = 120
+
+
+class Overloaded(APIException):
+    """
+    503 with Retry-After (DRF's exception handler sends `wait` as the
+    header) when a scan cannot be admitted for analysis.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Scan analysis is at capacity. Please retry shortly.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait, detail=None):
+        super().__init__(detail)
+        self.wait = wait
+
+
+class _Waiter:
+    __slots__ = ('lane', 'wake', 'granted')
+
+    def __init__(self, lane, wake):
+        self.lane = lane
+        self.wake = wake
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Bounds how many scans one worker process analyses at once.
+
+    Up to `capacity` uploads run; the next `queue_limit` wait, urgent ones
+    ahead of routine ones, and anything beyond is turned away at once with
+    Overloaded instead of queueing until the client gives up. A waiter
+    that is not admitted within `queue_timeout` seconds is turned away
+    too. Both sync views (threads) and the ASGI view (coroutines) wait on
+    the same queue.
+    """
+
+    def __init__(self, capacity, queue_limit, queue_timeout):
+        self.capacity = max(1, capacity)
+        self.queue_limit = max(0, queue_limit)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queues = {lane: deque() for lane in LANES}
+        self._service_time = None
+        self._admitted = {lane: 0 for lane in LANES}
+        self._rejected = {'queue_full': 0, 'timeout': 0, 'throttled': 0}
+
+    # --- Queueing ---
+    def _enter(self, lane, wake):
+        # None when admitted at once, else the queued waiter
+        with self._lock:
+            if self._running < self.capacity and not any(self._queues.values()):
+                self._running += 1
+                self._admitted[lane] += 1
+                return None
+            waiting = sum(len(queue) for queue in self._queues.values())
+            limit = self.queue_limit if lane == 'urgent' else math.floor(self.queue_limit * ROUTINE_QUEUE_SHARE)
+            if waiting >= limit:
+                self._rejected['queue_full'] += 1
+                raise Overloaded(self._retry_after(waiting))
+            waiter = _Waiter(lane, wake)
+            self._queues[lane].append(waiter)
+            return waiter
+
+    def _abandon(self, waiter):
+        # Gives up on a waiter; False if it had been admitted meanwhile
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queues[waiter.lane].remove(waiter)
+            self._rejected['timeout'] += 1
+        return True
+
+    def _release(self, elapsed):
+        with self._lock:
+            if self._service_time is None:
+                self._service_time = elapsed
+            else:
+                self._service_time += SERVICE_TIME_SMOOTHING * (elapsed - self._service_time)
+            for lane in LANES:
+                if self._queues[lane]:
+                    waiter = self._queues[lane].popleft()
+                    waiter.granted = True
+                    self._admitted[lane] += 1
+                    break
+            else:
+                self._running -= 1
+                return
+        # The slot passes straight to the waiter
+        waiter.wake()
+
+    def _retry_after(self, waiting):
+        # Time for everything ahead to drain, from the average analysis time
+        per_scan = self._service_time or 1.0
+        return min(MAX_RETRY_AFTER, max(1, math.ceil(per_scan * (self._running + waiting + 1) / self.capacity)))
+
+    # --- Admission ---
+    @contextlib.contextmanager
+    def admit(self, lane):
+        event = threading.Event()
+        waiter = self._enter(lane, event.set)
+        if waiter is not None and not event.wait(self.queue_timeout) and self._abandon(waiter):
+            raise Overloaded(self._retry_after(self.queue_limit))
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    @contextlib.asynccontextmanager
+    async def admit_async(self, lane):
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+        waiter = self._enter(lane, lambda: loop.call_soon_threadsafe(_resolve, admitted))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(admitted), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    raise Overloaded(self._retry_after(self.queue_limit))
+            except asyncio.CancelledError:
+                # Client went away while queued: hand on the slot if we got one
+                if not self._abandon(waiter):
+                    self._release(0.0)
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def record_throttled(self):
+        with self._lock:
+            self._rejected['throttled'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'capacity': self.capacity,
+                'running': self._running,
+                'queued': {lane: len(queue) for lane, queue in self._queues.items()},
+                'queue_limit': self.queue_limit,
+                'admitted': dict(self._admitted),
+                'rejected': dict(self._rejected),
+                'average_analysis_seconds': None if self._service_time is None else round(self._service_time, 3),
+            }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+controller = AdmissionController(
+    settings.SCAN_ANALYSIS_CONCURRENCY, settings.SCAN_QUEUE_LIMIT, settings.SCAN_QUEUE_TIMEOUT,
+)
+
+
+def upload_lane(request):
+    """
+    Lane of a scan upload from `?priority=urgent|routine` (routine by
+    default). Read from the query string so it is known before the body.
+    """
+    lane = request.query_params.get('priority', 'routine')
+    if lane not in LANES:
+        raise serializers.ValidationError({'priority': f"Must be one of: {', '.join(LANES)}."})
+    return lane
+
+
+# --- Per-user quota ---
+class ScanUploadThrottle(BaseThrottle):
+    """
+    Token bucket per user: SCAN_UPLOAD_BURST uploads at once, refilled at
+    SCAN_UPLOAD_RATE per minute, so one bulk uploader cannot take every
+    analysis slot. Buckets live in the worker process, like the admission
+    queue they protect. A rate of 0 disables the quota.
+    """
+    _buckets = {}
+    _lock = threading.Lock()
+
+    def allow_request(self, request, view):
+        rate = settings.SCAN_UPLOAD_RATE / 60.0
+        burst = settings.SCAN_UPLOAD_BURST
+        if rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(request.user.pk, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[request.user.pk] = (tokens - 1, now)
+                return True
+            self._buckets[request.user.pk] = (tokens, now)
+        self._wait = (1 - tokens) / rate
+        controller.record_throttled()
+        return False
+
+    def wait(self):
+        return self._wait
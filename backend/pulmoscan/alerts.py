@@ -0,0 +1,99 @@
+# pulmoscan/alerts.py
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .conditional import bump_versions
+from .events import publish_event
+from .models import Medicine, MedicineAlert
+
+# Single source of truth for both /api/medicines/alerts/ and the stock dashboard
+LOW_STOCK_THRESHOLD = 10  # a batch is low on stock at or below this quantity
+EXPIRY_WARNING_DAYS = 30
+
+# Keeps IN (...) lists well under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def alert_kinds(quantity, expiry_date, today):
+    """
+    The set of MedicineAlert kinds that apply to a batch on `today`.
+    """
+    kinds = set()
+    if quantity <= LOW_STOCK_THRESHOLD:
+        kinds.add('low_stock')
+    if expiry_date < today:
+        kinds.add('expired')
+    elif expiry_date <= today + timedelta(days=EXPIRY_WARNING_DAYS):
+        kinds.add('expiring_soon')
+    return kinds
+
+
+def refresh_alerts(medicine_ids=None):
+    """
+    Brings MedicineAlert rows in line with the current quantity and expiry
+    of the given medicines, or of every medicine when `medicine_ids` is None
+    (the daily sweep). Only the difference is written: stale alerts are
+    deleted and missing ones inserted. Returns True if anything changed.
+    """
+    today = date.today()
+    medicines = Medicine.objects.all()
+    existing_alerts = MedicineAlert.objects.all()
+    if medicine_ids is not None:
+        medicine_ids = list(medicine_ids)
+        medicines = medicines.filter(id__in=medicine_ids)
+        existing_alerts = existing_alerts.filter(medicine_id__in=medicine_ids)
+
+    with transaction.atomic():
+        wanted = {
+            (medicine_id, kind)
+            for medicine_id, quantity, expiry_date in medicines.values_list('id', 'quantity', 'expiry_date').iterator()
+            for kind in alert_kinds(quantity, expiry_date, today)
+        }
+        existing = set(existing_alerts.values_list('medicine_id', 'kind'))
+
+        stale = {}
+        for medicine_id, kind in existing - wanted:
+            stale.setdefault(kind, []).append(medicine_id)
+        for kind, ids in stale.items():
+            for i in range(0, len(ids), CHUNK_SIZE):
+                MedicineAlert.objects.filter(kind=kind, medicine_id__in=ids[i:i + CHUNK_SIZE]).delete()
+
+        MedicineAlert.objects.bulk_create(
+            [MedicineAlert(medicine_id=medicine_id, kind=kind) for medicine_id, kind in wanted - existing],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+        changed = wanted != existing
+        if changed:
+            bump_versions('medicines')
+            publish_event('alerts', **alert_counts())
+    return changed
+
+
+def alert_counts():
+    """
+    {kind: number of active alerts}, the figures on the stock dashboard.
+    """
+    counts = {kind: 0 for kind, _ in MedicineAlert.KIND_CHOICES}
+    counts.update(MedicineAlert.objects.order_by().values_list('kind').annotate(Count('id')))
+    return counts
+
+
+def current_alerts(serializer):
+    """
+    Every active alert with its medicine, in one query, grouped as
+    {kind: [row, ...]} where rows come from `serializer`, a
+    MedicineReadSerializer.
+    """
+    grouped = {kind: [] for kind, _ in MedicineAlert.KIND_CHOICES}
+    medicines = (
+        Medicine.objects.filter(alerts__isnull=False)
+        .annotate(alert_kind=F('alerts__kind'))
+        .order_by('expiry_date', 'id')
+    )
+    for row in serializer.serialize(medicines, extra=('alert_kind',)):
+        grouped[row.pop('alert_kind')].append(row)
+    return grouped
@@ -0,0 +1,143 @@
+# pulmoscan/analytics.py
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import CharField, Sum
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
+
+from .conditional import bump_versions
+from .models import DailyConsumption, InventoryTransaction, Medicine, RollupCheckpoint
+
+CONSUMPTION_CHECKPOINT = 'daily_consumption'
+# Each rollup re-reads sales from this long before the previous run: a
+# sale's `date` is set when its row is created, and its transaction may
+# commit only after a rollup has already covered that moment.
+ROLLUP_SAFETY_LAG = timedelta(days=1)
+
+# Forecast defaults, overridable per request on /api/dashboard/stock-forecast/
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_LEAD_TIME_DAYS = 7
+DEFAULT_REVIEW_PERIOD_DAYS = 7
+SERVICE_LEVEL_Z = 1.65  # ~95% cycle service level
+
+
+def rollup_consumption(now=None):
+    """
+    Brings DailyConsumption up to date with the sales ledger.
+
+    Each run recomputes whole days, from the day ROLLUP_SAFETY_LAG before the
+    previous run onwards (everything on the first run), grouped per
+    (medicine, day) in the database, and replaces the rollup rows for those
+    days when they differ. Totals are recomputed rather than added onto, so a
+    sale that commits after a run already covered its day is counted by the
+    next run, and repeating a run changes nothing. The checkpoint row is
+    locked for the run, so concurrent rollups queue. Returns the number of
+    (medicine, day) rows recomputed.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        RollupCheckpoint.objects.get_or_create(name=CONSUMPTION_CHECKPOINT)
+        checkpoint = RollupCheckpoint.objects.select_for_update().get(name=CONSUMPTION_CHECKPOINT)
+        sales = InventoryTransaction.objects.filter(transaction_type='sale')
+        rollup = DailyConsumption.objects.all()
+        if checkpoint.rolled_up_until is not None:
+            since = timezone.localdate(checkpoint.rolled_up_until - ROLLUP_SAFETY_LAG)
+            sales = sales.filter(date__gte=datetime.combine(since, time.min, tzinfo=timezone.get_current_timezone()))
+            rollup = rollup.filter(day__gte=since)
+
+        totals = set(
+            sales.annotate(day=TruncDate('date'))
+            .order_by()
+            .values('medicine_id', 'day')
+            .annotate(total=Sum('quantity'))
+            .values_list('medicine_id', 'day', 'total')
+        )
+        if totals != set(rollup.values_list('medicine_id', 'day', 'quantity')):
+            rollup.delete()
+            DailyConsumption.objects.bulk_create(
+                [DailyConsumption(medicine_id=medicine_id, day=day, quantity=total) for medicine_id, day, total in totals],
+                batch_size=1000,
+            )
+            bump_versions('consumption')
+        checkpoint.rolled_up_until = now
+        checkpoint.save(update_fields=['rolled_up_until', 'updated_at'])
+    return len(totals)
+
+
+def stock_forecast(window_days=DEFAULT_WINDOW_DAYS, lead_time_days=DEFAULT_LEAD_TIME_DAYS,
+                   review_period_days=DEFAULT_REVIEW_PERIOD_DAYS, today=None):
+    """
+    Consumption statistics and reorder suggestions per medicine name.
+
+    Batches are grouped by name, sales over the last `window_days` complete
+    days are loaded from the rollup as three flat columns and scattered
+    into a (medicines x days) matrix, and every statistic is then a
+    whole-matrix NumPy reduction, so the cost is one query plus a few
+    array passes regardless of how many SKUs there are.
+
+    Only non-expired stock counts towards cover. Results are sorted with
+    the least days of cover first. Sales are read as of the last
+    `manage.py rollup_consumption` run; this never writes.
+    """
+    today = today or date.today()
+    start = today - timedelta(days=window_days)
+
+    batches = list(Medicine.objects.values_list('id', 'name', 'quantity', 'expiry_date'))
+    if not batches:
+        return []
+    names = sorted({batch[1] for batch in batches})
+    name_index = {name: i for i, name in enumerate(names)}
+
+    batch_ids = np.array([batch[0] for batch in batches], dtype=np.int64)
+    batch_product = np.array([name_index[batch[1]] for batch in batches], dtype=np.int64)
+    usable = np.array([batch[2] if batch[3] >= today else 0 for batch in batches], dtype=np.float64)
+    order = np.argsort(batch_ids)
+    batch_ids, batch_product = batch_ids[order], batch_product[order]
+
+    stock = np.bincount(batch_product, weights=usable[order], minlength=len(names))
+
+    # The day comes back as ISO text so NumPy parses the whole column at
+    # once instead of the driver building one date object per row.
+    rows = list(
+        DailyConsumption.objects.filter(day__gte=start, day__lt=today)
+        .annotate(day_iso=Cast('day', output_field=CharField()))
+        .values_list('medicine_id', 'day_iso', 'quantity')
+    )
+    consumption = np.zeros((len(names), window_days), dtype=np.float64)
+    if rows:
+        medicine_ids, days, quantities = zip(*rows)
+        product = batch_product[np.searchsorted(batch_ids, np.array(medicine_ids, dtype=np.int64))]
+        offset = (np.array(days, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+        np.add.at(consumption, (product, offset), np.array(quantities, dtype=np.float64))
+
+    avg_7 = consumption[:, -7:].mean(axis=1)
+    avg_28 = consumption[:, -28:].mean(axis=1)
+    avg_window = consumption.mean(axis=1)
+    daily_std = consumption.std(axis=1)
+
+    # Recent demand drives the forecast; the long window only feeds the variability.
+    rate = avg_28
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(rate > 0, stock / rate, np.inf)
+    safety_stock = SERVICE_LEVEL_Z * daily_std * np.sqrt(lead_time_days)
+    reorder_point = rate * lead_time_days + safety_stock
+    order_up_to = rate * (lead_time_days + review_period_days) + safety_stock
+    reorder_quantity = np.where(stock <= reorder_point, np.ceil(np.maximum(order_up_to - stock, 0)), 0)
+
+    results = [
+        {
+            'name': name,
+            'stock': int(stock[i]),
+            'avg_daily_7d': round(float(avg_7[i]), 2),
+            'avg_daily_28d': round(float(avg_28[i]), 2),
+            'avg_daily_window': round(float(avg_window[i]), 2),
+            'days_of_cover': None if np.isinf(days_of_cover[i]) else round(float(days_of_cover[i]), 1),
+            'reorder_point': int(np.ceil(reorder_point[i])),
+            'reorder_quantity': int(reorder_quantity[i]),
+        }
+        for i, name in enumerate(names)
+    ]
+    results.sort(key=lambda row: (row['days_of_cover'] is None, row['days_of_cover'] or 0))
+    return results
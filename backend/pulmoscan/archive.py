@@ -0,0 +1,217 @@
+# pulmoscan/archive.py
+import hashlib
+import json
+import lzma
+import os
+import posixpath
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .models import ArchivedScanReport, ColdBlob, ScanReport
+
+# Models living in the archive database (see ArchiveRouter)
+ARCHIVE_MODELS = ('archivedscanreport', 'coldblob')
+ARCHIVE_DATABASE = 'archive'
+# xz level for cold storage: -6 is xz's default, -9 mostly costs memory
+COLD_LZMA_PRESET = 6
+PACK_FORMAT = 1
+
+
+# --- Archive database ---
+def archive_database():
+    """
+    Alias holding ArchivedScanReport and ColdBlob: `archive` when
+    configured (the separate SQLite file), else the default database.
+    """
+    return ARCHIVE_DATABASE if ARCHIVE_DATABASE in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+class ArchiveRouter:
+    """
+    Routes the archive models to archive_database() and keeps every other
+    table out of the `archive` database. Migrate it with
+    `manage.py migrate --database archive`.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'pulmoscan' and model._meta.model_name in ARCHIVE_MODELS:
+            return archive_database()
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if archive_database() == DEFAULT_DB_ALIAS:
+            return None
+        archive_model = app_label == 'pulmoscan' and model_name in ARCHIVE_MODELS
+        return archive_model if db == ARCHIVE_DATABASE else not archive_model
+
+
+def archive_available():
+    """
+    Whether archived data can exist. Never creates a missing SQLite
+    archive file just to find it empty.
+    """
+    alias = archive_database()
+    if alias == DEFAULT_DB_ALIAS or connections[alias].vendor != 'sqlite':
+        return True
+    return connections[alias].is_in_memory_db() or os.path.exists(settings.DATABASES[alias]['NAME'])
+
+
+def archive_ready():
+    alias = archive_database()
+    return archive_available() and ArchivedScanReport._meta.db_table in connections[alias].introspection.table_names()
+
+
+def ensure_partitions(dates):
+    """
+    PostgreSQL: creates the monthly partitions (UTC months) the given
+    upload dates fall in, e.g. pulmoscan_scanreport_archive_y2024m03.
+    """
+    connection = connections[archive_database()]
+    if connection.vendor != 'postgresql':
+        return
+    table = ArchivedScanReport._meta.db_table
+    months = {(date.astimezone(dt_timezone.utc).year, date.astimezone(dt_timezone.utc).month) for date in dates}
+    with connection.cursor() as cursor:
+        for year, month in sorted(months):
+            start = datetime(year, month, 1, tzinfo=dt_timezone.utc)
+            end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(f"{table}_y{year}m{month:02d}")} '
+                f'PARTITION OF {connection.ops.quote_name(table)} '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+
+
+def archived_fields():
+    # ScanReport attributes that have an ArchivedScanReport column
+    archived = {field.attname for field in ArchivedScanReport._meta.concrete_fields}
+    return [field.attname for field in ScanReport._meta.concrete_fields if field.attname in archived]
+
+
+def copy_to_archive(report_ids, archived_at):
+    """
+    Copies the hot reports to ArchivedScanReport and returns the ids the
+    archive now holds. A copy left by an interrupted run is replaced, so
+    edits made to the hot row since are kept and this can simply be
+    repeated. Run it in a transaction on archive_database().
+    """
+    fields = archived_fields()
+    rows = list(ScanReport.objects.filter(pk__in=report_ids).values(*fields))
+    ArchivedScanReport.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+    ArchivedScanReport.objects.bulk_create([ArchivedScanReport(**row, archived_at=archived_at) for row in rows])
+    return [row['id'] for row in rows]
+
+
+def archived_report(pk):
+    """
+    The archived ScanReport `pk` as an (unsaved) model instance, or None.
+    """
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    if not archive_available():
+        return None
+    row = ArchivedScanReport.objects.filter(pk=pk).values(*archived_fields()).first()
+    return ScanReport(**row) if row else None
+
+
+# --- Cold storage ---
+def pack_entry(storage, name):
+    """
+    Thread pool worker: (name, codec, stored bytes, size), or
+    (name, None, error message, 0). lzma releases the GIL, so threads
+    compress in parallel.
+    """
+    try:
+        with storage.open(name, 'rb') as source:
+            content = source.read()
+    except OSError as e:
+        return name, None, str(e), 0
+    digest = posixpath.basename(name).split('.')[0]
+    if len(digest) == 64 and hashlib.sha256(content).hexdigest() != digest:
+        # Content-addressed names carry their hash: never archive a damaged file
+        return name, None, 'content does not match its name', 0
+    packed = lzma.compress(content, preset=COLD_LZMA_PRESET)
+    if len(packed) < len(content):
+        return name, 'xz', packed, len(content)
+    return name, 'raw', content, len(content)
+
+
+class PackWriter:
+    """
+    Writes one pack file of cold storage: stored files back to back, each
+    xz-compressed (or kept as-is when that is no smaller). `close` fsyncs
+    the pack, moves it into place and writes `<pack>.idx`, a JSON index of
+    offset, stored size, size and codec per file, so a pack can be read
+    without the database. Nothing refers to a pack before it is complete.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = f"pack-{datetime.now(dt_timezone.utc):%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.pack"
+        self.entries = {}
+        os.makedirs(directory, exist_ok=True)
+        self._path = os.path.join(directory, self.name)
+        self._file = open(self._path + '.tmp', 'wb')
+
+    @property
+    def stored_bytes(self):
+        return sum(stored_size for _, stored_size, _, _ in self.entries.values())
+
+    def add(self, name, codec, data, size):
+        self.entries[name] = (self._file.tell(), len(data), size, codec)
+        self._file.write(data)
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._path + '.tmp', self._path)
+        with open(self._path + '.idx.tmp', 'w') as out:
+            json.dump({'format': PACK_FORMAT, 'entries': self.entries}, out)
+        os.replace(self._path + '.idx.tmp', self._path + '.idx')
+
+    def discard(self):
+        self._file.close()
+        os.unlink(self._path + '.tmp')
+
+
+def cold_blob_names(names):
+    """
+    The subset of `names` already held in cold storage.
+    """
+    return set(ColdBlob.objects.filter(name__in=list(names)).values_list('name', flat=True))
+
+
+def record_pack(pack):
+    ColdBlob.objects.bulk_create([
+        ColdBlob(name=name, pack=pack.name, pack_offset=offset, stored_size=stored_size, size=size, codec=codec)
+        for name, (offset, stored_size, size, codec) in pack.entries.items()
+    ], ignore_conflicts=True)
+
+
+def read_cold_blob(name):
+    """
+    Content of the stored file `name` from cold storage, or None if it was
+    never archived. One seek and read in its pack.
+    """
+    if not archive_available():
+        return None
+    row = ColdBlob.objects.filter(name=name).values_list('pack', 'pack_offset', 'stored_size', 'size', 'codec').first()
+    if row is None:
+        return None
+    pack, offset, stored_size, size, codec = row
+    with open(os.path.join(settings.SCAN_COLD_STORAGE_DIR, pack), 'rb') as source:
+        source.seek(offset)
+        data = source.read(stored_size)
+    if codec == 'xz':
+        data = lzma.decompress(data, format=lzma.FORMAT_XZ)
+    if len(data) != size:
+        raise OSError(f'Cold storage entry for {name} in {pack} is damaged.')
+    return data
@@ -0,0 +1,160 @@
+# pulmoscan/async_views.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+
+from .admission import controller as admission, upload_lane
+from .authentication import ClaimsJWTAuthentication
+from .calibration import current_calibration
+from .events import (
+    hub, format_event, read_ticket,
+    KEEPALIVE_SECONDS, RECONNECT_MILLISECONDS, STREAM_MAX_AGE,
+)
+from .permissions import user_role
+from .views import ScanReportViewSet
+
+# Model inference and DICOM decoding run here, never on the event loop nor
+# on the single thread Django uses for sync views and ORM calls under ASGI.
+# Its size bounds how many scans are analysed at once per worker process.
+inference_executor = ThreadPoolExecutor(
+    max_workers=settings.INFERENCE_WORKERS, thread_name_prefix='inference',
+)
+
+_scan_report_collection = ScanReportViewSet.as_view({'get': 'list', 'post': 'create'})
+
+
+async def run_in_inference_executor(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, func, *args)
+
+
+def _validate_upload(view, request):
+    # Authentication, permissions, throttling and multipart parsing, as
+    # APIView.dispatch would do them
+    view.initial(request)
+    serializer = view.get_serializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer
+
+
+def _create_view(request, args, kwargs):
+    view = ScanReportViewSet(action_map={'get': 'list', 'post': 'create'}, format_kwarg=None)
+    view.args, view.kwargs = args, kwargs
+    view.request = view.initialize_request(request, *args, **kwargs)
+    view.headers = view.default_response_headers
+    return view
+
+
+@csrf_exempt
+async def scan_report_collection(request, *args, **kwargs):
+    """
+    /api/scan-reports/ in ASGI mode (see main_api_urls).
+
+    POST runs ScanReportViewSet's create steps without ever blocking the
+    event loop: ORM and file writes go through sync_to_async, decoding and
+    inference are awaited on `inference_executor`. While a scan is being
+    analysed the worker keeps serving every other request (dashboards,
+    alerts, auth). Other methods go to the regular sync viewset.
+    """
+    if request.method != 'POST':
+        return await sync_to_async(_scan_report_collection)(request, *args, **kwargs)
+
+    view = _create_view(request, args, kwargs)
+    drf_request = view.request
+    try:
+        serializer = await sync_to_async(_validate_upload)(view, drf_request)
+        # Queued uploads wait here, holding no thread; overflow fails fast (503)
+        async with admission.admit_async(upload_lane(drf_request)):
+            study = await run_in_inference_executor(view.read_upload, serializer)
+            instance = await sync_to_async(view.save_upload)(serializer, study)
+            calibration = await sync_to_async(current_calibration)()
+            prediction = await run_in_inference_executor(view.analyse, instance, study, calibration)
+            await sync_to_async(view.save_prediction)(instance, prediction)
+        data = await sync_to_async(lambda: serializer.data)()
+        response = Response(data, status=status.HTTP_201_CREATED, headers=view.get_success_headers(data))
+    except Exception as exc:
+        response = await sync_to_async(view.handle_exception)(exc)
+
+    response = view.finalize_response(drf_request, response)
+    return await sync_to_async(response.render)()
+
+
+# --- Live events ---
+def _stream_credentials(request):
+    # (role, is_staff) from a ticket (EventSource) or a Bearer token (other
+    # clients); a JsonResponse when neither is valid
+    ticket = request.GET.get('ticket')
+    if ticket:
+        claims = read_ticket(ticket)
+        if claims is None:
+            return JsonResponse({'detail': 'Invalid or expired ticket.'}, status=401)
+        return claims[1:]
+    try:
+        authenticated = ClaimsJWTAuthentication().authenticate(request)
+    except AuthenticationFailed as e:
+        detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+        return JsonResponse(detail, status=401)
+    if authenticated is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    user = authenticated[0]
+    return user_role(user), user.is_staff
+
+
+async def _event_messages(subscription, reconnected):
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + STREAM_MAX_AGE
+    try:
+        # An id up front makes the browser send Last-Event-ID when it
+        # reconnects, even if no event arrived in between
+        yield f'retry: {RECONNECT_MILLISECONDS}\nid: {hub.next_id()}\n\n'.encode()
+        if reconnected:
+            # Events published while the client was away were missed
+            yield format_event({'type': 'resync'}, hub.next_id())
+        while (remaining := closes_at - loop.time()) > 0:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), min(KEEPALIVE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            yield format_event(event, hub.next_id())
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def event_stream(request):
+    """
+    /api/events/: Server-Sent Events announcing new scan diagnoses to
+    doctors and stock / alert changes to pharmacists (staff get both), so
+    the dashboards refetch only when something changed instead of polling.
+
+    Events are compact JSON (see pulmoscan.signals): `scan` with the
+    report's id, patient, diagnosis and confidence; `stock` with the ids of
+    changed medicines; `alerts` with the alert counts; `resync` when the
+    client may have missed events and should refetch once.
+
+    Only served in ASGI mode, where an open stream costs a coroutine rather
+    than a whole worker.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    if settings.SERVER_MODE != 'asgi':
+        return JsonResponse({'detail': 'The event stream is only available with SERVER_MODE=asgi.'}, status=503)
+
+    credentials = _stream_credentials(request)
+    if isinstance(credentials, JsonResponse):
+        return credentials
+    subscription = hub.subscribe(*credentials)
+    response = StreamingHttpResponse(
+        _event_messages(subscription, reconnected='HTTP_LAST_EVENT_ID' in request.META),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,79 @@
+# pulmoscan/authentication.py
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+
+class ClaimsUser(TokenUser):
+    """
+    Request user built purely from a verified access token.
+
+    CustomTokenObtainPairSerializer already signs `role`, `is_staff`,
+    `username` and `email` into every token, so authorization needs no user
+    or profile query. Claims can be at most ACCESS_TOKEN_LIFETIME stale, and
+    an inactive user is refused at the next refresh, which does hit the
+    database.
+    """
+
+    @cached_property
+    def role(self):
+        return self.token.get('role')
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT authentication that trusts the token's claims instead of loading the
+    user row on every request. Use `full_user(request)` in the few places
+    that need a real model instance.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return ClaimsUser(validated_token)
+
+
+# --- Short-lived cache of full user rows ---
+FULL_USER_TTL = 60  # seconds
+FULL_USER_CACHE_SIZE = 1024
+
+_full_users = OrderedDict()  # user_id -> (expires_at, user)
+_full_users_lock = threading.Lock()
+
+
+def full_user(request):
+    """
+    The User model instance behind `request.user`, for code that must hold
+    a real row (e.g. assigning a ForeignKey). Rows are cached per process
+    for FULL_USER_TTL seconds in a small LRU, so a burst of writes by the
+    same user costs one query.
+    """
+    user = request.user
+    if not isinstance(user, TokenUser):
+        return user
+
+    now = time.monotonic()
+    with _full_users_lock:
+        cached = _full_users.get(user.id)
+        if cached is not None and cached[0] > now:
+            _full_users.move_to_end(user.id)
+            return cached[1]
+
+    instance = get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user.id})
+    with _full_users_lock:
+        _full_users[user.id] = (now + FULL_USER_TTL, instance)
+        _full_users.move_to_end(user.id)
+        while len(_full_users) > FULL_USER_CACHE_SIZE:
+            _full_users.popitem(last=False)
+    return instance
@@ -0,0 +1,157 @@
+# pulmoscan/calibration.py
+import numpy as np
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Exp, Greatest, Least, Round
+
+from .conditional import bump_versions
+from .inference import PNEUMONIA_CONFIDENCE_THRESHOLD, diagnose
+from .models import DiagnosisCalibration, ScanReport
+
+# Bounds on the fitted softmax temperature; perfectly separated labels
+# would otherwise drive it to zero
+MIN_TEMPERATURE, MAX_TEMPERATURE = 0.05, 20.0
+NEWTON_STEPS = 50
+
+
+def current_calibration():
+    """
+    (threshold, temperature) in force: the latest DiagnosisCalibration, or
+    PNEUMONIA_CONFIDENCE_THRESHOLD at temperature 1 before any.
+    """
+    latest = DiagnosisCalibration.objects.order_by('-created_at', '-pk').values_list('threshold', 'temperature').first()
+    return latest or (PNEUMONIA_CONFIDENCE_THRESHOLD, 1.0)
+
+
+def calibrated_diagnosis(logits):
+    """
+    {"diagnosis", "confidence"} for one frame's logits under the current
+    calibration.
+    """
+    threshold, temperature = current_calibration()
+    return diagnose(np.asarray(logits)[np.newaxis], threshold, temperature)[0]
+
+
+def labelled_margins():
+    """
+    (margins, labels) over every report with stored logits and a confirmed
+    diagnosis: pneumonia minus normal logit, and 1 for Pneumonia.
+    """
+    rows = ScanReport.objects.filter(
+        pneumonia_logit__isnull=False, normal_logit__isnull=False, confirmed_diagnosis__isnull=False,
+    ).values_list('normal_logit', 'pneumonia_logit', 'confirmed_diagnosis')
+    normal, pneumonia, labels = [], [], []
+    for normal_logit, pneumonia_logit, label in rows.iterator(chunk_size=5000):
+        normal.append(normal_logit)
+        pneumonia.append(pneumonia_logit)
+        labels.append(label == 'Pneumonia')
+    return np.subtract(pneumonia, normal, dtype=np.float64), np.array(labels, dtype=bool)
+
+
+def fit_temperature(margins, labels):
+    """
+    Temperature minimising the negative log-likelihood of the labels.
+
+    With two classes the calibrated pneumonia probability is
+    sigmoid(margin / T), so this is a one-parameter logistic regression in
+    1/T: convex, solved with a few vectorised Newton steps.
+    """
+    signs = np.where(labels, 1.0, -1.0)
+    inverse = 1.0
+    for _ in range(NEWTON_STEPS):
+        z = signs * margins * inverse
+        wrong = 1.0 / (1.0 + np.exp(z))  # sigmoid(-z): probability given to the other class
+        gradient = -np.sum(signs * margins * wrong)
+        hessian = np.sum(margins ** 2 * wrong * (1.0 - wrong))
+        if hessian <= 0:
+            break
+        step = gradient / hessian
+        inverse = float(np.clip(inverse - step, 1 / MAX_TEMPERATURE, 1 / MIN_TEMPERATURE))
+        if abs(step) < 1e-9:
+            break
+    return 1.0 / inverse
+
+
+def negative_log_likelihood(margins, labels, temperature):
+    z = np.where(labels, 1.0, -1.0) * margins / temperature
+    return float(np.mean(np.logaddexp(0.0, -z)))
+
+
+def roc_curve(probabilities, labels):
+    """
+    Confusion counts at every distinct candidate threshold (predict
+    Pneumonia when probability >= threshold), highest threshold first,
+    from one sort and two cumulative sums. Returns a dict of arrays:
+    thresholds, tp, fp, tn, fn, tpr, fpr, plus the area under the curve.
+    """
+    order = np.argsort(-probabilities, kind='stable')
+    scores, hits = probabilities[order], labels[order]
+    tp = np.cumsum(hits)
+    fp = np.cumsum(~hits)
+    # Last position of each run of equal scores: ties share a threshold
+    last = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tp, fp = tp[last], fp[last]
+    positives, negatives = int(labels.sum()), int((~labels).sum())
+    tpr = tp / max(positives, 1)
+    fpr = fp / max(negatives, 1)
+    return {
+        'thresholds': scores[last],
+        'tp': tp, 'fp': fp, 'fn': positives - tp, 'tn': negatives - fp,
+        'tpr': tpr, 'fpr': fpr,
+        'auc': float(np.trapezoid(np.r_[0.0, tpr], np.r_[0.0, fpr])),
+    }
+
+
+def choose_threshold(roc, target_sensitivity=None):
+    """
+    Index into `roc` of the chosen operating point: the highest threshold
+    reaching `target_sensitivity`, or the best Youden's J (sensitivity +
+    specificity - 1) without one.
+    """
+    if target_sensitivity is not None:
+        reaching = np.flatnonzero(roc['tpr'] >= target_sensitivity)
+        return int(reaching[0]) if len(reaching) else len(roc['tpr']) - 1
+    return int(np.argmax(roc['tpr'] - roc['fpr']))
+
+
+def confusion_at(probabilities, labels, threshold):
+    predicted = probabilities >= threshold
+    return {
+        'tp': int(np.sum(predicted & labels)), 'fp': int(np.sum(predicted & ~labels)),
+        'tn': int(np.sum(~predicted & ~labels)), 'fn': int(np.sum(~predicted & labels)),
+    }
+
+
+def rederive_diagnoses(threshold, temperature):
+    """
+    Recomputes diagnosis and confidence of every report with stored logits
+    under the given calibration, in one UPDATE and without the model.
+    Returns the number of reports updated.
+
+    Pneumonia probability >= threshold is the same as margin >= temperature
+    * logit(threshold), so the branch compares stored columns directly;
+    confidences are the softmax probabilities in percent, as in
+    pulmoscan.inference.diagnose.
+    """
+    cutoff = temperature * float(np.log(threshold / (1 - threshold)))
+    margin = F('pneumonia_logit') - F('normal_logit')
+
+    def percent(exponent):
+        # Clamped: PostgreSQL's exp() raises on overflow and underflow
+        exponent = Greatest(Least(exponent / Value(temperature), Value(700.0)), Value(-700.0))
+        return Round(Value(100.0) / (Value(1.0) + Exp(exponent)), 2, output_field=FloatField())
+
+    with transaction.atomic():
+        updated = ScanReport.objects.filter(pneumonia_logit__isnull=False, normal_logit__isnull=False).update(
+            diagnosis=Case(
+                When(pneumonia_logit__gte=F('normal_logit') + cutoff, then=Value('Pneumonia')),
+                default=Value('Normal'),
+            ),
+            confidence=Case(
+                When(pneumonia_logit__gte=F('normal_logit') + cutoff, then=percent(-margin)),
+                default=percent(margin),
+            ),
+        )
+        if updated:
+            bump_versions('scans')
+    return updated
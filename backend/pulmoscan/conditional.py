@@ -0,0 +1,105 @@
+# pulmoscan/conditional.py
+import functools
+from datetime import datetime, time
+
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpRequest
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.request import Request
+
+from .models import ResourceVersion
+
+
+def bump_versions(*keys):
+    """
+    Marks the given resources as changed once the current transaction
+    commits (immediately in autocommit), so rolled-back writes never
+    invalidate clients and the counter row is not locked for the length
+    of the writer's transaction.
+    """
+    def bump():
+        updated = ResourceVersion.objects.filter(key__in=keys).update(
+            version=F('version') + 1, updated_at=timezone.now(),
+        )
+        if updated < len(keys):
+            for key in keys:
+                ResourceVersion.objects.get_or_create(key=key, defaults={'version': 1})
+
+    transaction.on_commit(bump)
+
+
+def resource_validators(keys):
+    """
+    (etag, last_modified) for a response built from `keys`, read with one
+    primary-key lookup. Today's date is folded in because several payloads
+    (expiry windows, forecasts) change at midnight without any write.
+    """
+    rows = dict(
+        (key, (version, updated_at))
+        for key, version, updated_at in ResourceVersion.objects.filter(key__in=keys).values_list('key', 'version', 'updated_at')
+    )
+    today = timezone.localdate()
+    etag = '"%s-%s"' % (
+        today.strftime('%Y%m%d'),
+        '.'.join(f"{key}{rows.get(key, (0, None))[0]}" for key in keys),
+    )
+    midnight = datetime.combine(today, time.min, tzinfo=timezone.get_current_timezone())
+    last_modified = max([midnight] + [updated_at for _, updated_at in rows.values()])
+    return etag, int(last_modified.timestamp())
+
+
+def conditional_response(request, keys, build_response):
+    """
+    Answers with 304 Not Modified when the client's If-None-Match /
+    If-Modified-Since still match `keys`; only otherwise calls
+    `build_response()` (and so runs the queries and serialization), then
+    stamps the validators on the fresh response.
+    """
+    etag, last_modified = resource_validators(keys)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        response = not_modified
+    else:
+        response = build_response()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Let the browser keep the payload but always revalidate it
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_on(*keys):
+    """
+    Decorator for GET handlers (function views or viewset actions) whose
+    payload depends only on the given resources.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if isinstance(arg, (Request, HttpRequest)))
+            return conditional_response(request, keys, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag / Last-Modified validation to a viewset's list and retrieve,
+    keyed on `conditional_resources`.
+    """
+    conditional_resources = ()
+
+    def list(self, request, *args, **kwargs):
+        return conditional_response(
+            request, self.conditional_resources, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(
+            request, self.conditional_resources, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+        )
@@ -0,0 +1,213 @@
+# pulmoscan/dicom.py
+import io
+import os
+
+import numpy as np
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from .imaging import MAX_SCAN_PIXELS
+from .inference import MAX_REQUEST_FRAMES
+
+try:
+    import pydicom
+    from pydicom.errors import InvalidDicomError
+    from pydicom.pixels import iter_pixels
+except ImportError:  # optional: only needed to ingest DICOM uploads
+    pydicom = None
+
+# Longest side of the PNG stored in ScanReport.scan_image for display
+PREVIEW_SIZE = 1024
+# Side of the square grayscale frames handed to the model
+MODEL_INPUT_SIZE = 224
+
+# Header elements copied into ScanReport.dicom_metadata
+METADATA_KEYWORDS = (
+    'Modality', 'BodyPartExamined', 'ViewPosition', 'StudyDate', 'StudyDescription',
+    'SeriesDescription', 'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID',
+    'Manufacturer', 'Rows', 'Columns', 'NumberOfFrames', 'BitsStored',
+    'PhotometricInterpretation', 'PixelSpacing',
+)
+
+
+class DicomError(ValueError):
+    """
+    Raised for uploads that cannot be read as DICOM (or when pydicom is
+    not installed).
+    """
+
+
+def is_dicom(file):
+    """
+    Whether an uploaded file is DICOM Part 10, judged from the 'DICM'
+    marker after the 128-byte preamble. The file position is restored.
+    """
+    position = file.tell()
+    try:
+        file.seek(128)
+        return file.read(4) == b'DICM'
+    finally:
+        file.seek(position)
+
+
+def _metadata_value(value):
+    if isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)) or type(value).__name__ == 'MultiValue':
+        return [_metadata_value(item) for item in value]
+    return str(value)
+
+
+def _first(value, default=None):
+    # Multi-valued window settings: the first pair is the default view
+    if value is None:
+        return default
+    if isinstance(value, (list, tuple)) or type(value).__name__ == 'MultiValue':
+        return float(value[0]) if len(value) else default
+    return float(value)
+
+
+def read_header(file):
+    """
+    Parses the DICOM header only (`stop_before_pixels`), so even a large
+    multi-frame study costs a few kilobytes of reading. Studies with more
+    frames than the sidecar accepts (MAX_REQUEST_FRAMES) or frames larger
+    than MAX_SCAN_PIXELS are refused here, before any decoding.
+    """
+    if pydicom is None:
+        raise DicomError('DICOM support needs pydicom installed.')
+    position = file.tell()
+    try:
+        header = pydicom.dcmread(file, stop_before_pixels=True)
+        frame_count = int(header.get('NumberOfFrames') or 1)
+        rows, columns = int(header.get('Rows') or 0), int(header.get('Columns') or 0)
+    except (InvalidDicomError, EOFError, ValueError) as e:
+        raise DicomError(f'Not a readable DICOM file: {e}')
+    finally:
+        file.seek(position)
+    if not rows or not columns:
+        raise DicomError('DICOM file has no image dimensions (Rows, Columns).')
+    if frame_count > MAX_REQUEST_FRAMES:
+        raise DicomError(f'DICOM study has {frame_count} frames; at most {MAX_REQUEST_FRAMES} can be analysed.')
+    if rows * columns > MAX_SCAN_PIXELS:
+        raise DicomError(f'DICOM frames too large to analyse: {columns}x{rows} pixels.')
+    return header
+
+
+# --- Pixel pipeline ---
+def block_reduce(frame, factor):
+    """
+    Shrinks a 2-D (or 2-D x channels) frame by an integer `factor` with
+    box averaging, as one reshape and one mean; the frame is never
+    converted to floating point at full resolution.
+    """
+    if factor <= 1:
+        return frame.astype(np.float32)
+    height = frame.shape[0] // factor * factor
+    width = frame.shape[1] // factor * factor
+    blocks = frame[:height, :width].reshape(height // factor, factor, width // factor, factor, *frame.shape[2:])
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def to_display(frame, header):
+    """
+    Rescale slope/intercept, VOI windowing (the header's first window, or
+    the 1st-99th percentile range when it has none) and MONOCHROME1
+    inversion, mapped to 8-bit grayscale. `frame` is float32, already
+    downscaled, so each step is one cheap array operation.
+    """
+    if frame.ndim == 3:
+        frame = frame.mean(axis=2)
+    slope = _first(header.get('RescaleSlope'), 1.0)
+    intercept = _first(header.get('RescaleIntercept'), 0.0)
+    if slope != 1.0 or intercept != 0.0:
+        frame = frame * slope + intercept
+
+    center = _first(header.get('WindowCenter'))
+    width = _first(header.get('WindowWidth'))
+    if center is not None and width is not None and width > 1:
+        low, high = center - 0.5 - (width - 1) / 2, center - 0.5 + (width - 1) / 2
+    else:
+        low, high = np.percentile(frame, (1, 99))
+    scaled = (frame - low) / max(high - low, 1e-6)
+    np.clip(scaled, 0.0, 1.0, out=scaled)
+
+    if header.get('PhotometricInterpretation') == 'MONOCHROME1':
+        scaled = 1.0 - scaled
+    return (scaled * 255.0 + 0.5).astype(np.uint8)
+
+
+def _reduce_factor(shape, target, cover):
+    # cover=True: smallest result still >= target on both sides (model input);
+    # cover=False: result fits within target (preview)
+    height, width = shape[:2]
+    if cover:
+        return max(1, min(height // target, width // target))
+    return max(1, -(-max(height, width) // target))
+
+
+def _decoded_frames(file):
+    """
+    pydicom's iter_pixels, with its decoding failures (missing or
+    truncated pixel data, no decoder for the transfer syntax) raised as
+    DicomError. Errors in the caller's processing of a frame are not
+    caught here.
+    """
+    frames = iter_pixels(file)
+    while True:
+        try:
+            frame = next(frames)
+        except StopIteration:
+            return
+        except (AttributeError, EOFError, OSError, RuntimeError, ValueError) as e:
+            raise DicomError(f'Could not decode DICOM pixel data: {e}')
+        yield frame
+
+
+class DicomStudy:
+    """
+    What ingestion keeps of a DICOM upload: header metadata, a display
+    preview PNG and one model-sized 8-bit frame per image frame.
+    """
+    def __init__(self, metadata, preview, frames):
+        self.metadata = metadata
+        self.preview = preview
+        self.frames = frames
+
+
+def read_study(file):
+    """
+    Decodes a DICOM upload in a single pass over its frames.
+
+    Frames are decoded one at a time (pydicom's iter_pixels), reduced by
+    an integer factor straight away and only then windowed, so at most one
+    full-resolution 16-bit frame is in memory at any moment and each frame
+    is decoded exactly once. The first frame also yields the preview.
+    """
+    header = read_header(file)
+    metadata = {
+        keyword: _metadata_value(header.get(keyword))
+        for keyword in METADATA_KEYWORDS if header.get(keyword) is not None
+    }
+
+    preview = None
+    frames = []
+    try:
+        for frame in _decoded_frames(file):
+            if preview is None:
+                preview = Image.fromarray(
+                    to_display(block_reduce(frame, _reduce_factor(frame.shape, PREVIEW_SIZE, cover=False)), header),
+                )
+            small = to_display(block_reduce(frame, _reduce_factor(frame.shape, MODEL_INPUT_SIZE, cover=True)), header)
+            frames.append(np.asarray(
+                Image.fromarray(small).resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), Image.Resampling.BILINEAR),
+            ))
+    finally:
+        file.seek(0)
+    if preview is None:
+        raise DicomError('DICOM file has no pixel data.')
+
+    buffer = io.BytesIO()
+    preview.save(buffer, format='PNG', optimize=True)
+    stem = os.path.splitext(os.path.basename(getattr(file, 'name', '') or 'scan'))[0]
+    return DicomStudy(metadata=metadata, preview=ContentFile(buffer.getvalue(), name=f'{stem}.png'), frames=frames)
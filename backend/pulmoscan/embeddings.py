@@ -0,0 +1,253 @@
+# pulmoscan/embeddings.py
+import fcntl
+import os
+import threading
+import uuid
+
+import numpy as np
+from django.conf import settings
+
+# Width of the ResNet18 penultimate layer (pulmoscan.utils.predict)
+EMBEDDING_DIM = 512
+# Rows scored per step of an exhaustive scan: bounds the float32 copy
+SCAN_CHUNK_ROWS = 16384
+# Inverted lists probed per query when an index exists
+DEFAULT_NPROBE = 32
+
+
+def normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingStore:
+    """
+    Scan embeddings on disk, for cosine nearest-neighbour search.
+
+    `vectors.f16` is an append-only matrix of L2-normalised float16 rows
+    and `ids.i64` holds the ScanReport id of each row. Both are only ever
+    appended to (under a file lock), so any number of processes can write
+    and readers never need a lock: they memory-map the files and count only
+    rows present in both. The pages live in the OS page cache, shared by
+    every worker, rather than in each worker's heap.
+
+    A scan analysed again simply gets a newer row; `vector_for` returns the
+    latest. `build_index` adds an IVF index (k-means coarse quantiser with
+    the rows regrouped by list) so a query scores only the `nprobe` closest
+    lists plus the rows appended since the build, instead of every row.
+    """
+
+    def __init__(self, directory, dim=EMBEDDING_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, 'vectors.f16')
+        self.ids_path = os.path.join(directory, 'ids.i64')
+        self.index_path = os.path.join(directory, 'ivf.npz')
+        self._mapped = (0, None, None)
+        self._index = (None, None)
+        self._lock = threading.Lock()
+
+    # --- Writing ---
+    def append(self, scan_id, vector):
+        row = normalise(vector).astype('<f2').reshape(self.dim)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            rows = self._row_count()
+            # Cut any half-written row a crashed writer left behind, then
+            # write the vector before its id so readers never see an id
+            # without its vector.
+            with open(self.vectors_path, 'ab') as vectors:
+                vectors.truncate(rows * self.dim * 2)
+                vectors.write(row.tobytes())
+            with open(self.ids_path, 'ab') as ids:
+                ids.truncate(rows * 8)
+                ids.write(np.int64(scan_id).astype('<i8').tobytes())
+
+    def _row_count(self):
+        try:
+            vector_bytes = os.path.getsize(self.vectors_path)
+            id_bytes = os.path.getsize(self.ids_path)
+        except FileNotFoundError:
+            return 0
+        return min(vector_bytes // (self.dim * 2), id_bytes // 8)
+
+    # --- Reading ---
+    def _arrays(self):
+        """
+        (vectors, ids) memory maps over every complete row, remapped only
+        when rows have been appended since the last call.
+        """
+        rows = self._row_count()
+        with self._lock:
+            mapped_rows, vectors, ids = self._mapped
+            if rows != mapped_rows:
+                if rows == 0:
+                    vectors, ids = np.empty((0, self.dim), '<f2'), np.empty(0, '<i8')
+                else:
+                    vectors = np.memmap(self.vectors_path, dtype='<f2', mode='r', shape=(rows, self.dim))
+                    ids = np.memmap(self.ids_path, dtype='<i8', mode='r', shape=(rows,))
+                self._mapped = (rows, vectors, ids)
+            elif vectors is None:
+                vectors, ids = np.empty((0, self.dim), '<f2'), np.empty(0, '<i8')
+        return vectors, ids
+
+    def __len__(self):
+        return len(self._arrays()[1])
+
+    def scan_ids(self):
+        return set(self._arrays()[1].tolist())
+
+    def vector_for(self, scan_id):
+        """
+        The latest embedding stored for `scan_id` as float32, or None.
+        """
+        vectors, ids = self._arrays()
+        rows = np.flatnonzero(ids == scan_id)
+        if not len(rows):
+            return None
+        return np.asarray(vectors[rows[-1]], dtype=np.float32)
+
+    def _load_index(self):
+        # (centroids, offsets, indexed_rows, vectors, ids) of the current
+        # index, reloaded when build_index has replaced it
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            loaded_mtime, index = self._index
+            if loaded_mtime != mtime:
+                with np.load(self.index_path) as data:
+                    name = str(data['name'])
+                    centroids, offsets = data['centroids'], data['offsets']
+                    indexed_rows = int(data['indexed_rows'])
+                vectors = np.memmap(os.path.join(self.directory, f'{name}.f16'), dtype='<f2', mode='r', shape=(indexed_rows, self.dim))
+                ids = np.memmap(os.path.join(self.directory, f'{name}.i64'), dtype='<i8', mode='r', shape=(indexed_rows,))
+                index = (centroids, offsets, indexed_rows, vectors, ids)
+                self._index = (mtime, index)
+        return index
+
+    @staticmethod
+    def _score(query, vectors, ids, scores, matched_ids):
+        for start in range(0, len(ids), SCAN_CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + SCAN_CHUNK_ROWS], dtype=np.float32)
+            scores.append(chunk @ query)
+            matched_ids.append(np.asarray(ids[start:start + SCAN_CHUNK_ROWS]))
+
+    def search(self, query, k, exclude=(), nprobe=DEFAULT_NPROBE):
+        """
+        Up to `k` (scan_id, cosine similarity) pairs, most similar first,
+        one per scan and none from `exclude`. Exact without an index;
+        with one, approximate for the indexed rows (see `nprobe`).
+        """
+        query = normalise(query).reshape(self.dim)
+        vectors, ids = self._arrays()
+        scores, matched_ids = [], []
+
+        index = self._load_index()
+        tail_start = 0
+        if index is not None:
+            centroids, offsets, indexed_rows, index_vectors, index_ids = index
+            probed = np.argsort(centroids @ query)[::-1][:nprobe]
+            for cluster in probed:
+                start, end = offsets[cluster], offsets[cluster + 1]
+                self._score(query, index_vectors[start:end], index_ids[start:end], scores, matched_ids)
+            tail_start = min(indexed_rows, len(ids))
+        # Rows added since the index was built (or every row without one)
+        self._score(query, vectors[tail_start:], ids[tail_start:], scores, matched_ids)
+
+        if not scores:
+            return []
+        scores, matched_ids = np.concatenate(scores), np.concatenate(matched_ids)
+        # Enough candidates to survive duplicates and exclusions
+        wanted = min(len(scores), 2 * (k + len(exclude)) + 16)
+        candidates = np.argpartition(-scores, wanted - 1)[:wanted]
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        results, seen = [], set(exclude)
+        for row in candidates:
+            scan_id = int(matched_ids[row])
+            if scan_id in seen:
+                continue
+            seen.add(scan_id)
+            results.append((scan_id, float(scores[row])))
+            if len(results) == k:
+                break
+        return results
+
+    # --- Index ---
+    def build_index(self, nlist=None, iterations=10, seed=0):
+        """
+        Clusters every stored row with spherical k-means into `nlist`
+        inverted lists (about 4 * sqrt(rows) by default) and writes the
+        rows regrouped by list. Searches switch to the new index once it is
+        complete. Returns (rows indexed, lists).
+        """
+        vectors, ids = self._arrays()
+        rows = len(ids)
+        if rows == 0:
+            return 0, 0
+        nlist = max(1, min(rows, nlist or int(4 * np.sqrt(rows))))
+        rng = np.random.default_rng(seed)
+
+        # Train on a sample: ~64 rows per list is plenty for a coarse quantiser
+        sample = np.sort(rng.choice(rows, size=min(rows, 64 * nlist), replace=False))
+        training = np.asarray(vectors[sample], dtype=np.float32)
+        centroids = training[rng.choice(len(training), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = self._assign(training, centroids)
+            order = np.argsort(assignment, kind='stable')
+            clusters, starts = np.unique(assignment[order], return_index=True)
+            sums = centroids.copy()  # empty lists keep their centroid
+            sums[clusters] = np.add.reduceat(training[order], starts)
+            centroids = normalise(sums)
+
+        assignment = np.concatenate([
+            self._assign(np.asarray(vectors[start:start + SCAN_CHUNK_ROWS], dtype=np.float32), centroids)
+            for start in range(0, rows, SCAN_CHUNK_ROWS)
+        ])
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=nlist), out=offsets[1:])
+
+        # New files under a fresh name, published by replacing ivf.npz, so
+        # readers keep using the previous index until the switch
+        name = f'ivf-{uuid.uuid4().hex[:12]}'
+        with open(os.path.join(self.directory, f'{name}.f16'), 'wb') as out:
+            for start in range(0, rows, SCAN_CHUNK_ROWS):
+                out.write(np.ascontiguousarray(vectors[order[start:start + SCAN_CHUNK_ROWS]]).tobytes())
+        np.asarray(ids[order], dtype='<i8').tofile(os.path.join(self.directory, f'{name}.i64'))
+        temporary = os.path.join(self.directory, f'{name}.npz')
+        np.savez(temporary, name=name, centroids=centroids.astype(np.float32), offsets=offsets, indexed_rows=rows)
+        previous = self._index_name()
+        os.replace(temporary, self.index_path)
+        if previous:
+            for suffix in ('.f16', '.i64'):
+                # Open memory maps keep working on the unlinked files
+                os.remove(os.path.join(self.directory, previous + suffix))
+        return rows, nlist
+
+    def _index_name(self):
+        try:
+            with np.load(self.index_path) as data:
+                return str(data['name'])
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        return np.argmax(vectors @ centroids.T, axis=1)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore(settings.EMBEDDINGS_DIR)
+        return _store
@@ -0,0 +1,233 @@
+# pulmoscan/events.py
+import asyncio
+import atexit
+import itertools
+import json
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .renderers import dumps
+
+# Events a subscriber may fall behind by before its backlog is replaced
+# with a single 'resync' (the client then refetches once)
+SUBSCRIBER_QUEUE_SIZE = 100
+# Comment line sent on idle streams so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+# Streams are closed after this long; EventSource reconnects by itself,
+# which re-checks the client's credentials
+STREAM_MAX_AGE = 30 * 60
+# Delay the browser waits before reconnecting, sent as the SSE `retry:`
+RECONNECT_MILLISECONDS = 3000
+# Lifetime of the ticket an EventSource passes in its URL (it cannot send
+# an Authorization header)
+TICKET_MAX_AGE = 60
+TICKET_SALT = 'pulmoscan.events'
+# A 'stock' event lists at most this many medicine ids; bulk writes send
+# `medicines: null`, meaning "many, refetch".
+STOCK_EVENT_MAX_IDS = 100
+
+# Role that receives each event type; staff receive everything
+EVENT_AUDIENCES = {
+    'scan': 'doctor',
+    'stock': 'pharmacist',
+    'alerts': 'pharmacist',
+}
+
+
+# --- Stream tickets ---
+def issue_ticket(user, role):
+    return signing.dumps({'u': user.id, 'r': role, 's': bool(user.is_staff)}, salt=TICKET_SALT, compress=True)
+
+
+def read_ticket(ticket):
+    """
+    (user_id, role, is_staff) from a ticket made by `issue_ticket`, or
+    None if it is forged or older than TICKET_MAX_AGE.
+    """
+    try:
+        claims = signing.loads(ticket, salt=TICKET_SALT, max_age=TICKET_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return claims['u'], claims['r'], claims['s']
+
+
+# --- In-process hub ---
+class Subscription:
+    """
+    One connected stream: a bounded asyncio queue living on the event loop
+    that serves the client, filtered to the events its role may see.
+    """
+
+    def __init__(self, loop, role, is_staff):
+        self.loop = loop
+        self.role = role
+        self.is_staff = is_staff
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, event):
+        audience = EVENT_AUDIENCES.get(event['type'])
+        return audience is None or self.is_staff or audience == self.role
+
+    def offer(self, event):
+        # Runs on self.loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync'})
+
+
+class EventHub:
+    """
+    Broadcasts events to every stream connected to this process, and
+    through `relay` (see EVENTS_FANOUT) to the other worker processes.
+
+    `publish` may be called from any thread; each event is handed to the
+    subscribers' event loops with call_soon_threadsafe, so publishing never
+    blocks on a slow client.
+    """
+
+    def __init__(self, relay=None):
+        self.relay = relay
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._listening = False
+        self._ids = itertools.count(1)
+
+    def subscribe(self, role, is_staff):
+        subscription = Subscription(asyncio.get_running_loop(), role, is_staff)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if self.relay is not None and not self._listening:
+                self.relay.listen(self.deliver)
+                self._listening = True
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def next_id(self):
+        return next(self._ids)
+
+    def publish(self, event):
+        self.deliver(event)
+        if self.relay is not None:
+            self.relay.send(event)
+
+    def deliver(self, event):
+        with self._lock:
+            subscriptions = [s for s in self._subscriptions if s.wants(event)]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:  # loop closed: the stream is gone
+                self.unsubscribe(subscription)
+
+
+class UnixSocketRelay:
+    """
+    Fan-out between the worker processes of one host over Unix datagram
+    sockets. Every process with connected streams binds `<pid>.sock` in
+    `directory`; publishing sends the event to every socket there, so a
+    scan analysed by one worker reaches the streams held by the others.
+    Sockets left by dead workers are removed when a send is refused.
+    Management commands (imports, sweeps) publish through it as well.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = None
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+
+    def send(self, event):
+        payload = dumps(event)
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.sock') or path == self.path:
+                continue
+            try:
+                self._sender.sendto(payload, path)
+            except ConnectionRefusedError:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except (BlockingIOError, FileNotFoundError):
+                # Receiver's buffer full, or it just exited: its streams
+                # will resync on reconnect
+                pass
+
+    def listen(self, deliver):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self.path = os.path.join(self.directory, f'{os.getpid()}.sock')
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(self.path)
+        atexit.register(self._remove, self.path)
+
+        def receive():
+            while True:
+                payload = receiver.recv(65536)
+                try:
+                    deliver(json.loads(payload))
+                except ValueError:
+                    continue
+
+        threading.Thread(target=receive, name='event-relay', daemon=True).start()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _make_relay():
+    fanout = settings.EVENTS_FANOUT
+    if not fanout:
+        return None
+    if fanout == 'unix':
+        return UnixSocketRelay(settings.EVENTS_SOCKET_DIR)
+    # Dotted path to a class with send(event) and listen(deliver)
+    return import_string(fanout)()
+
+
+hub = EventHub(relay=_make_relay())
+
+
+def publish_event(event_type, **data):
+    """
+    Publishes `{'type': event_type, **data}` once the current transaction
+    commits (immediately in autocommit), so streams never announce a write
+    that is rolled back.
+    """
+    event = {'type': event_type, **data}
+    transaction.on_commit(lambda: hub.publish(event))
+
+
+def format_event(event, event_id=None):
+    """
+    One Server-Sent Events message; the event type becomes the SSE event
+    name (EventSource.addEventListener('scan', ...)).
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f"event: {event['type']}")
+    lines.append('data: ' + dumps(event).decode())
+    return ('\n'.join(lines) + '\n\n').encode()
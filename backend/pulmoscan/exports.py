@@ -0,0 +1,103 @@
+# pulmoscan/exports.py
+import csv
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .renderers import CSVExportRenderer, FastJSONRenderer, NDJSONExportRenderer, StreamingExportRenderer, dumps
+
+# Rows fetched per server-side cursor round trip
+EXPORT_CHUNK_SIZE = 2000
+# Rows joined into one chunk of the response body
+EXPORT_WRITE_BATCH = 500
+
+
+class _Echo:
+    """
+    File-like object whose write() hands the line back, so csv.writer can
+    format rows without buffering them.
+    """
+    def write(self, value):
+        return value
+
+
+def csv_stream(names, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(names).encode()
+    batch = []
+    for row in rows:
+        batch.append(writer.writerow(['' if value is None else value for value in row]))
+        if len(batch) >= EXPORT_WRITE_BATCH:
+            yield ''.join(batch).encode()
+            batch = []
+    if batch:
+        yield ''.join(batch).encode()
+
+
+def ndjson_stream(names, rows):
+    batch = []
+    for row in rows:
+        batch.append(dumps(dict(zip(names, row))))
+        if len(batch) >= EXPORT_WRITE_BATCH:
+            yield b'\n'.join(batch) + b'\n'
+            batch = []
+    if batch:
+        yield b'\n'.join(batch) + b'\n'
+
+
+async def async_chunks(chunks):
+    """
+    Async iterator over a sync chunk generator, fetching one chunk per trip
+    to the sync thread. Under ASGI, Django would otherwise consume a sync
+    iterator whole with sync_to_async(list) before sending anything.
+    """
+    next_chunk = sync_to_async(next)
+    done = object()
+    try:
+        while (chunk := await next_chunk(chunks, done)) is not done:
+            yield chunk
+    finally:
+        # Closes the server-side cursor when the client goes away early
+        await sync_to_async(chunks.close)()
+
+
+class ExportMixin:
+    """
+    Adds GET <list-url>/export/ streaming every row of the viewset's
+    filtered queryset as CSV (default, or ?format=csv) or NDJSON
+    (?format=ndjson / Accept: application/x-ndjson).
+
+    Rows are formatted by the viewset's `read_serializer_class` and pulled
+    through a server-side cursor in EXPORT_CHUNK_SIZE chunks, so memory use
+    and time-to-first-byte do not grow with the size of the export (with
+    SERVER_MODE=asgi the body is an async iterator, see async_chunks).
+    Error responses (401, 403, 400...) go out as JSON.
+    """
+    export_name = 'export'
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Only errors reach here as a Response: the export itself streams
+        if isinstance(response, Response) and isinstance(response.accepted_renderer, StreamingExportRenderer):
+            response.accepted_renderer = FastJSONRenderer()
+            response.accepted_media_type = FastJSONRenderer.media_type
+        return response
+
+    @action(detail=False, methods=['get'], renderer_classes=[CSVExportRenderer, NDJSONExportRenderer])
+    def export(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).order_by('pk')
+        names, rows = self.read_serializer_class(request).rows(queryset, chunk_size=EXPORT_CHUNK_SIZE)
+
+        renderer = request.accepted_renderer
+        stream = ndjson_stream if renderer.format == 'ndjson' else csv_stream
+        chunks = stream(names, rows)
+        if settings.SERVER_MODE == 'asgi':
+            chunks = async_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=f'{renderer.media_type}; charset=utf-8')
+        filename = f"{self.export_name}-{date.today():%Y%m%d}.{renderer.format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
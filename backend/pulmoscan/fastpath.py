@@ -0,0 +1,127 @@
+# pulmoscan/fastpath.py
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .media import media_url_prefix, signed_media_url
+
+
+# --- Column formatters, matching what the DRF fields emit ---
+def format_datetime(value):
+    if value is None:
+        return None
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def format_date(value):
+    return None if value is None else value.isoformat()
+
+
+def format_decimal(value):
+    return None if value is None else '{:f}'.format(value)
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer for list and dashboard payloads.
+
+    Instead of building model instances and running DRF field machinery per
+    row, it pulls only the needed columns with `.values_list()` and applies
+    one small formatter per column that needs one (dates, decimals, file
+    URLs); everything else is passed through. The output matches the
+    corresponding ModelSerializer field for field.
+
+    `fields` lists the output fields in order and `formatters` maps a field
+    name to the name of a method turning the raw column value into its
+    representation. A `?fields=a,b` query parameter narrows the output
+    (sparse fieldsets).
+    """
+    model = None
+    fields = ()
+    formatters = {}
+    # Output field -> database column, for foreign keys and the like
+    sources = {}
+
+    def __init__(self, request=None, fields=None):
+        self.request = request
+        if fields is None and request is not None:
+            fields = request.query_params.get('fields')
+        self.selected = self.select_fields(fields)
+
+    def select_fields(self, fields):
+        if not fields:
+            return tuple(self.fields)
+        requested = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in requested if name not in self.fields]
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(unknown)}"})
+        return tuple(name for name in self.fields if name in requested)
+
+    def serialize(self, queryset, extra=()):
+        """
+        Evaluates `queryset` and returns a list of dicts. Names in `extra`
+        (annotations, usually) are fetched too and passed through as-is.
+        """
+        names, rows = self.rows(queryset, extra)
+        return [dict(zip(names, row)) for row in rows]
+
+    def rows(self, queryset, extra=(), chunk_size=None):
+        """
+        (names, rows) where rows yields formatted value tuples in `names`
+        order. With `chunk_size`, rows stream from a server-side cursor
+        via .iterator() instead of loading the whole result.
+        """
+        names = self.selected + tuple(extra)
+        columns = [self.sources.get(name, name) for name in self.selected] + list(extra)
+        formatters = [
+            getattr(self, self.formatters[name]) if name in self.formatters else None
+            for name in names
+        ]
+        rows = queryset.values_list(*columns)
+        rows = rows.iterator(chunk_size=chunk_size) if chunk_size else iter(rows)
+        if all(formatter is None for formatter in formatters):
+            return names, rows
+        return names, (
+            tuple(value if formatter is None else formatter(value) for formatter, value in zip(formatters, row))
+            for row in rows
+        )
+
+    def file_url(self, name):
+        """
+        Signed URL of a stored file on the protected media view, as
+        SignedImageField builds it, with the URL prefix resolved once per
+        serializer.
+        """
+        if not name:
+            return None
+        if not hasattr(self, '_media_prefix'):
+            self._media_prefix = media_url_prefix(self.request)
+        return signed_media_url(name, prefix=self._media_prefix)
+
+    # Formatter hooks referenced by name from `formatters`
+    def datetime(self, value):
+        return format_datetime(value)
+
+    def date(self, value):
+        return format_date(value)
+
+    def decimal(self, value):
+        return format_decimal(value)
+
+
+class FastListMixin:
+    """
+    Serves a viewset's unpaginated `list` through `read_serializer_class`,
+    a ValuesSerializer, instead of the ModelSerializer used for writes and
+    detail views. Filtering still goes through get_queryset/filter_queryset.
+    """
+    read_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.read_serializer_class is None or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(self.read_serializer_class(request).serialize(queryset))
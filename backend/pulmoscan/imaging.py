@@ -0,0 +1,68 @@
+# pulmoscan/imaging.py
+import warnings
+
+from PIL import Image
+
+# Side of the square input the model sees (transforms.Resize in utils.py)
+MODEL_INPUT_SIZE = 224
+# Shrink in the decoder to at least this multiple of the model input, so
+# the final bilinear resize still has real pixels to average over.
+DECODE_OVERSAMPLE = 2
+# Largest image accepted for analysis; checked from the header, before
+# any pixel is decoded. 50 MP covers 7000x7000 detector panels.
+MAX_SCAN_PIXELS = 50_000_000
+
+GRAYSCALE_MODES = ('1', 'I', 'I;16', 'I;16L', 'I;16B', 'I;16N', 'F', 'LA', 'La')
+
+
+class ScanImageError(ValueError):
+    """
+    Raised for scan images that are unreadable or too large to decode.
+    """
+
+
+def load_scan_image(path, size=MODEL_INPUT_SIZE):
+    """
+    Opens a scan image already shrunk to a little over `size` pixels on
+    its short side, in grayscale ('L').
+
+    The work is done where it is cheapest: JPEGs are decoded at 1/2, 1/4
+    or 1/8 scale directly in the DCT domain (`Image.draft`), other formats
+    are decoded once and box-reduced by an integer factor (`Image.reduce`),
+    and only the small result is converted from RGB to grayscale. The
+    result feeds the same transform as before, whose Resize then works on
+    a few hundred pixels instead of millions.
+
+    Dimensions are checked against MAX_SCAN_PIXELS from the header alone,
+    and Pillow's decompression-bomb warning is treated as an error.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', Image.DecompressionBombWarning)
+        try:
+            image = Image.open(path)
+        except (Image.DecompressionBombWarning, Image.DecompressionBombError) as e:
+            raise ScanImageError(f'Image too large to analyse: {e}')
+        except OSError as e:
+            raise ScanImageError(f'Unreadable image: {e}')
+
+    width, height = image.size
+    if width * height > MAX_SCAN_PIXELS:
+        image.close()
+        raise ScanImageError(f'Image too large to analyse: {width}x{height} pixels.')
+
+    target = size * DECODE_OVERSAMPLE
+    if image.format == 'JPEG':
+        # Picks the largest DCT scale keeping both sides >= target
+        image.draft(image.mode, (target, target))
+    image.load()
+
+    if image.mode not in ('L', 'RGB'):
+        # 16-bit, palette, alpha, CMYK...: normalise first, the same way the
+        # previous convert("RGB") did (grayscale modes straight to 'L')
+        image = image.convert('L' if image.mode in GRAYSCALE_MODES else 'RGB')
+    factor = min(image.size[0] // target, image.size[1] // target)
+    if factor > 1:
+        image = image.reduce(factor)
+    if image.mode != 'L':
+        image = image.convert('L')
+    return image
@@ -0,0 +1,268 @@
+# pulmoscan/imports.py
+import csv
+import io
+from datetime import date, datetime
+from itertools import islice
+
+import numpy as np
+from django.db import transaction
+
+from .alerts import CHUNK_SIZE as LOOKUP_CHUNK_SIZE
+from .models import InventoryTransaction, Medicine
+from .signals import stock_changed
+
+try:
+    import openpyxl
+except ImportError:  # optional: only needed for .xlsx imports
+    openpyxl = None
+
+IMPORT_COLUMNS = ('name', 'batch_number', 'expiry_date', 'quantity', 'price', 'supplier')
+# Rows validated and written per database transaction
+IMPORT_CHUNK_SIZE = 5000
+
+_MAX_LENGTHS = {
+    field: Medicine._meta.get_field(field).max_length
+    for field in ('name', 'batch_number', 'supplier')
+}
+_PRICE_FIELD = Medicine._meta.get_field('price')
+_PRICE_INTEGER_DIGITS = _PRICE_FIELD.max_digits - _PRICE_FIELD.decimal_places
+_DELETE_ASCII_DIGITS = str.maketrans('', '', '0123456789')
+
+
+class ImportFileError(ValueError):
+    """
+    Raised when an import file cannot be read at all (bad header, unknown
+    format), as opposed to per-row errors which are reported and skipped.
+    """
+
+
+# --- Reading ---
+def _cell_text(value):
+    # Spreadsheet cells arrive typed; bring them to the text form CSV uses
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def read_rows(file, filename):
+    """
+    Iterates the data rows of a CSV or XLSX file as (row number, values)
+    with values as strings in IMPORT_COLUMNS order. Row numbers count the
+    header as row 1, as spreadsheets do; blank rows are skipped. Header
+    names are matched case-insensitively and extra columns are ignored.
+    `file` is a binary file object.
+    """
+    if filename.lower().endswith('.xlsx'):
+        if openpyxl is None:
+            raise ImportFileError('XLSX import needs openpyxl installed; upload a CSV file instead.')
+        sheet = openpyxl.load_workbook(file, read_only=True, data_only=True).active
+        rows = (tuple(_cell_text(value) for value in row) for row in sheet.iter_rows(values_only=True))
+    elif filename.lower().endswith('.csv'):
+        rows = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    else:
+        raise ImportFileError('Unsupported file type; upload a .csv or .xlsx file.')
+
+    header = [name.strip().lower() for name in next(rows, ())]
+    missing = [column for column in IMPORT_COLUMNS if column not in header]
+    if missing:
+        raise ImportFileError(f"Missing column(s): {', '.join(missing)}")
+    positions = [header.index(column) for column in IMPORT_COLUMNS]
+    width = max(positions) + 1
+
+    for number, row in enumerate(rows, start=2):
+        if not any(row):
+            continue
+        row = list(row) + [''] * (width - len(row))
+        yield number, tuple(row[position] for position in positions)
+
+
+# --- Validation ---
+def _parse_dates(values):
+    """
+    datetime64[D] array for ISO dates, NaT where a value does not parse.
+    The whole column is parsed in one call; only a column containing a bad
+    value falls back to element-wise parsing.
+    """
+    well_formed = np.char.str_len(values) == 10
+    try:
+        parsed = np.where(well_formed, values, 'NaT').astype('datetime64[D]')
+    except ValueError:
+        parsed = np.empty(len(values), dtype='datetime64[D]')
+        for i, (value, ok) in enumerate(zip(values.tolist(), well_formed)):
+            try:
+                parsed[i] = np.datetime64(value, 'D') if ok else np.datetime64('NaT')
+            except ValueError:
+                parsed[i] = np.datetime64('NaT')
+    return parsed
+
+
+def _ascii_digits(values):
+    # Not np.char.isdigit: it also accepts '²' or '١', which int() and
+    # Decimal() reject or read differently
+    return (np.char.str_len(values) > 0) & (np.char.str_len(np.char.translate(values, _DELETE_ASCII_DIGITS)) == 0)
+
+
+def validate_chunk(chunk):
+    """
+    Column-wise validation of a chunk of (row number, values) pairs.
+
+    Each column becomes one NumPy string array and every check is a
+    whole-array operation, so validating a chunk costs a handful of
+    vectorized passes rather than a serializer run per row. Returns
+    (valid, errors): `valid` is a list of (row, name, batch_number,
+    expiry_date, quantity, price, supplier) with parsed values, `errors` a
+    list of {'row': ..., 'errors': {field: message}}.
+    """
+    numbers, rows = zip(*chunk)
+    numbers = np.array(numbers)
+    columns = {
+        column: np.char.strip(np.array(values, dtype=str))
+        for column, values in zip(IMPORT_COLUMNS, zip(*rows))
+    }
+    problems = {}
+
+    for field, max_length in _MAX_LENGTHS.items():
+        lengths = np.char.str_len(columns[field])
+        problems[field] = [
+            (lengths == 0, 'This field may not be blank.'),
+            (lengths > max_length, f'Ensure this field has no more than {max_length} characters.'),
+        ]
+
+    expiry = _parse_dates(columns['expiry_date'])
+    problems['expiry_date'] = [(np.isnat(expiry), 'Enter a date as YYYY-MM-DD.')]
+
+    quantity_text = columns['quantity']
+    quantity_ok = _ascii_digits(quantity_text) & (np.char.str_len(quantity_text) <= 9)
+    quantity = np.where(quantity_ok, quantity_text, '0').astype(np.int64)
+    problems['quantity'] = [
+        (~quantity_ok, 'Enter a whole number.'),
+        (quantity_ok & (quantity < 1), 'Ensure this value is greater than or equal to 1.'),
+    ]
+
+    whole, point, fraction = (np.char.partition(columns['price'], '.')[:, i] for i in range(3))
+    whole_length, fraction_length = np.char.str_len(whole), np.char.str_len(fraction)
+    price_ok = (
+        _ascii_digits(whole) & (whole_length <= _PRICE_INTEGER_DIGITS)
+        & ((point == '') | (_ascii_digits(fraction) & (fraction_length <= _PRICE_FIELD.decimal_places)))
+    )
+    problems['price'] = [(~price_ok, f'Enter a number with at most {_PRICE_FIELD.decimal_places} decimal places.')]
+
+    bad = np.zeros(len(rows), dtype=bool)
+    for checks in problems.values():
+        for mask, _ in checks:
+            bad |= mask
+
+    errors = []
+    for i in np.flatnonzero(bad).tolist():
+        row_errors = {}
+        for field, checks in problems.items():
+            for mask, message in checks:
+                if mask[i]:
+                    row_errors.setdefault(field, message)
+        errors.append({'row': int(numbers[i]), 'errors': row_errors})
+
+    good = np.flatnonzero(~bad)
+    valid = list(zip(
+        numbers[good].tolist(),
+        columns['name'][good].tolist(),
+        columns['batch_number'][good].tolist(),
+        expiry[good].tolist(),
+        quantity[good].tolist(),
+        columns['price'][good].tolist(),
+        columns['supplier'][good].tolist(),
+    ))
+    return valid, errors
+
+
+# --- Writing ---
+def _batch_ids(keys, lock=False):
+    """
+    {(name, batch_number): (id, quantity)} for the given keys, looked up
+    by name in slices small enough for SQLite's parameter limit.
+    """
+    found = {}
+    names = sorted({name for name, _ in keys})
+    queryset = Medicine.objects.select_for_update() if lock else Medicine.objects.all()
+    for start in range(0, len(names), LOOKUP_CHUNK_SIZE):
+        for medicine_id, name, batch_number, quantity in queryset.filter(
+            name__in=names[start:start + LOOKUP_CHUNK_SIZE],
+        ).values_list('id', 'name', 'batch_number', 'quantity'):
+            if (name, batch_number) in keys:
+                found[name, batch_number] = (medicine_id, quantity)
+    return found
+
+
+def upsert_chunk(valid, user=None):
+    """
+    Writes one validated chunk in a single transaction: existing batches
+    (same name and batch number) are locked and receive the imported
+    quantity on top of their stock, new ones are inserted, all with one
+    `bulk_create(update_conflicts=True)`, and every row gets its matching
+    'purchase' InventoryTransaction. Returns (created, updated).
+    """
+    # Repeated keys within the chunk collapse into one upsert row; the
+    # last occurrence wins for the batch details.
+    batches = {}
+    for _, name, batch_number, expiry_date, quantity, price, supplier in valid:
+        previous = batches.get((name, batch_number))
+        added = quantity + (previous[1] if previous else 0)
+        batches[name, batch_number] = (expiry_date, added, price, supplier)
+
+    with transaction.atomic():
+        existing = _batch_ids(batches.keys(), lock=True)
+        Medicine.objects.bulk_create(
+            [
+                Medicine(
+                    name=name, batch_number=batch_number, expiry_date=expiry_date, price=price, supplier=supplier,
+                    quantity=existing.get((name, batch_number), (None, 0))[1] + added,
+                )
+                for (name, batch_number), (expiry_date, added, price, supplier) in batches.items()
+            ],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['name', 'batch_number'],
+            update_fields=['expiry_date', 'quantity', 'price', 'supplier'],
+        )
+        ids = {key: medicine_id for key, (medicine_id, _) in _batch_ids(batches.keys()).items()}
+        InventoryTransaction.objects.bulk_create(
+            [
+                InventoryTransaction(
+                    medicine_id=ids[name, batch_number], transaction_type='purchase', quantity=quantity, user=user,
+                )
+                for _, name, batch_number, _, quantity, _, _ in valid
+            ],
+            batch_size=1000,
+        )
+        stock_changed.send(sender=Medicine, medicine_ids=list(ids.values()))
+    updated = len(existing)
+    return len(batches) - updated, updated
+
+
+def import_medicines(file, filename, user=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports medicine batches from a CSV/XLSX file with columns
+    IMPORT_COLUMNS, `chunk_size` rows at a time.
+
+    Invalid rows are skipped and reported with their row number (the
+    header is row 1); valid rows of the same chunk are still imported.
+    Raises ImportFileError if the file itself cannot be read.
+    """
+    rows = read_rows(file, filename)
+    summary = {'rows': 0, 'created': 0, 'updated': 0, 'errors': []}
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return summary
+        valid, errors = validate_chunk(chunk)
+        if valid:
+            created, updated = upsert_chunk(valid, user)
+            summary['created'] += created
+            summary['updated'] += updated
+        summary['rows'] += len(chunk)
+        summary['errors'] += errors
@@ -0,0 +1,291 @@
+# pulmoscan/inference.py
+import logging
+import queue
+import socket
+import struct
+import threading
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .imaging import MODEL_INPUT_SIZE, ScanImageError, load_scan_image
+
+logger = logging.getLogger(__name__)
+
+# Nothing here imports torch: the web tier either talks to the inference
+# sidecar (`manage.py inference_sidecar`, INFERENCE_SOCKET set) or, in
+# development, loads pulmoscan.utils lazily on the first scan.
+
+class_names = ["Normal", "Pneumonia"]
+
+# Define a threshold for Pneumonia confidence
+# This value will need to be tuned based on your desired balance
+# between false positives (misclassifying Normal as Pneumonia)
+# and false negatives (misclassifying Pneumonia as Normal).
+PNEUMONIA_CONFIDENCE_THRESHOLD = 0.75 # Only consider Pneumonia if confidence is 75% or higher
+
+
+class InferenceUnavailable(RuntimeError):
+    """
+    Raised when the model cannot be run: sidecar unreachable or failing,
+    or model weights missing.
+    """
+
+
+# --- Wire protocol ---
+# Request:  magic, frame count, height, width, then count*height*width
+#           uint8 grayscale pixels (row-major, already model-sized).
+# Response: magic, status, count, classes, embedding size, then
+#           count*classes float32 logits and count*size float16
+#           embeddings; on error (status 1) `count` bytes of UTF-8 message.
+# All integers and floats little-endian.
+PROTOCOL_MAGIC = b'PSI2'
+REQUEST_HEADER = struct.Struct('<4sIHH')
+RESPONSE_HEADER = struct.Struct('<4sBIHH')
+STATUS_OK, STATUS_ERROR = 0, 1
+# Largest request the sidecar accepts (a long multi-frame study)
+MAX_REQUEST_FRAMES = 1024
+# Smallest frame side accepted (cascade screening runs below 224)
+MIN_FRAME_SIZE = 32
+
+
+def recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError('Connection closed mid-message.')
+        received += n
+    return buffer
+
+
+class SidecarClient:
+    """
+    Thin client for the inference sidecar: up to `pool_size` concurrent
+    requests, each on a persistent Unix socket connection taken from an
+    idle pool. A request that fails on a pooled connection the sidecar
+    has dropped (e.g. after a restart) is retried once on a fresh one;
+    timeouts are not retried.
+    """
+
+    def __init__(self, path, pool_size, timeout):
+        self.path = path
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise InferenceUnavailable(f'Inference sidecar unreachable at {self.path}: {e}')
+        return sock
+
+    def _exchange(self, sock, message):
+        sock.sendall(message)
+        magic, status, length, classes, size = RESPONSE_HEADER.unpack(recv_exactly(sock, RESPONSE_HEADER.size))
+        if magic != PROTOCOL_MAGIC:
+            raise ConnectionError('Unexpected reply from the inference sidecar.')
+        body = recv_exactly(sock, length if status != STATUS_OK else length * (classes * 4 + size * 2))
+        return status, length, classes, size, body
+
+    def predict(self, frames):
+        frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        count, height, width = frames.shape
+        message = REQUEST_HEADER.pack(PROTOCOL_MAGIC, count, height, width) + frames.tobytes()
+        with self._slots:
+            try:
+                sock, pooled = self._idle.get_nowait(), True
+            except queue.Empty:
+                sock, pooled = self._connect(), False
+            try:
+                reply = self._exchange(sock, message)
+            except OSError as e:
+                sock.close()
+                # Never after a timeout: the sidecar is slow, not gone, and
+                # sending the frames again would only add to its load
+                if not pooled or isinstance(e, socket.timeout):
+                    raise InferenceUnavailable(f'Inference sidecar failed: {e}')
+                sock = self._connect()
+                try:
+                    reply = self._exchange(sock, message)
+                except OSError as e:
+                    sock.close()
+                    raise InferenceUnavailable(f'Inference sidecar failed: {e}')
+            self._idle.put(sock)
+        status, length, classes, size, body = reply
+        if status != STATUS_OK:
+            raise InferenceUnavailable(body.decode('utf-8', 'replace'))
+        logits = np.frombuffer(body, dtype='<f4', count=length * classes).reshape(length, classes)
+        embeddings = np.frombuffer(body, dtype='<f2', offset=length * classes * 4).reshape(length, size)
+        return logits, embeddings
+
+
+class LocalModel:
+    """
+    Runs the model in this process (pulmoscan.utils, imported on first
+    use). The default when no sidecar is configured.
+    """
+
+    def predict(self, frames):
+        from . import utils
+        try:
+            return utils.predict(frames)
+        except utils.ModelUnavailable as e:
+            raise InferenceUnavailable(str(e))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if settings.INFERENCE_SOCKET:
+                _backend = SidecarClient(settings.INFERENCE_SOCKET, settings.INFERENCE_POOL_SIZE, settings.INFERENCE_TIMEOUT)
+            else:
+                _backend = LocalModel()
+        return _backend
+
+
+# --- Analysis ---
+def scan_pixels(image_path):
+    """
+    The model input for one scan image as a (1, 224, 224) uint8 array:
+    the reduced grayscale decode of `load_scan_image`, resized exactly as
+    transforms.Resize((224, 224)) does.
+    """
+    image = load_scan_image(image_path)
+    image = image.resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), Image.Resampling.BILINEAR)
+    return np.asarray(image, dtype=np.uint8)[np.newaxis]
+
+
+def softmax(logits):
+    logits = np.asarray(logits, dtype=np.float64)
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def diagnose(logits, threshold=PNEUMONIA_CONFIDENCE_THRESHOLD, temperature=1.0):
+    """
+    Diagnosis from the logits of one or more frames: the frame most
+    suggestive of pneumonia decides, with `threshold` applied to its
+    softmax probability at `temperature` (see pulmoscan.calibration).
+    Also returns that frame's index.
+    """
+    probabilities = softmax(np.asarray(logits, dtype=np.float64) / temperature)
+    pneumonia_index = class_names.index("Pneumonia")
+    frame = int(np.argmax(probabilities[:, pneumonia_index]))
+    most_suspicious = probabilities[frame]
+
+    pneumonia_confidence = most_suspicious[pneumonia_index]
+    if pneumonia_confidence >= threshold:
+        final_diagnosis, final_confidence = "Pneumonia", pneumonia_confidence
+    else:
+        final_diagnosis, final_confidence = "Normal", most_suspicious[class_names.index("Normal")]
+    return {
+        "diagnosis": final_diagnosis,
+        "confidence": round(float(final_confidence) * 100, 2)
+    }, frame
+
+
+# --- Cascade ---
+def cascade_plan():
+    """
+    (screen size, (low, high)) from the CASCADE_* settings, or None when
+    cascade mode is off.
+    """
+    if not settings.CASCADE_SCREEN_SIZE:
+        return None
+    return settings.CASCADE_SCREEN_SIZE, settings.CASCADE_UNCERTAIN_BAND
+
+
+def screen_band(band, threshold):
+    """
+    The uncertainty band widened to contain the diagnosis `threshold`, so a
+    screen below it always reads Normal and one above it Pneumonia; a
+    calibration that moves the threshold outside CASCADE_UNCERTAIN_BAND
+    escalates the scans in between instead of deciding them on the screen.
+    """
+    low, high = band
+    return min(low, threshold), max(high, threshold)
+
+
+def reduce_frames(frames, size):
+    """
+    Box-downsamples (n, 224, 224) uint8 frames to (n, size, size).
+    """
+    return np.stack([
+        np.asarray(Image.fromarray(frame).resize((size, size), Image.Resampling.BOX), dtype=np.uint8)
+        for frame in frames
+    ])
+
+
+def analyse_frames(frames, backend=None, cascade=None, calibration=None):
+    """
+    Diagnosis for 224x224 uint8 grayscale frames (one scan image, or the
+    frames of a DICOM study from pulmoscan.dicom.read_study), under
+    `calibration` (threshold, temperature; see pulmoscan.calibration). On
+    success the result also carries the `stage` that decided and, after a
+    full-resolution pass, the deciding frame's raw `logits` and its
+    `embedding` (see pulmoscan.embeddings).
+
+    With a cascade plan (`cascade_plan()` unless `cascade` is given;
+    False turns it off) the frames are first screened by the same network
+    at a reduced resolution, a fraction of the cost of a full pass. Only
+    when the screen's pneumonia probability falls inside the uncertainty
+    band [low, high) (see screen_band) does the full-resolution model run.
+    A screen's logits and embedding are not returned: they are on a
+    different scale from full-resolution ones, which calibration and
+    similarity search rely on.
+    """
+    if len(frames) == 0:
+        return {"diagnosis": "Error", "confidence": 0, "message": "No image frames"}
+    frames = np.stack(frames)
+    backend = backend or get_backend()
+    plan = cascade_plan() if cascade is None else cascade
+    threshold, temperature = calibration or (PNEUMONIA_CONFIDENCE_THRESHOLD, 1.0)
+    try:
+        stage = "full"
+        if plan:
+            screen_size, band = plan
+            logits, embeddings = backend.predict(reduce_frames(frames, screen_size))
+            pneumonia = softmax(np.asarray(logits, dtype=np.float64) / temperature)[:, class_names.index("Pneumonia")].max()
+            low, high = screen_band(band, threshold)
+            stage = "screen"
+            if low <= pneumonia < high:
+                stage = "full"
+        if stage == "full":
+            logits, embeddings = backend.predict(frames)
+    except InferenceUnavailable as e:
+        logger.error("Inference failed: %s", e)
+        return {"diagnosis": "Error", "confidence": 0, "message": f"Inference failed: {e}"}
+    prediction, frame = diagnose(logits, threshold, temperature)
+    logger.info(
+        "Diagnosis over %d frame(s) (%s): %s, confidence %s%%",
+        len(frames), stage, prediction['diagnosis'], prediction['confidence'],
+    )
+    if stage == "screen":
+        return {**prediction, "stage": stage}
+    return {**prediction, "logits": logits[frame], "embedding": embeddings[frame], "stage": stage}
+
+
+def analyse_scan(image_path, backend=None, cascade=None, calibration=None):
+    """
+    Diagnosis for a stored scan image. Decoding happens here, so only 50 KB
+    of pixels travel to the sidecar.
+    """
+    try:
+        pixels = scan_pixels(image_path)
+    except (OSError, ScanImageError) as e:
+        logger.error("Could not read image %s: %s", image_path, e)
+        return {"diagnosis": "Error", "confidence": 0, "message": f"Unreadable image: {e}"}
+    return analyse_frames(pixels, backend, cascade, calibration)
@@ -0,0 +1,175 @@
+# pulmoscan/inventory.py
+from datetime import date, datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, Max, Min, Sum, When
+from django.utils import timezone
+
+from .models import Medicine, InventoryTransaction, StockSnapshot
+from .signals import stock_changed
+
+
+class InsufficientStockError(Exception):
+    """
+    Raised when the non-expired batches of a medicine cannot cover a sale.
+    """
+    def __init__(self, name, requested, available):
+        self.name = name
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Not enough stock for {name}: requested {requested}, available {available}."
+        )
+
+
+def allocate_fefo(name, quantity, user=None):
+    """
+    Sells `quantity` units of the medicine called `name`, taking stock
+    first-expiry-first-out across its batches.
+
+    All candidate batches are locked in a single query ordered by expiry
+    (served by the (name, expiry_date) index); expired and empty batches are
+    skipped. The sale is split into one 'sale' InventoryTransaction per batch
+    touched, and everything happens inside one database transaction, so
+    either the whole quantity is allocated or nothing changes.
+
+    Returns the list of created InventoryTransaction rows.
+    """
+    with transaction.atomic():
+        batches = list(
+            Medicine.objects.select_for_update()
+            .filter(name=name, expiry_date__gte=date.today(), quantity__gt=0)
+            .order_by('expiry_date', 'id')
+        )
+
+        available = sum(batch.quantity for batch in batches)
+        if available < quantity:
+            raise InsufficientStockError(name, quantity, available)
+
+        remaining = quantity
+        touched = []
+        sales = []
+        for batch in batches:
+            if remaining == 0:
+                break
+            taken = min(batch.quantity, remaining)
+            batch.quantity -= taken
+            remaining -= taken
+            touched.append(batch)
+            sales.append(InventoryTransaction(
+                medicine=batch, transaction_type='sale', quantity=taken, user=user,
+            ))
+
+        Medicine.objects.bulk_update(touched, ['quantity'])
+        created = InventoryTransaction.objects.bulk_create(sales)
+        stock_changed.send(sender=Medicine, medicine_ids=[batch.pk for batch in touched])
+        return created
+
+
+# --- Stock snapshots ---
+def end_of_day(day):
+    """
+    The instant a calendar day ends (next midnight in the current time zone).
+    Ledger windows are half-open, so a transaction belongs to `day` when
+    its timestamp is strictly before this.
+    """
+    return datetime.combine(day + timedelta(days=1), time.min, tzinfo=timezone.get_current_timezone())
+
+
+def ledger_delta(start=None, end=None):
+    """
+    Net quantity moved per medicine by transactions in [start, end), as
+    {medicine_id: purchases - sales}. Computed with one aggregate query
+    over the `date` index; either bound may be None for an open end.
+    """
+    transactions = InventoryTransaction.objects.all()
+    if start is not None:
+        transactions = transactions.filter(date__gte=start)
+    if end is not None:
+        transactions = transactions.filter(date__lt=end)
+    net = Sum(Case(When(transaction_type='purchase', then=F('quantity')), default=-F('quantity')))
+    return dict(
+        transactions.order_by().values('medicine_id').annotate(net=net).values_list('medicine_id', 'net')
+    )
+
+
+def take_snapshot(day):
+    """
+    Writes (or overwrites) the end-of-day StockSnapshot rows for `day`.
+
+    The quantity is derived from the live stock minus whatever moved after
+    the day ended, so the command gives the same answer whether it runs
+    at midnight or catches up a few days later. Returns the row count.
+    """
+    with transaction.atomic():
+        moved_since = ledger_delta(start=end_of_day(day))
+        snapshots = [
+            StockSnapshot(medicine_id=medicine_id, date=day, quantity=quantity - moved_since.get(medicine_id, 0))
+            for medicine_id, quantity in Medicine.objects.values_list('id', 'quantity')
+        ]
+        StockSnapshot.objects.bulk_create(
+            snapshots,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['medicine', 'date'],
+            update_fields=['quantity'],
+        )
+    return len(snapshots)
+
+
+def record_opening_stock(medicine, user=None):
+    """
+    Records the quantity a medicine batch was created with as a purchase,
+    so the ledger (and stock_at) knows the batch did not exist before.
+    The bulk import writes its own purchases; this covers the API and
+    admin create paths.
+    """
+    if medicine.quantity > 0:
+        InventoryTransaction.objects.create(
+            medicine=medicine, transaction_type='purchase', quantity=medicine.quantity, user=user,
+        )
+
+
+def stock_at(day):
+    """
+    Per-medicine quantity held at the end of `day`.
+
+    Anchors on whichever is fewest days from `day`: the latest snapshot on
+    or before it, the earliest one after it, or the live quantities (as of
+    today). The ledger is then rolled forward or backwards from the anchor,
+    so only the transactions in between are aggregated.
+
+    Only stock that moved through InventoryTransaction rows is rolled:
+    quantities edited directly on a batch (the update endpoint, the admin
+    change form) are not in the ledger, and days before such an edit
+    report the edited quantity.
+
+    Returns (quantities, anchor_date) where quantities is
+    {medicine_id: quantity} and anchor_date is None for the live anchor.
+    """
+    cutoff = end_of_day(day)
+    before = StockSnapshot.objects.filter(date__lte=day).aggregate(d=Max('date'))['d']
+    after = StockSnapshot.objects.filter(date__gt=day).aggregate(d=Min('date'))['d']
+    anchors = [(abs((anchor - day).days), anchor) for anchor in (before, after) if anchor is not None]
+    anchors.append((abs((date.today() - day).days), None))
+    anchor_date = min(anchors, key=lambda anchor: anchor[0])[1]
+
+    if anchor_date is None:
+        base = dict(Medicine.objects.values_list('id', 'quantity'))
+        anchor_cutoff = None
+    else:
+        base = dict(StockSnapshot.objects.filter(date=anchor_date).values_list('medicine_id', 'quantity'))
+        anchor_cutoff = end_of_day(anchor_date)
+
+    if anchor_cutoff is not None and anchor_cutoff <= cutoff:
+        delta = ledger_delta(start=anchor_cutoff, end=cutoff)
+        sign = 1
+    else:
+        delta = ledger_delta(start=cutoff, end=anchor_cutoff)
+        sign = -1
+
+    quantities = {
+        medicine_id: base.get(medicine_id, 0) + sign * delta.get(medicine_id, 0)
+        for medicine_id in base.keys() | delta.keys()
+    }
+    return quantities, anchor_date
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
@@ -14,3 +15,9 @@ router.register(r'user-profiles', UserProfileViewSet, basename='userprofile')
 urlpatterns = [
     path('', include(router.urls)),
 ]
+
+if settings.SERVER_MODE == 'asgi':
+    from .async_views import scan_report_collection
+
+    # Ahead of the router: uploads are analysed without blocking the event loop
+    urlpatterns.insert(0, path('scan-reports/', scan_report_collection, name='scanreport-list'))
@@ -0,0 +1,111 @@
+# backend/pulmoscan/management/commands/archive_scans.py
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from pulmoscan.archive import (
+    PackWriter, archive_database, archive_ready, cold_blob_names, copy_to_archive, ensure_partitions, pack_entry,
+    record_pack,
+)
+from pulmoscan.models import ScanReport
+from pulmoscan.storage import scan_storage
+
+
+class Command(BaseCommand):
+    help = ('Archives scan reports older than SCAN_ARCHIVE_AFTER_DAYS: their image and DICOM files are '
+            'recompressed losslessly into packs in SCAN_COLD_STORAGE_DIR and the rows move to the archive '
+            'table (monthly partitions on PostgreSQL, SCAN_ARCHIVE_DATABASE on SQLite). Archived reports '
+            'stay readable through the scan report detail endpoint. Safe to interrupt and re-run.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=settings.SCAN_ARCHIVE_AFTER_DAYS,
+                            help='Age in days (default: SCAN_ARCHIVE_AFTER_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Reports per pack and per transaction (default 500).')
+        parser.add_argument('--limit', type=int, default=None, help='Archive at most this many reports.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Compression threads (default: one per CPU).')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived.')
+
+    def handle(self, *args, **options):
+        if options['older_than'] <= 0:
+            raise CommandError('--older-than must be a positive number of days.')
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+        candidates = ScanReport.objects.filter(date_uploaded__lt=cutoff).order_by('pk')
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"{candidates.count()} scan reports uploaded before {cutoff:%Y-%m-%d} would be archived."
+            ))
+            return
+
+        if not archive_ready():
+            raise CommandError(f"The archive tables are missing: run `manage.py migrate --database {archive_database()}`.")
+        archived = skipped = files = original_bytes = stored_bytes = packs = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while options['limit'] is None or archived < options['limit']:
+                size = options['batch_size']
+                if options['limit'] is not None:
+                    size = min(size, options['limit'] - archived)
+                batch = list(candidates.filter(pk__gt=last_id).values_list(
+                    'pk', 'date_uploaded', 'scan_image', 'source_file',
+                )[:size])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+
+                names = {name for row in batch for name in row[2:] if name}
+                names -= cold_blob_names(names)
+                pack = PackWriter(settings.SCAN_COLD_STORAGE_DIR)
+                failed = set()
+                for name, codec, data, original_size in pool.map(lambda name: pack_entry(scan_storage, name), sorted(names)):
+                    if codec is None:
+                        if options['verbosity']:
+                            self.stderr.write(f"Cannot archive {name}: {data}")
+                        failed.add(name)
+                        continue
+                    pack.add(name, codec, data, original_size)
+                    original_bytes += original_size
+                # Reports with a missing or damaged file stay in the hot table
+                kept = [row for row in batch if not failed.intersection(row[2:])]
+                skipped += len(batch) - len(kept)
+                batch = kept
+                if pack.entries:
+                    pack.close()
+                    stored_bytes += pack.stored_bytes
+                    files += len(pack.entries)
+                    packs += 1
+                else:
+                    pack.discard()
+                if not batch:
+                    continue
+
+                # The pack is on disk before anything refers to it, and hot
+                # rows are deleted only once the archive transaction holding
+                # their copies has committed. With a separate archive
+                # database a failure in between leaves a report in both
+                # tables: it stays readable, and re-running replaces the
+                # copy and finishes the move. Deleting through the ORM
+                # releases the blobs as usual: files no live report uses go
+                # after commit.
+                with transaction.atomic():
+                    with transaction.atomic(using=archive_database()):
+                        if pack.entries:
+                            record_pack(pack)
+                        ensure_partitions(row[1] for row in batch)
+                        report_ids = copy_to_archive([row[0] for row in batch], timezone.now())
+                    ScanReport.objects.filter(pk__in=report_ids).delete()
+                archived += len(report_ids)
+                self.stdout.write(f"Archived {archived} scan reports so far.")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} scan reports uploaded before {cutoff:%Y-%m-%d}: {files} files, "
+            f"{original_bytes / 1e6:.1f} MB stored as {stored_bytes / 1e6:.1f} MB in {packs} packs "
+            f"({skipped} skipped)."
+        ))
@@ -0,0 +1,78 @@
+# backend/pulmoscan/management/commands/benchmark_serialization.py
+
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from pulmoscan.models import Medicine, ScanReport
+from pulmoscan.renderers import FastJSONRenderer
+from pulmoscan.serializers import (
+    MedicineSerializer, MedicineReadSerializer, ScanReportSerializer, ScanReportReadSerializer,
+)
+
+
+class Command(BaseCommand):
+    help = ('Measures rows/sec of the large-list case: ModelSerializer + stock JSON renderer '
+            'versus the .values() read serializers + FastJSONRenderer. Works on throwaway rows '
+            'inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help='Rows per table (default 20000).')
+        parser.add_argument('--repeat', type=int, default=3, help='Best-of-N timing (default 3).')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        request = Request(RequestFactory().get('/api/'))
+
+        with transaction.atomic():
+            self.seed(rows)
+            cases = [
+                ('medicines', Medicine, MedicineSerializer, MedicineReadSerializer),
+                ('scan-reports', ScanReport, ScanReportSerializer, ScanReportReadSerializer),
+            ]
+            for label, model, model_serializer, read_serializer in cases:
+                before = self.best_of(repeat, lambda: JSONRenderer().render(
+                    model_serializer(model.objects.all(), many=True, context={'request': request}).data
+                ))
+                after = self.best_of(repeat, lambda: FastJSONRenderer().render(
+                    read_serializer(request).serialize(model.objects.all())
+                ))
+                self.stdout.write(
+                    f"{label:<14} before: {rows / before:>10,.0f} rows/s   "
+                    f"after: {rows / after:>10,.0f} rows/s   speedup: {before / after:.1f}x"
+                )
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Benchmark complete (sample rows rolled back).'))
+
+    def seed(self, rows):
+        expiry = date.today() + timedelta(days=365)
+        Medicine.objects.bulk_create(
+            [
+                Medicine(name=f'Benchmark {i}', batch_number=f'BENCH-{i}', expiry_date=expiry,
+                         quantity=i % 500, price='12.50', supplier='Benchmark Supplier')
+                for i in range(rows)
+            ],
+            batch_size=2000,
+        )
+        ScanReport.objects.bulk_create(
+            [
+                ScanReport(patient_name=f'Patient {i}', scan_image=f'scans/benchmark_{i}.png',
+                           diagnosis='Normal', confidence=87.5)
+                for i in range(rows)
+            ],
+            batch_size=2000,
+        )
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
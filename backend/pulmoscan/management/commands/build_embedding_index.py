@@ -0,0 +1,50 @@
+# backend/pulmoscan/management/commands/build_embedding_index.py
+
+from django.core.management.base import BaseCommand
+
+from pulmoscan.dicom import DicomError, read_study
+from pulmoscan.embeddings import get_store
+from pulmoscan.inference import analyse_frames, analyse_scan
+from pulmoscan.models import ScanReport
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the IVF index over the stored scan embeddings used by /api/scan-reports/<id>/similar/. '
+            'Run it periodically (e.g. nightly); scans embedded since the last build are still searched exhaustively.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='First embed scan reports that have no embedding yet (runs the model on each).')
+        parser.add_argument('--lists', type=int, default=None,
+                            help='Number of inverted lists (default: about 4 * sqrt(embeddings)).')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        store = get_store()
+        if options['backfill']:
+            embedded = 0
+            known = store.scan_ids()
+            for report in ScanReport.objects.only('pk', 'scan_image', 'source_file').iterator():
+                if report.pk in known:
+                    continue
+                prediction = self.analyse(report)
+                if prediction is not None and "embedding" in prediction:
+                    store.append(report.pk, prediction["embedding"])
+                    embedded += 1
+            self.stdout.write(f'Embedded {embedded} scan reports.')
+
+        rows, lists = store.build_index(nlist=options['lists'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {rows} embeddings in {lists} lists.'))
+
+    def analyse(self, report):
+        # Full resolution only: cascade screens return no embedding
+        try:
+            if report.source_file:
+                with report.source_file.open('rb') as source:
+                    return analyse_frames(read_study(source).frames, cascade=False)
+            if report.scan_image:
+                return analyse_scan(report.scan_image.path, cascade=False)
+        except (OSError, DicomError) as e:
+            if self.verbosity:
+                self.stderr.write(f"Skipping scan report {report.pk}: {e}")
+        return None
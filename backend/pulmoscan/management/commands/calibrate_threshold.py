@@ -0,0 +1,90 @@
+# backend/pulmoscan/management/commands/calibrate_threshold.py
+
+import csv
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from pulmoscan.calibration import (
+    choose_threshold, confusion_at, current_calibration, fit_temperature, labelled_margins,
+    negative_log_likelihood, rederive_diagnoses, roc_curve,
+)
+from pulmoscan.models import DiagnosisCalibration
+
+
+class Command(BaseCommand):
+    help = ('Fits the pneumonia threshold and softmax temperature to clinician-confirmed diagnoses, using the '
+            'logits stored per scan report, then re-derives every stored diagnosis without running the model.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-sensitivity', type=float,
+                            help='Pick the highest threshold reaching this sensitivity (e.g. 0.95) '
+                                 "instead of maximising Youden's J.")
+        parser.add_argument('--threshold', type=float,
+                            help='Use this pneumonia probability threshold instead of choosing one.')
+        parser.add_argument('--no-temperature', action='store_true',
+                            help='Keep temperature 1 (plain softmax) instead of fitting it.')
+        parser.add_argument('--roc-csv', help='Write the confusion matrix at every candidate threshold to this CSV file.')
+        parser.add_argument('--dry-run', action='store_true', help='Report only; change nothing.')
+
+    def handle(self, *args, **options):
+        for name in ('target_sensitivity', 'threshold'):
+            if options[name] is not None and not 0 < options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be between 0 and 1 (exclusive).")
+
+        margins, labels = labelled_margins()
+        if labels.all() or not labels.any():
+            raise CommandError(
+                f'Need confirmed Normal and Pneumonia reports with stored logits; found {len(labels)} '
+                f'({int(labels.sum())} Pneumonia).'
+            )
+
+        temperature = 1.0 if options['no_temperature'] else fit_temperature(margins, labels)
+        probabilities = 1.0 / (1.0 + np.exp(-margins / temperature))
+        roc = roc_curve(probabilities, labels)
+        if options['threshold'] is not None:
+            threshold = options['threshold']
+        else:
+            threshold = float(roc['thresholds'][choose_threshold(roc, options['target_sensitivity'])])
+            threshold = min(max(threshold, 1e-6), 1 - 1e-6)
+
+        self.stdout.write(
+            f"{len(labels)} labelled reports ({int(labels.sum())} Pneumonia), AUC {roc['auc']:.4f}\n"
+            f"Temperature {temperature:.4f} (log loss {negative_log_likelihood(margins, labels, 1.0):.4f} "
+            f"-> {negative_log_likelihood(margins, labels, temperature):.4f})"
+        )
+        current_threshold, current_temperature = current_calibration()
+        current_probabilities = 1.0 / (1.0 + np.exp(-margins / current_temperature))
+        for title, confusion in (
+            (f'Current (threshold {current_threshold:.4f})', confusion_at(current_probabilities, labels, current_threshold)),
+            (f'Chosen  (threshold {threshold:.4f})', confusion_at(probabilities, labels, threshold)),
+        ):
+            sensitivity = confusion['tp'] / max(confusion['tp'] + confusion['fn'], 1)
+            specificity = confusion['tn'] / max(confusion['tn'] + confusion['fp'], 1)
+            self.stdout.write(
+                f"{title}: TP {confusion['tp']} FP {confusion['fp']} TN {confusion['tn']} FN {confusion['fn']}, "
+                f"sensitivity {sensitivity:.3f}, specificity {specificity:.3f}"
+            )
+
+        if options['roc_csv']:
+            with open(options['roc_csv'], 'w', newline='') as out:
+                writer = csv.writer(out)
+                writer.writerow(['threshold', 'tp', 'fp', 'tn', 'fn', 'tpr', 'fpr'])
+                writer.writerows(zip(
+                    roc['thresholds'].round(6), roc['tp'], roc['fp'], roc['tn'], roc['fn'],
+                    roc['tpr'].round(6), roc['fpr'].round(6),
+                ))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Dry run: calibration not saved.'))
+            return
+
+        # Together: new uploads read the latest calibration, so it must not
+        # be in force over diagnoses still derived under the previous one
+        with transaction.atomic():
+            DiagnosisCalibration.objects.create(
+                threshold=threshold, temperature=temperature, labelled_scans=len(labels), auc=roc['auc'],
+            )
+            updated = rederive_diagnoses(threshold, temperature)
+        self.stdout.write(self.style.SUCCESS(f'Saved the calibration and re-derived {updated} diagnoses.'))
@@ -0,0 +1,133 @@
+# backend/pulmoscan/management/commands/evaluate_cascade.py
+
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pulmoscan.calibration import current_calibration
+from pulmoscan.dicom import DicomError, read_study
+from pulmoscan.imaging import ScanImageError
+from pulmoscan.inference import analyse_frames, scan_pixels
+from pulmoscan.models import ScanReport
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class Command(BaseCommand):
+    help = ('Compares cascade inference with the full model alone on a labelled set: escalation rate, '
+            'average latency, agreement with the full-model diagnosis and accuracy of both. The set is '
+            'either scan reports with a confirmed diagnosis or an image folder with Normal/ and Pneumonia/ '
+            'subfolders.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', help='Folder with Normal/ and Pneumonia/ subfolders (case-insensitive).')
+        parser.add_argument('--limit', type=int, default=None, help='Evaluate at most this many scans.')
+        parser.add_argument('--screen-size', type=int, default=settings.CASCADE_SCREEN_SIZE or 112,
+                            help='Screening resolution (default: CASCADE_SCREEN_SIZE, or 112 when off).')
+        parser.add_argument('--band', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                            default=settings.CASCADE_UNCERTAIN_BAND,
+                            help='Pneumonia probabilities escalated to the full model (default: CASCADE_UNCERTAIN_BAND).')
+        parser.add_argument('--json', help='Also write the report to this JSON file.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        low, high = options['band']
+        if not 0 <= low <= high <= 1:
+            raise CommandError('--band needs 0 <= LOW <= HIGH <= 1.')
+        plan = (options['screen_size'], (low, high))
+        # Both runs diagnose under the calibration in force, like uploads
+        calibration = current_calibration()
+
+        full_seconds = cascade_seconds = 0.0
+        scans = escalated = agreed = 0
+        full_correct = cascade_correct = 0
+        for label, frames in self.labelled_frames(options['images'], options['limit']):
+            if not scans:
+                # Untimed: loads the model and warms up both input sizes
+                analyse_frames(frames, cascade=False, calibration=calibration)
+                analyse_frames(frames, cascade=(plan[0], (0, 1)), calibration=calibration)
+            started = time.perf_counter()
+            full = analyse_frames(frames, cascade=False, calibration=calibration)
+            full_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            cascade = analyse_frames(frames, cascade=plan, calibration=calibration)
+            cascade_seconds += time.perf_counter() - started
+            if full['diagnosis'] == 'Error' or cascade['diagnosis'] == 'Error':
+                raise CommandError(full.get('message') or cascade.get('message'))
+
+            scans += 1
+            escalated += cascade['stage'] == 'full'
+            agreed += cascade['diagnosis'] == full['diagnosis']
+            full_correct += full['diagnosis'] == label
+            cascade_correct += cascade['diagnosis'] == label
+
+        if not scans:
+            raise CommandError('No labelled scans to evaluate.')
+        report = {
+            'scans': scans,
+            'screen_size': plan[0],
+            'uncertain_band': [low, high],
+            'escalation_rate': round(escalated / scans, 4),
+            'full_mean_ms': round(full_seconds / scans * 1000, 1),
+            'cascade_mean_ms': round(cascade_seconds / scans * 1000, 1),
+            'agreement_with_full': round(agreed / scans, 4),
+            'full_accuracy': round(full_correct / scans, 4),
+            'cascade_accuracy': round(cascade_correct / scans, 4),
+        }
+        for key, value in report.items():
+            self.stdout.write(f'{key}: {value}')
+        if options['json']:
+            with open(options['json'], 'w') as out:
+                json.dump(report, out, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f"Cascade escalated {escalated} of {scans} scans and agreed with the full model on {agreed}."
+        ))
+
+    def labelled_frames(self, images, limit):
+        """
+        Yields (label, frames) with the label 'Normal' or 'Pneumonia'.
+        Decoding happens here so it is not part of either timing.
+        """
+        count = 0
+        if images:
+            folders = {name.lower(): os.path.join(images, name) for name in os.listdir(images)}
+            sources = [
+                (label, os.path.join(folders[label.lower()], name))
+                for label in ('Normal', 'Pneumonia') if label.lower() in folders
+                for name in sorted(os.listdir(folders[label.lower()]))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+            for label, path in sources:
+                if limit is not None and count >= limit:
+                    return
+                try:
+                    frames = scan_pixels(path)
+                except (OSError, ScanImageError) as e:
+                    if self.verbosity:
+                        self.stderr.write(f"Skipping {path}: {e}")
+                    continue
+                count += 1
+                yield label, frames
+            return
+
+        reports = ScanReport.objects.filter(confirmed_diagnosis__isnull=False).only(
+            'pk', 'scan_image', 'source_file', 'confirmed_diagnosis',
+        )
+        for report in reports.iterator():
+            if limit is not None and count >= limit:
+                return
+            try:
+                if report.source_file:
+                    with report.source_file.open('rb') as source:
+                        frames = read_study(source).frames
+                else:
+                    frames = scan_pixels(report.scan_image.path)
+            except (OSError, ScanImageError, DicomError) as e:
+                if self.verbosity:
+                    self.stderr.write(f"Skipping scan report {report.pk}: {e}")
+                continue
+            count += 1
+            yield report.confirmed_diagnosis, frames
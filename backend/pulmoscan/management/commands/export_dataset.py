@@ -0,0 +1,222 @@
+# backend/pulmoscan/management/commands/export_dataset.py
+
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from pulmoscan.dicom import DicomError, read_study
+from pulmoscan.imaging import MODEL_INPUT_SIZE, ScanImageError
+from pulmoscan.inference import scan_pixels
+from pulmoscan.models import ScanReport
+
+MANIFEST_NAME = 'manifest.json'
+INDEX_COLUMNS = ('row', 'report_id', 'frame', 'label', 'diagnosis', 'confidence')
+LABEL_UPDATE_COLUMNS = ('report_id', 'label')
+
+
+def preprocess(task):
+    """
+    Pool worker: (report id, frames as an (n, 224, 224) uint8 array or
+    None, error message). Same decoding and resize as the model input, i.e.
+    `pulmoscan.utils.transform` up to (not including) normalisation.
+    """
+    report_id, image_path, source_path = task
+    try:
+        if source_path:
+            with open(source_path, 'rb') as source:
+                frames = read_study(source).frames
+        else:
+            frames = scan_pixels(image_path)
+    except (OSError, ScanImageError, DicomError) as e:
+        return report_id, None, str(e)
+    return report_id, np.stack(frames).astype(np.uint8, copy=False), None
+
+
+class Command(BaseCommand):
+    help = ('Exports scan reports as a training set: preprocessed 224x224 uint8 frames in .npy shards, each '
+            'with a CSV index of label (confirmed diagnosis), diagnosis and confidence. Re-running into the '
+            'same folder appends the reports not exported yet (new, confirmed since, or skipped before) and '
+            'writes labels confirmed or changed since their export to a labels-NNNNN.csv update; apply those '
+            'in order over the shard indexes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Dataset folder (created if missing).')
+        parser.add_argument('--shard-size', type=int, default=2048, help='Frames per shard (default 2048, ~100 MB).')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Decoding processes (default: one per CPU).')
+        parser.add_argument('--labelled-only', action='store_true',
+                            help='Only reports with a confirmed diagnosis.')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        os.makedirs(output, exist_ok=True)
+        manifest = self.read_manifest(output, options)
+        if manifest['shard_size'] != options['shard_size']:
+            self.stdout.write(f"Keeping the folder's shard size of {manifest['shard_size']}.")
+
+        # Every report is compared with what the folder holds, not just ids
+        # above the last exported one: reports confirmed or fixed since are
+        # still picked up, and changed labels are recorded.
+        labels = exported_labels(output, manifest)
+        rows = ScanReport.objects.order_by('pk').values_list(
+            'pk', 'scan_image', 'source_file', 'confirmed_diagnosis', 'diagnosis', 'confidence',
+        )
+        storage = ScanReport._meta.get_field('scan_image').storage
+        details = {}
+        label_updates = []
+
+        def tasks():
+            for report_id, image, source, label, diagnosis, confidence in rows.iterator(chunk_size=2000):
+                label = label or ''
+                if report_id in labels:
+                    if labels[report_id] != label:
+                        label_updates.append((report_id, label))
+                    continue
+                if options['labelled_only'] and not label:
+                    continue
+                details[report_id] = (label, diagnosis, confidence)
+                yield report_id, storage.path(image), storage.path(source) if source else None
+
+        shard = ShardWriter(output, manifest)
+        exported = skipped = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for report_id, frames, error in ordered_map(pool, preprocess, tasks(), window=options['workers'] * 4):
+                label, diagnosis, confidence = details.pop(report_id)
+                if error is not None:
+                    if options['verbosity']:
+                        self.stderr.write(f"Skipping scan report {report_id}: {error}")
+                    skipped += 1
+                    continue
+                shard.add(report_id, frames, label, diagnosis, confidence)
+                exported += 1
+        shard.close()
+        write_label_updates(output, manifest, label_updates)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {exported} scan reports ({shard.frames_written} frames, {skipped} skipped) and "
+            f"{len(label_updates)} label updates to {output}: {manifest['rows']} frames in "
+            f"{len(manifest['shards'])} shards."
+        ))
+
+    @staticmethod
+    def read_manifest(output, options):
+        path = os.path.join(output, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return {
+                'format': 2, 'image_size': MODEL_INPUT_SIZE, 'shard_size': options['shard_size'],
+                'labelled_only': options['labelled_only'], 'rows': 0, 'shards': [], 'label_updates': [],
+            }
+        with open(path) as source:
+            manifest = json.load(source)
+        if manifest.get('labelled_only') != options['labelled_only']:
+            raise CommandError('The folder was exported with a different --labelled-only; use a new folder.')
+        # Format 1 resumed from a report id high-water mark instead
+        manifest.pop('last_report_id', None)
+        manifest.setdefault('label_updates', [])
+        manifest['format'] = 2
+        return manifest
+
+
+def exported_labels(output, manifest):
+    """
+    {report id: label} for every report in the folder's complete shards,
+    with the label updates applied in order.
+    """
+    labels = {}
+    for entry in manifest['shards'] + manifest['label_updates']:
+        with open(os.path.join(output, f"{entry['name']}.csv"), newline='') as source:
+            for row in csv.DictReader(source):
+                labels[int(row['report_id'])] = row['label']
+    return labels
+
+
+def write_label_updates(output, manifest, updates):
+    """
+    Writes `labels-NNNNN.csv` (report id, current label) for reports whose
+    label changed since they were exported, and records it in the manifest.
+    """
+    if not updates:
+        return
+    name = f"labels-{len(manifest['label_updates']):05d}"
+    base = os.path.join(output, name)
+    with open(f'{base}.csv.tmp', 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(LABEL_UPDATE_COLUMNS)
+        writer.writerows(updates)
+    os.replace(f'{base}.csv.tmp', f'{base}.csv')
+    manifest['label_updates'].append({'name': name, 'rows': len(updates)})
+    write_manifest(output, manifest)
+
+
+def write_manifest(output, manifest):
+    temporary = os.path.join(output, MANIFEST_NAME + '.tmp')
+    with open(temporary, 'w') as out:
+        json.dump(manifest, out, indent=2)
+    os.replace(temporary, os.path.join(output, MANIFEST_NAME))
+
+
+def ordered_map(pool, func, items, window):
+    """
+    pool.map that keeps at most `window` tasks in flight, so a huge
+    queryset is streamed instead of submitted all at once. Order is kept.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ShardWriter:
+    """
+    Buffers frames into `shard-NNNNN.npy` files of `shard_size` frames,
+    each next to a `shard-NNNNN.csv` index. A shard and its index are
+    written to temporary names and moved into place before the manifest
+    records them, so an interrupted export resumes after the last complete
+    shard: reports only in an unrecorded shard are exported again.
+    """
+
+    def __init__(self, output, manifest):
+        self.output = output
+        self.manifest = manifest
+        self.frames = []
+        self.index = []
+        self.frames_written = 0
+
+    def add(self, report_id, frames, label, diagnosis, confidence):
+        for number, frame in enumerate(frames):
+            self.index.append((report_id, number, label, diagnosis, confidence))
+            self.frames.append(frame)
+        if len(self.frames) >= self.manifest['shard_size']:
+            self.flush()
+
+    def flush(self):
+        if not self.frames:
+            return
+        name = f"shard-{len(self.manifest['shards']):05d}"
+        base = os.path.join(self.output, name)
+        with open(f'{base}.npy.tmp', 'wb') as out:
+            np.save(out, np.stack(self.frames), allow_pickle=False)
+        with open(f'{base}.csv.tmp', 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(INDEX_COLUMNS)
+            writer.writerows((row, *entry) for row, entry in enumerate(self.index))
+        os.replace(f'{base}.npy.tmp', f'{base}.npy')
+        os.replace(f'{base}.csv.tmp', f'{base}.csv')
+
+        self.manifest['shards'].append({'name': name, 'rows': len(self.frames)})
+        self.manifest['rows'] += len(self.frames)
+        write_manifest(self.output, self.manifest)
+        self.frames_written += len(self.frames)
+        self.frames, self.index = [], []
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,18 @@
+# backend/pulmoscan/management/commands/gc_scan_blobs.py
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pulmoscan.models import ScanBlob
+from pulmoscan.storage import BLOB_GRACE_PERIOD, delete_unreferenced_blob
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored scan files no ScanReport refers to any more (e.g. abandoned uploads). Safe to run any time.'
+
+    def handle(self, *args, **options):
+        candidates = ScanBlob.objects.filter(
+            refcount=0, last_seen__lt=timezone.now() - BLOB_GRACE_PERIOD,
+        ).values_list('name', flat=True)
+        deleted = sum(delete_unreferenced_blob(name) for name in list(candidates))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced scan files.'))
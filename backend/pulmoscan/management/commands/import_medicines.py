@@ -0,0 +1,32 @@
+# backend/pulmoscan/management/commands/import_medicines.py
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pulmoscan.imports import IMPORT_CHUNK_SIZE, ImportFileError, import_medicines
+
+
+class Command(BaseCommand):
+    help = 'Bulk-imports medicine batches from a CSV or XLSX file, upserting on (name, batch_number).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file with columns name, batch_number, expiry_date, quantity, price, supplier.')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows per transaction.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as file:
+                summary = import_medicines(file, options['path'], chunk_size=options['chunk_size'])
+        except (OSError, ImportFileError) as e:
+            raise CommandError(str(e))
+
+        for error in summary['errors']:
+            details = '; '.join(f'{field}: {message}' for field, message in error['errors'].items())
+            self.stderr.write(f"Row {error['row']}: {details}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['rows'] - len(summary['errors'])} of {summary['rows']} rows "
+            f"({summary['created']} new batches, {summary['updated']} updated) "
+            f"in {time.perf_counter() - started:.1f}s."
+        ))
@@ -0,0 +1,39 @@
+# backend/pulmoscan/management/commands/inference_sidecar.py
+
+import signal
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pulmoscan.sidecar import InferenceSidecar
+from pulmoscan.utils import ModelUnavailable
+
+
+class Command(BaseCommand):
+    help = ('Runs the inference sidecar: loads the model once and serves the web workers over a Unix '
+            'socket. Start it next to the web server and set INFERENCE_SOCKET to the same path in both, '
+            'so the web processes never import torch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.INFERENCE_SOCKET,
+                            help='Socket path (default: the INFERENCE_SOCKET setting).')
+        parser.add_argument('--max-batch', type=int, default=32,
+                            help='Most frames run in one forward pass (default 32).')
+        parser.add_argument('--batch-window', type=float, default=5,
+                            help='Milliseconds to wait for more requests to batch together (default 5).')
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError('No socket path: pass --socket or set INFERENCE_SOCKET.')
+        # Exit through serve_forever's cleanup (socket file removed) on SIGTERM too
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        sidecar = InferenceSidecar(options['socket'], options['max_batch'], options['batch_window'] / 1000)
+        try:
+            sidecar.serve_forever(ready=lambda: self.stdout.write(self.style.SUCCESS(
+                f"Inference sidecar listening on {options['socket']}"
+            )))
+        except ModelUnavailable as e:
+            raise CommandError(str(e))
+        except KeyboardInterrupt:
+            pass
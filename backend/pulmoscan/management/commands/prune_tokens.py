@@ -0,0 +1,17 @@
+# backend/pulmoscan/management/commands/prune_tokens.py
+
+from django.core.management.base import BaseCommand
+
+from pulmoscan.revocation import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = ('Deletes expired outstanding/blacklisted JWT refresh tokens in small batches, keeping '
+            'the token_blacklist tables bounded. Run on a schedule, e.g. hourly from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Tokens deleted per statement (default 5000).')
+
+    def handle(self, *args, **options):
+        removed = prune_expired_tokens(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Pruned {removed} expired tokens.'))
@@ -0,0 +1,14 @@
+# backend/pulmoscan/management/commands/rollup_consumption.py
+
+from django.core.management.base import BaseCommand
+
+from pulmoscan.analytics import rollup_consumption
+
+
+class Command(BaseCommand):
+    help = ('Brings the daily consumption rollup behind /api/dashboard/stock-forecast/ up to date with the '
+            'sales ledger. Run on a schedule, e.g. hourly from cron.')
+
+    def handle(self, *args, **options):
+        rows = rollup_consumption()
+        self.stdout.write(self.style.SUCCESS(f'Consumption rollup complete: {rows} medicine-days recomputed.'))
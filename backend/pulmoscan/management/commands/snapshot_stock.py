@@ -0,0 +1,29 @@
+# backend/pulmoscan/management/commands/snapshot_stock.py
+
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from pulmoscan.inventory import take_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Records end-of-day stock snapshots per medicine batch (defaults to yesterday). Run daily, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to snapshot, as YYYY-MM-DD. Defaults to yesterday.')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                day = parse_date(options['date'])
+            except ValueError:  # well-formed but impossible, e.g. 2024-02-30
+                day = None
+            if day is None:
+                raise CommandError(f"Invalid date: {options['date']}")
+        else:
+            day = date.today() - timedelta(days=1)
+
+        count = take_snapshot(day)
+        self.stdout.write(self.style.SUCCESS(f'Recorded {count} stock snapshots for {day}.'))
@@ -0,0 +1,14 @@
+# backend/pulmoscan/management/commands/sweep_alerts.py
+
+from django.core.management.base import BaseCommand
+
+from pulmoscan.alerts import refresh_alerts
+from pulmoscan.models import MedicineAlert
+
+
+class Command(BaseCommand):
+    help = 'Recomputes low-stock, expiring-soon and expired alerts for every medicine batch. Run daily, e.g. from cron.'
+
+    def handle(self, *args, **options):
+        refresh_alerts()
+        self.stdout.write(self.style.SUCCESS(f'Alert sweep complete: {MedicineAlert.objects.count()} active alerts.'))
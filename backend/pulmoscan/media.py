@@ -0,0 +1,227 @@
+# pulmoscan/media.py
+import hashlib
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import http_date, parse_http_date_safe
+
+# Signed media URLs are stable for a bucket so browsers can cache them,
+# and outlive a day so URLs in a list revalidated with a 304 until
+# midnight (see pulmoscan.conditional) still work.
+MEDIA_URL_BUCKET = 60 * 60  # seconds
+MEDIA_URL_MAX_AGE = 25 * 60 * 60  # seconds
+MEDIA_SIGNING_SALT = 'pulmoscan.media'
+
+# Files named by their SHA-256 never change, so clients may keep them
+CONTENT_ADDRESSED_NAME = re.compile(r'(?:^|/)[0-9a-f]{64}(?:\.[A-Za-z0-9]+)?$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # seconds
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class BucketedTimestampSigner(signing.TimestampSigner):
+    """
+    TimestampSigner whose timestamp is rounded down to MEDIA_URL_BUCKET,
+    so the same file signs to the same URL for the whole bucket.
+    """
+    def timestamp(self):
+        return signing.b62_encode(int(time.time()) // MEDIA_URL_BUCKET * MEDIA_URL_BUCKET)
+
+
+_signer = BucketedTimestampSigner(salt=MEDIA_SIGNING_SALT)
+
+
+def sign_media_name(name):
+    """
+    The `sig` query value granting access to the stored file `name`.
+    """
+    return _signer.sign(name)[len(name) + 1:]
+
+
+def media_signature_valid(name, signature):
+    try:
+        _signer.unsign(f'{name}:{signature}', max_age=MEDIA_URL_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def media_url_prefix(request=None):
+    """
+    Absolute (with a request) URL prefix of the protected media view.
+    """
+    prefix = reverse('protected-media', kwargs={'name': 'x'})[:-1]
+    return request.build_absolute_uri(prefix) if request is not None else prefix
+
+
+def signed_media_url(name, request=None, prefix=None):
+    """
+    URL of the protected media view for `name`, carrying a signature so it
+    works as a plain <img src> without the Authorization header. Pass a
+    precomputed `prefix` (media_url_prefix) when building many URLs.
+    """
+    if not name:
+        return None
+    if prefix is None:
+        prefix = media_url_prefix(request)
+    return f'{prefix}{filepath_to_uri(name)}?sig={sign_media_name(name)}'
+
+
+# --- Serving ---
+def _byte_range(header, size):
+    """
+    (start, end) inclusive for a single-range `Range` header, None to
+    serve the whole file (absent, malformed or multi-range headers) and
+    False when the range cannot be satisfied.
+    """
+    match = RANGE_HEADER.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final `last` bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = file.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+
+
+def _content_etag(name):
+    match = CONTENT_ADDRESSED_NAME.search(name)
+    return '"%s"' % match.group(0).lstrip('/').split('.')[0] if match else None
+
+
+def _validators(name, stat):
+    etag = _content_etag(name) or '"%x-%x"' % (stat.st_size, stat.st_mtime_ns)
+    return etag, int(stat.st_mtime)
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve_media(request, name):
+    """
+    Response delivering the stored file `name` after access was checked.
+
+    With MEDIA_ACCEL = 'nginx' the body is handed to the front server via
+    X-Accel-Redirect (MEDIA_ACCEL_PREFIX must map to an `internal`
+    location aliasing MEDIA_ROOT); with 'sendfile' via X-Sendfile (Apache
+    mod_xsendfile, lighttpd). Either way no worker streams the bytes, and
+    the front server handles Range and conditional requests itself.
+
+    Otherwise the file is served here: 304/412 from ETag and
+    Last-Modified, single byte ranges as 206 (416 when unsatisfiable), and
+    full bodies through FileResponse, which lets the WSGI server use
+    sendfile(2).
+    """
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(path)
+    except (ValueError, OSError):
+        raise Http404('File not found.')
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    etag, last_modified = _validators(name, stat)
+    accel = getattr(settings, 'MEDIA_ACCEL', None)
+
+    if accel in ('nginx', 'sendfile'):
+        response = HttpResponse(content_type=content_type)
+        if accel == 'nginx':
+            response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/') + filepath_to_uri(name)
+        else:
+            response['X-Sendfile'] = path
+    else:
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            response = not_modified
+        else:
+            byte_range = None
+            if _if_range_matches(request, etag, last_modified):
+                byte_range = _byte_range(request.META.get('HTTP_RANGE'), stat.st_size)
+            if byte_range is False:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+            if byte_range is None:
+                response = FileResponse(open(path, 'rb'), content_type=content_type)
+            else:
+                start, end = byte_range
+                response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type=content_type)
+                response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+                response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if CONTENT_ADDRESSED_NAME.search(name):
+        patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def serve_content(request, name, content):
+    """
+    Like serve_media for a file already read into memory (archived scans,
+    read back from cold storage; see pulmoscan.archive): conditional
+    requests on the ETag, single byte ranges and the same caching.
+    """
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    etag = _content_etag(name) or '"%s"' % hashlib.sha256(content).hexdigest()[:32]
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        byte_range = None
+        if _if_range_matches(request, etag, None):
+            byte_range = _byte_range(request.META.get('HTTP_RANGE'), len(content))
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{len(content)}'
+            return response
+        if byte_range is None:
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            start, end = byte_range
+            response = HttpResponse(content[start:end + 1], status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if CONTENT_ADDRESSED_NAME.search(name):
+        patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
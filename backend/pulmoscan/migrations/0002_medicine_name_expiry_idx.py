@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-19 17:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['name', 'expiry_date'], name='medicine_name_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-19 17:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0003_stock_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_consumption', to='pulmoscan.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='dailyconsumption_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medicine', 'day'), name='unique_medicine_consumption_per_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-19 17:11
+
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_alerts(apps, schema_editor):
+    # Mirrors pulmoscan.alerts at the time of writing (threshold 10, 30-day expiry window)
+    Medicine = apps.get_model('pulmoscan', 'Medicine')
+    MedicineAlert = apps.get_model('pulmoscan', 'MedicineAlert')
+    today = date.today()
+    alerts = []
+    for medicine_id, quantity, expiry_date in Medicine.objects.values_list('id', 'quantity', 'expiry_date').iterator():
+        if quantity <= 10:
+            alerts.append(MedicineAlert(medicine_id=medicine_id, kind='low_stock'))
+        if expiry_date < today:
+            alerts.append(MedicineAlert(medicine_id=medicine_id, kind='expired'))
+        elif expiry_date <= today + timedelta(days=30):
+            alerts.append(MedicineAlert(medicine_id=medicine_id, kind='expiring_soon'))
+    MedicineAlert.objects.bulk_create(alerts, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0004_consumption_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('low_stock', 'Low stock'), ('expiring_soon', 'Expiring soon'), ('expired', 'Expired')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='pulmoscan.medicine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind'], name='medicinealert_kind_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medicine', 'kind'), name='unique_medicine_alert_kind')],
+            },
+        ),
+        migrations.RunPython(backfill_alerts, migrations.RunPython.noop),
+    ]
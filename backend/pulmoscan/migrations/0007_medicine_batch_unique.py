@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-19 17:21
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def disambiguate_duplicate_batches(apps, schema_editor):
+    # Rows entered twice under the same name and batch number keep their
+    # stock and history; all but the oldest get their id appended so the
+    # constraint can be created.
+    Medicine = apps.get_model('pulmoscan', 'Medicine')
+    duplicates = (
+        Medicine.objects.values('name', 'batch_number')
+        .annotate(rows=Count('id'), first_id=Min('id'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        for medicine in Medicine.objects.filter(
+            name=duplicate['name'], batch_number=duplicate['batch_number'], id__gt=duplicate['first_id'],
+        ):
+            suffix = f"-{medicine.id}"
+            medicine.batch_number = medicine.batch_number[:50 - len(suffix)] + suffix
+            medicine.save(update_fields=['batch_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0006_resource_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(disambiguate_duplicate_batches, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='medicine',
+            constraint=models.UniqueConstraint(fields=('name', 'batch_number'), name='unique_medicine_batch'),
+        ),
+    ]
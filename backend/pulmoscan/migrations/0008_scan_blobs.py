@@ -0,0 +1,50 @@
+# Generated by Django 5.2.1 on 2026-10-19 17:26
+
+import os
+
+import django.utils.timezone
+import pulmoscan.storage
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_references(apps, schema_editor):
+    # Files uploaded before content addressing keep their names; give them
+    # blob rows so deleting their reports releases them like any other.
+    ScanReport = apps.get_model('pulmoscan', 'ScanReport')
+    ScanBlob = apps.get_model('pulmoscan', 'ScanBlob')
+    blobs = []
+    for row in ScanReport.objects.exclude(scan_image='').values('scan_image').annotate(refs=Count('id')).order_by():
+        path = os.path.join(settings.MEDIA_ROOT, row['scan_image'])
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        blobs.append(ScanBlob(name=row['scan_image'], refcount=row['refs'], size=size))
+    ScanBlob.objects.bulk_create(blobs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0007_medicine_batch_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scanreport',
+            name='scan_image',
+            field=models.ImageField(storage=pulmoscan.storage.ContentAddressedStorage(), upload_to='scans/'),
+        ),
+        migrations.CreateModel(
+            name='ScanBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['refcount', 'last_seen'], name='scanblob_refcount_idx')],
+            },
+        ),
+        migrations.RunPython(count_existing_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-19 17:28
+
+import pulmoscan.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0008_scan_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanreport',
+            name='dicom_metadata',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanreport',
+            name='source_file',
+            field=models.FileField(blank=True, storage=pulmoscan.storage.ContentAddressedStorage(), upload_to='dicom/'),
+        ),
+    ]
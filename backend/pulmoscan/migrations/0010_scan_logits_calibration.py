@@ -0,0 +1,39 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0009_scan_dicom_source'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisCalibration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('threshold', models.FloatField()),
+                ('temperature', models.FloatField(default=1.0)),
+                ('labelled_scans', models.PositiveIntegerField(default=0)),
+                ('auc', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scanreport',
+            name='confirmed_diagnosis',
+            field=models.CharField(blank=True, choices=[('Normal', 'Normal'), ('Pneumonia', 'Pneumonia')], max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanreport',
+            name='normal_logit',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanreport',
+            name='pneumonia_logit',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0010_scan_logits_calibration'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scanreport',
+            index=models.Index(fields=['date_uploaded'], name='scanreport_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scanreport',
+            index=models.Index(fields=['diagnosis', 'date_uploaded'], name='scanreport_diagnosis_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0011_scanreport_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanreport',
+            name='analysis_stage',
+            field=models.CharField(blank=True, choices=[('screen', 'Reduced-resolution screen'), ('full', 'Full resolution')], max_length=10, null=True),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:25
+
+from django.db import migrations, models
+
+
+def create_archive_table(apps, schema_editor):
+    ArchivedScanReport = apps.get_model('pulmoscan', 'ArchivedScanReport')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(ArchivedScanReport)
+        return
+    # Partitioned by month of upload; archive_scans adds the partitions as
+    # it goes. The partition key has to be part of the primary key.
+    quote = schema_editor.quote_name
+    columns = ', '.join(
+        f'{quote(field.column)} {field.db_type(schema_editor.connection)}{"" if field.null else " NOT NULL"}'
+        for field in ArchivedScanReport._meta.local_fields
+    )
+    schema_editor.execute(
+        f'CREATE TABLE {quote(ArchivedScanReport._meta.db_table)} ({columns}, '
+        f'PRIMARY KEY ("id", "date_uploaded")) PARTITION BY RANGE ("date_uploaded")'
+    )
+
+
+def drop_archive_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('pulmoscan', 'ArchivedScanReport'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0012_scanreport_analysis_stage'),
+    ]
+
+    operations = [
+        # The table itself is created below, partitioned on PostgreSQL
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='ArchivedScanReport',
+                fields=[
+                    ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                    ('patient_name', models.CharField(max_length=100)),
+                    ('scan_image', models.CharField(max_length=100)),
+                    ('source_file', models.CharField(blank=True, max_length=100)),
+                    ('dicom_metadata', models.JSONField(blank=True, null=True)),
+                    ('diagnosis', models.TextField()),
+                    ('confidence', models.FloatField(blank=True, null=True)),
+                    ('normal_logit', models.FloatField(blank=True, null=True)),
+                    ('pneumonia_logit', models.FloatField(blank=True, null=True)),
+                    ('analysis_stage', models.CharField(blank=True, max_length=10, null=True)),
+                    ('confirmed_diagnosis', models.CharField(blank=True, max_length=20, null=True)),
+                    ('date_uploaded', models.DateTimeField()),
+                    ('user_id', models.BigIntegerField(blank=True, null=True)),
+                    ('archived_at', models.DateTimeField()),
+                ],
+                options={
+                    'db_table': 'pulmoscan_scanreport_archive',
+                },
+            ),
+        ]),
+        migrations.RunPython(create_archive_table, drop_archive_table, hints={'model_name': 'archivedscanreport'}),
+        migrations.CreateModel(
+            name='ColdBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('pack', models.CharField(max_length=100)),
+                ('pack_offset', models.BigIntegerField()),
+                ('stored_size', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('codec', models.CharField(max_length=8)),
+            ],
+        ),
+    ]
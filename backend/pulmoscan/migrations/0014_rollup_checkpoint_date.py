@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-19 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pulmoscan', '0013_scan_archive'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='rollupcheckpoint',
+            name='last_transaction_id',
+        ),
+        migrations.AddField(
+            model_name='rollupcheckpoint',
+            name='rolled_up_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
+from django.utils import timezone
+
+from .storage import scan_storage
 
 class CustomUser(AbstractUser):
     groups = models.ManyToManyField(
@@ -41,9 +44,45 @@ class Medicine(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     supplier = models.CharField(max_length=100)
 
+    class Meta:
+        constraints = [
+            # A batch is identified by its name and batch number; bulk imports upsert on it
+            models.UniqueConstraint(fields=['name', 'batch_number'], name='unique_medicine_batch'),
+        ]
+        indexes = [
+            # Backs FEFO allocation: all batches of a medicine, oldest expiry first
+            models.Index(fields=['name', 'expiry_date'], name='medicine_name_expiry_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} (Batch: {self.batch_number})"
 
+class MedicineAlert(models.Model):
+    """
+    Materialized low-stock / expiry state of a medicine batch. Maintained by
+    `pulmoscan.alerts.refresh_alerts` on writes and by the daily
+    `sweep_alerts` command as dates pass.
+    """
+    KIND_CHOICES = (
+        ('low_stock', 'Low stock'),
+        ('expiring_soon', 'Expiring soon'),
+        ('expired', 'Expired'),
+    )
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='alerts')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'kind'], name='unique_medicine_alert_kind'),
+        ]
+        indexes = [
+            models.Index(fields=['kind'], name='medicinealert_kind_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.medicine_id}"
+
 class InventoryTransaction(models.Model):
     TRANSACTION_TYPE = (('purchase', 'Purchase'), ('sale', 'Sale'))
     medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE)
@@ -53,20 +92,202 @@ class InventoryTransaction(models.Model):
     # --- ADD THIS LINE ---
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='inventory_transactions')
 
+    class Meta:
+        indexes = [
+            # Bounded range scans when replaying the ledger from a stock snapshot
+            models.Index(fields=['date'], name='inventorytx_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.transaction_type} - {self.medicine.name} x{self.quantity}"
 
+class StockSnapshot(models.Model):
+    """
+    End-of-day quantity of one medicine batch, written by the
+    `snapshot_stock` management command.
+    """
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='snapshots')
+    date = models.DateField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'date'], name='unique_medicine_snapshot_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='stocksnapshot_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.medicine_id} @ {self.date}: {self.quantity}"
+
+class DailyConsumption(models.Model):
+    """
+    Units of one medicine batch sold on one day, rolled up from
+    InventoryTransaction sales by `pulmoscan.analytics.rollup_consumption`.
+    """
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='daily_consumption')
+    day = models.DateField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'day'], name='unique_medicine_consumption_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='dailyconsumption_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.medicine_id} @ {self.day}: {self.quantity}"
+
+class RollupCheckpoint(models.Model):
+    """
+    When a rollup table was last brought up to date, so the next run only
+    recomputes the days since then (less a safety lag).
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    rolled_up_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.rolled_up_until}"
+
+class ResourceVersion(models.Model):
+    """
+    Change counter per API resource ('medicines', 'inventory', 'scans',
+    'consumption'), bumped by signals on every write and by the rollups.
+    Serves as the cheap validator behind ETag / Last-Modified on the read
+    endpoints.
+    """
+    key = models.CharField(max_length=30, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+class ScanBlob(models.Model):
+    """
+    One stored scan file (image or DICOM source), named by its content
+    hash, and the number of ScanReport fields referring to it. Maintained
+    by signals and by ContentAddressedStorage; see pulmoscan.storage.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    refcount = models.PositiveIntegerField(default=0)
+    size = models.PositiveBigIntegerField(default=0)
+    # Last time the content was stored or deduplicated against
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Finding unreferenced blobs for gc_scan_blobs
+            models.Index(fields=['refcount', 'last_seen'], name='scanblob_refcount_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+class DiagnosisCalibration(models.Model):
+    """
+    Pneumonia threshold and softmax temperature fitted by the
+    `calibrate_threshold` command. The latest row applies to every scan;
+    see pulmoscan.calibration.
+    """
+    threshold = models.FloatField()
+    temperature = models.FloatField(default=1.0)
+    labelled_scans = models.PositiveIntegerField(default=0)
+    auc = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"threshold {self.threshold:.3f}, temperature {self.temperature:.3f} ({self.created_at:%Y-%m-%d})"
+
 class ScanReport(models.Model):
+    CONFIRMED_DIAGNOSIS_CHOICES = (
+        ('Normal', 'Normal'),
+        ('Pneumonia', 'Pneumonia'),
+    )
+    ANALYSIS_STAGE_CHOICES = (
+        ('screen', 'Reduced-resolution screen'),
+        ('full', 'Full resolution'),
+    )
     patient_name = models.CharField(max_length=100)
-    scan_image = models.ImageField(upload_to='scans/')
+    scan_image = models.ImageField(upload_to='scans/', storage=scan_storage)
+    # Original upload when it was DICOM; scan_image then holds a PNG preview
+    source_file = models.FileField(upload_to='dicom/', storage=scan_storage, blank=True)
+    dicom_metadata = models.JSONField(null=True, blank=True)
     diagnosis = models.TextField(default="Pending Analysis")
     confidence = models.FloatField(null=True, blank=True)
+    # Raw model outputs (of the deciding frame for multi-frame studies), so
+    # diagnoses can be re-derived under a new calibration without inference
+    normal_logit = models.FloatField(null=True, blank=True)
+    pneumonia_logit = models.FloatField(null=True, blank=True)
+    # Cascade stage that decided (pulmoscan.inference.analyse_frames); logits
+    # are only stored for full-resolution passes
+    analysis_stage = models.CharField(max_length=10, choices=ANALYSIS_STAGE_CHOICES, null=True, blank=True)
+    # Clinician-confirmed outcome; the labels `calibrate_threshold` fits to
+    confirmed_diagnosis = models.CharField(max_length=20, choices=CONFIRMED_DIAGNOSIS_CHOICES, null=True, blank=True)
     date_uploaded = models.DateTimeField(auto_now_add=True)
     # --- ADD THIS LINE ---
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='scan_reports')
 
+    class Meta:
+        indexes = [
+            # Newest-first lists and the admin's date drill-down
+            models.Index(fields=['date_uploaded'], name='scanreport_uploaded_idx'),
+            # Admin diagnosis filter, still ordered by upload date
+            models.Index(fields=['diagnosis', 'date_uploaded'], name='scanreport_diagnosis_idx'),
+        ]
+
     def __str__(self):
         return f"Scan: {self.patient_name} - {self.diagnosis}"
+
+class ArchivedScanReport(models.Model):
+    """
+    A ScanReport moved out of the hot table by the `archive_scans` command,
+    with the same columns (stored file names instead of file fields, the
+    user as a bare id) plus `archived_at`. Lives in the `archive` database
+    on SQLite and in a table partitioned by month of date_uploaded on
+    PostgreSQL; see pulmoscan.archive. A field added to ScanReport needs
+    adding here too.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patient_name = models.CharField(max_length=100)
+    scan_image = models.CharField(max_length=100)
+    source_file = models.CharField(max_length=100, blank=True)
+    dicom_metadata = models.JSONField(null=True, blank=True)
+    diagnosis = models.TextField()
+    confidence = models.FloatField(null=True, blank=True)
+    normal_logit = models.FloatField(null=True, blank=True)
+    pneumonia_logit = models.FloatField(null=True, blank=True)
+    analysis_stage = models.CharField(max_length=10, null=True, blank=True)
+    confirmed_diagnosis = models.CharField(max_length=20, null=True, blank=True)
+    date_uploaded = models.DateTimeField()
+    user_id = models.BigIntegerField(null=True, blank=True)
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'pulmoscan_scanreport_archive'
+
+    def __str__(self):
+        return f"Archived scan {self.id}: {self.patient_name} - {self.diagnosis}"
+
+class ColdBlob(models.Model):
+    """
+    Where a scan file archived by `archive_scans` sits in cold storage:
+    its pack file, byte offset and stored size, the original size and the
+    codec ('xz' or 'raw'). Kept next to ArchivedScanReport.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    pack = models.CharField(max_length=100)
+    pack_offset = models.BigIntegerField()
+    stored_size = models.BigIntegerField()
+    size = models.BigIntegerField()
+    codec = models.CharField(max_length=8)
+
+    def __str__(self):
+        return f"{self.name} in {self.pack}"
     
 
 
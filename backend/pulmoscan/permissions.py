@@ -1,5 +1,19 @@
 from rest_framework.permissions import BasePermission
 
+
+def user_role(user):
+    """
+    Role of an authenticated user: read from the token claims for JWT
+    requests (pulmoscan.authentication.ClaimsUser), or from the profile row
+    for real User instances (admin session, tests).
+    """
+    role = getattr(user, 'role', None)
+    if role is not None:
+        return role
+    # IMPORTANT: Use 'profile' because of related_name='profile' on OneToOneField
+    profile = getattr(user, 'profile', None)
+    return getattr(profile, 'role', None)
+
 class IsDoctor(BasePermission):
     """
     Custom permission to only allow doctors (or admins who can act as doctors) to access.
@@ -9,10 +23,8 @@ class IsDoctor(BasePermission):
         if not request.user.is_authenticated:
             return False
 
-        # Check if user is staff (admin) or has a profile with 'doctor' role
-        # IMPORTANT: Use 'profile' because of related_name='profile' on OneToOneField
-        return request.user.is_staff or \
-               (hasattr(request.user, 'profile') and request.user.profile.role == 'doctor')
+        # Check if user is staff (admin) or has the 'doctor' role
+        return request.user.is_staff or user_role(request.user) == 'doctor'
 
 class IsPharmacist(BasePermission):
     """
@@ -22,13 +34,11 @@ class IsPharmacist(BasePermission):
         if not request.user.is_authenticated:
             return False
 
-        # IMPORTANT: Use 'profile' here too
-        return request.user.is_staff or \
-               (hasattr(request.user, 'profile') and request.user.profile.role == 'pharmacist')
+        return request.user.is_staff or user_role(request.user) == 'pharmacist'
 
 class IsAdminUserCustom(BasePermission):
     """
     Custom permission to only allow users with is_staff=True to access.
     """
     def has_permission(self, request, view):
-        return request.user.is_authenticated and request.user.is_staff
\ No newline at end of file
+        return request.user.is_authenticated and request.user.is_staff
@@ -0,0 +1,62 @@
+# pulmoscan/renderers.py
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to DRF's stdlib-json renderer
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson when it is installed.
+
+    orjson encodes straight to UTF-8 bytes in C, several times faster than
+    the stdlib encoder on large lists. Anything orjson cannot encode
+    natively (Decimal, lazy strings, ...) goes through DRF's own encoder so
+    the output stays the same. Indented output (the browsable API) and
+    environments without orjson use the stock renderer.
+    """
+    orjson_options = (orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=JSONEncoder().default, option=self.orjson_options)
+
+
+def dumps(data):
+    """
+    Compact JSON bytes for one value, through orjson when available.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=JSONEncoder().default, option=FastJSONRenderer.orjson_options)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class StreamingExportRenderer(BaseRenderer):
+    """
+    Content-negotiation stand-in for the streamed export formats. Exports
+    return a StreamingHttpResponse that is never passed through render(),
+    and ExportMixin hands error payloads (403, 400...) to the JSON
+    renderer; this only encodes JSON as a fallback.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b'' if data is None else dumps(data)
+
+
+class CSVExportRenderer(StreamingExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class NDJSONExportRenderer(StreamingExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
@@ -0,0 +1,201 @@
+# pulmoscan/revocation.py
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+# How stale this process's view of blacklists written by *other* workers
+# may get. Tokens blacklisted in this process are seen immediately.
+SYNC_INTERVAL = 2.0  # seconds
+# Longest a blacklist INSERT is expected to stay uncommitted
+SYNC_OVERLAP = 10.0  # seconds
+# Full reload, dropping expired entries so the filter never saturates
+REBUILD_INTERVAL = 15 * 60  # seconds
+BLOOM_CAPACITY = 100_000
+BLOOM_ERROR_RATE = 0.001
+CONFIRMED_CACHE_SIZE = 4096
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings: no false negatives, roughly
+    `error_rate` false positives at `capacity` items.
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """
+    In-process answer to "is this refresh token blacklisted?".
+
+    Blacklisted JTIs are mirrored into a Bloom filter that is topped up
+    incrementally at most every SYNC_INTERVAL seconds and rebuilt from
+    unexpired rows every REBUILD_INTERVAL. A miss in the filter means "not
+    revoked" with no query; a hit is confirmed against the database once
+    and remembered in a small LRU, so Bloom false positives cost one
+    indexed lookup.
+
+    Ids are assigned at INSERT but become visible at COMMIT, so a top-up
+    re-reads every id above the high-water mark seen SYNC_OVERLAP seconds
+    before the previous sync, not just the ids above the latest one. One
+    thread syncs at a time, querying outside the lock; the others keep
+    answering from the current filter meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._syncing = False
+        self._synced_at = 0.0
+        self._built_at = 0.0
+        # (monotonic time, highest BlacklistedToken id read) per sync
+        self._marks = deque()
+        self._confirmed = OrderedDict()
+
+    def _sync(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._syncing or (self._bloom is not None and now - self._synced_at < SYNC_INTERVAL):
+                return
+            self._syncing = True
+            rebuild = self._bloom is None or now - self._built_at >= REBUILD_INTERVAL
+            while len(self._marks) > 1 and self._marks[1][0] <= self._synced_at - SYNC_OVERLAP:
+                self._marks.popleft()
+            floor = self._marks[0][1] if self._marks and self._marks[0][0] <= self._synced_at - SYNC_OVERLAP else 0
+
+        try:
+            rows = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+            if not rebuild:
+                rows = rows.filter(id__gt=floor)
+            rows = list(rows.order_by('id').values_list('id', 'token__jti'))
+            if rebuild:
+                bloom = BloomFilter()
+                for _, jti in rows:
+                    bloom.add(jti)
+        except BaseException:
+            with self._lock:
+                self._syncing = False
+            raise
+
+        with self._lock:
+            if rebuild:
+                # Keep local additions made while the new filter was loading
+                for jti in self._confirmed:
+                    bloom.add(jti)
+                self._bloom, self._built_at = bloom, now
+            else:
+                for _, jti in rows:
+                    self._bloom.add(jti)
+            high_water = max(rows[-1][0] if rows else 0, self._marks[-1][1] if self._marks else 0)
+            self._marks.append((now, high_water))
+            self._synced_at, self._syncing = now, False
+
+    def is_revoked(self, jti):
+        with self._lock:
+            if jti in self._confirmed:
+                self._confirmed.move_to_end(jti)
+                return True
+        self._sync()
+        with self._lock:
+            # No filter yet while another thread builds the first one
+            if self._bloom is not None and jti not in self._bloom:
+                return False
+        revoked = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        if revoked:
+            self.add(jti)
+        return revoked
+
+    def add(self, jti):
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+            self._confirmed[jti] = True
+            self._confirmed.move_to_end(jti)
+            while len(self._confirmed) > CONFIRMED_CACHE_SIZE:
+                self._confirmed.popitem(last=False)
+
+
+revocation_filter = RevocationFilter()
+
+
+class FilteredRefreshToken(RefreshToken):
+    """
+    RefreshToken whose blacklist check goes through the in-process
+    RevocationFilter, and whose blacklist/outstand writes are single
+    INSERTs instead of user lookups plus get_or_create round trips.
+    """
+
+    def check_blacklist(self):
+        if revocation_filter.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+    def outstand(self):
+        OutstandingToken.objects.bulk_create(
+            [OutstandingToken(
+                jti=self.payload[api_settings.JTI_CLAIM],
+                user_id=self.payload.get(api_settings.USER_ID_CLAIM),
+                created_at=self.current_time,
+                token=str(self),
+                expires_at=datetime_from_epoch(self.payload['exp']),
+            )],
+            ignore_conflicts=True,
+        )
+
+    def blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        token_id = OutstandingToken.objects.filter(jti=jti).order_by().values_list('id', flat=True).first()
+        if token_id is None:
+            # Issued before outstanding tokens were tracked: take the slow path
+            blacklisted = super().blacklist()
+        else:
+            BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=token_id)], ignore_conflicts=True)
+            blacklisted = None
+        revocation_filter.add(jti)
+        return blacklisted
+
+
+def prune_expired_tokens(batch_size=5000):
+    """
+    Deletes expired outstanding tokens, and with them their blacklist rows,
+    in primary-key batches. Tokens expire in roughly issue order, so each
+    batch is a short index range scan from the start of the table and no
+    single DELETE holds locks for long. Returns the number of tokens removed.
+    """
+    removed = 0
+    now = timezone.now()
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(expires_at__lt=now)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        BlacklistedToken.objects.filter(token_id__in=ids).delete()
+        OutstandingToken.objects.filter(id__in=ids).delete()
+        removed += len(ids)
@@ -1,7 +1,37 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import models
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import Medicine, InventoryTransaction, ScanReport, UserProfile
+from .fastpath import ValuesSerializer
+from .dicom import DicomError, is_dicom, read_header
+from .media import signed_media_url
+
+
+class SignedFileField(serializers.FileField):
+    """
+    FileField represented by a signed URL on the protected media view
+    instead of the public MEDIA_URL, which is not served in production.
+    """
+    def to_representation(self, value):
+        if not value:
+            return None
+        return signed_media_url(value.name, self.context.get('request'))
+
+class SignedImageField(SignedFileField, serializers.ImageField):
+    """
+    SignedFileField for images. DICOM uploads are let through without the
+    Pillow check; ScanReportViewSet turns them into a PNG preview.
+    """
+    def to_internal_value(self, data):
+        if hasattr(data, 'seek') and is_dicom(data):
+            try:
+                read_header(data)
+            except DicomError as e:
+                raise serializers.ValidationError(str(e))
+            return serializers.FileField.to_internal_value(self, data)
+        return super().to_internal_value(data)
+
 
 class MedicineSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,10 +43,46 @@ class InventoryTransactionSerializer(serializers.ModelSerializer):
         model = InventoryTransaction
         fields = '__all__'
 
+class FefoSaleSerializer(serializers.Serializer):
+    """
+    Input for a sale allocated first-expiry-first-out across a medicine's batches.
+    """
+    name = serializers.CharField(max_length=100)
+    quantity = serializers.IntegerField(min_value=1)
+
 class ScanReportSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: SignedImageField,
+        models.FileField: SignedFileField,
+    }
+
     class Meta:
         model = ScanReport
         fields = '__all__'
+        read_only_fields = ('source_file', 'dicom_metadata', 'normal_logit', 'pneumonia_logit', 'analysis_stage')
+
+# --- Read-optimized serializers for list and dashboard endpoints ---
+# Same output as the ModelSerializers above, built from .values_list() rows.
+class MedicineReadSerializer(ValuesSerializer):
+    model = Medicine
+    fields = ('id', 'name', 'batch_number', 'expiry_date', 'quantity', 'price', 'supplier')
+    formatters = {'expiry_date': 'date', 'price': 'decimal'}
+
+class InventoryTransactionReadSerializer(ValuesSerializer):
+    model = InventoryTransaction
+    fields = ('id', 'transaction_type', 'quantity', 'date', 'medicine', 'user')
+    formatters = {'date': 'datetime'}
+    sources = {'medicine': 'medicine_id', 'user': 'user_id'}
+
+class ScanReportReadSerializer(ValuesSerializer):
+    model = ScanReport
+    fields = (
+        'id', 'patient_name', 'scan_image', 'source_file', 'dicom_metadata', 'diagnosis', 'confidence',
+        'normal_logit', 'pneumonia_logit', 'analysis_stage', 'confirmed_diagnosis', 'date_uploaded', 'user',
+    )
+    formatters = {'scan_image': 'file_url', 'source_file': 'file_url', 'date_uploaded': 'datetime'}
+    sources = {'user': 'user_id'}
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -32,10 +98,13 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ('user', 'role')
 
     
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from pulmoscan.models import CustomUser, UserProfile # Ensure UserProfile is correctly imported
+from pulmoscan.revocation import FilteredRefreshToken
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = FilteredRefreshToken
+
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
@@ -56,6 +125,14 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         return token
 
 
+class FilteredTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that checks and records revocations through
+    pulmoscan.revocation instead of querying the blacklist tables each time.
+    """
+    token_class = FilteredRefreshToken
+
+
 
 
 
@@ -0,0 +1,143 @@
+# pulmoscan/sidecar.py
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+
+import numpy as np
+
+from . import utils
+from .imaging import MODEL_INPUT_SIZE
+from .inference import (
+    PROTOCOL_MAGIC, REQUEST_HEADER, RESPONSE_HEADER, STATUS_ERROR, STATUS_OK, MAX_REQUEST_FRAMES,
+    MIN_FRAME_SIZE, class_names, recv_exactly,
+)
+
+
+class _Job:
+    def __init__(self, frames):
+        self.frames = frames
+        self.logits = self.embeddings = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceSidecar:
+    """
+    Owns the model and serves `pulmoscan.inference.SidecarClient`s on a
+    Unix stream socket (protocol in pulmoscan.inference).
+
+    Each client connection gets a thread that only does socket I/O; all
+    forward passes happen on one model thread, which gathers the frames of
+    every request arriving within `batch_window` seconds (up to
+    `max_batch` frames) into a single batch. Under concurrent uploads this
+    amortises the per-call overhead instead of running requests side by
+    side on competing threads.
+    """
+
+    def __init__(self, path, max_batch=32, batch_window=0.005):
+        self.path = path
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self._jobs = queue.Queue()
+
+    def serve_forever(self, ready=None):
+        utils.predict(np.zeros((1, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), dtype=np.uint8))  # load and warm up
+        threading.Thread(target=self._run_model, name='inference-model', daemon=True).start()
+
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.unlink(self.path)  # left over from a previous run
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o660)  # the web workers' user or group only
+        server.listen(64)
+        if ready is not None:
+            ready()
+        try:
+            while True:
+                connection, _ = server.accept()
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            server.close()
+            os.unlink(self.path)
+
+    def _serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    header = recv_exactly(connection, REQUEST_HEADER.size)
+                except (ConnectionError, OSError):
+                    return  # client went away (normal for pooled connections)
+                magic, count, height, width = REQUEST_HEADER.unpack(header)
+                if magic != PROTOCOL_MAGIC:
+                    return
+                if not 0 < count <= MAX_REQUEST_FRAMES or height != width or not MIN_FRAME_SIZE <= height <= MODEL_INPUT_SIZE:
+                    # The payload cannot be trusted to be skipped safely either
+                    self._reply_error(
+                        connection,
+                        f'Expected 1-{MAX_REQUEST_FRAMES} square frames of {MIN_FRAME_SIZE}-{MODEL_INPUT_SIZE} pixels.',
+                    )
+                    return
+                try:
+                    pixels = recv_exactly(connection, count * height * width)
+                except (ConnectionError, OSError):
+                    return
+                job = _Job(np.frombuffer(pixels, dtype=np.uint8).reshape(count, height, width))
+                self._jobs.put(job)
+                job.done.wait()
+                try:
+                    if job.error is not None:
+                        self._reply_error(connection, job.error)
+                    else:
+                        logits = np.ascontiguousarray(job.logits, dtype='<f4')
+                        embeddings = np.ascontiguousarray(job.embeddings, dtype='<f2')
+                        connection.sendall(
+                            RESPONSE_HEADER.pack(PROTOCOL_MAGIC, STATUS_OK, count, len(class_names), embeddings.shape[1])
+                            + logits.tobytes() + embeddings.tobytes()
+                        )
+                except OSError:
+                    return
+
+    @staticmethod
+    def _reply_error(connection, message):
+        message = message.encode()
+        connection.sendall(RESPONSE_HEADER.pack(PROTOCOL_MAGIC, STATUS_ERROR, len(message), 0, 0) + message)
+
+    def _run_model(self):
+        while True:
+            jobs = [self._jobs.get()]
+            frames = len(jobs[0].frames)
+            deadline = time.monotonic() + self.batch_window
+            while frames < self.max_batch:
+                try:
+                    job = self._jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                frames += len(job.frames)
+
+            # One forward pass per frame size (cascade screens are smaller)
+            by_size = {}
+            for job in jobs:
+                by_size.setdefault(job.frames.shape[1:], []).append(job)
+            for group in by_size.values():
+                self._predict(group)
+
+    @staticmethod
+    def _predict(jobs):
+        try:
+            logits, embeddings = utils.predict(np.concatenate([job.frames for job in jobs]))
+        except Exception as e:
+            for job in jobs:
+                job.error = f'Inference failed: {e}'
+                job.done.set()
+            return
+        start = 0
+        for job in jobs:
+            job.logits = logits[start:start + len(job.frames)]
+            job.embeddings = embeddings[start:start + len(job.frames)]
+            start += len(job.frames)
+            job.done.set()
@@ -1,14 +1,110 @@
 # medpharma/signals.py
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver, Signal
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Medicine, InventoryTransaction, ScanReport
+
+# Sent with `medicine_ids` by bulk stock writes (FEFO sales, imports) that
+# bypass Medicine.save() and therefore post_save.
+stock_changed = Signal()
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
 
+@receiver(post_save, sender=Medicine)
+def refresh_medicine_alerts(sender, instance, **kwargs):
+    from .alerts import refresh_alerts
+    refresh_alerts([instance.pk])
+
+@receiver(stock_changed)
+def refresh_changed_stock_alerts(sender, medicine_ids, **kwargs):
+    from .alerts import refresh_alerts
+    refresh_alerts(medicine_ids)
+
+# --- Resource versions behind ETag / Last-Modified ---
+@receiver([post_save, post_delete], sender=Medicine)
+def bump_medicines_version(sender, **kwargs):
+    from .conditional import bump_versions
+    bump_versions('medicines')
+
+@receiver([post_save, post_delete], sender=InventoryTransaction)
+def bump_inventory_version(sender, **kwargs):
+    from .conditional import bump_versions
+    bump_versions('inventory')
+
+@receiver(stock_changed)
+def bump_stock_versions(sender, **kwargs):
+    from .conditional import bump_versions
+    bump_versions('medicines', 'inventory')
+
+@receiver([post_save, post_delete], sender=ScanReport)
+def bump_scans_version(sender, **kwargs):
+    from .conditional import bump_versions
+    bump_versions('scans')
+
+# --- Scan blob reference counts ---
+# ScanReport file fields stored in ContentAddressedStorage
+SCAN_BLOB_FIELDS = ('scan_image', 'source_file')
+
+@receiver(post_init, sender=ScanReport)
+def remember_scan_blobs(sender, instance, **kwargs):
+    # Raw attributes: the stored names, without building FieldFiles.
+    # Deferred (.only()/.defer()) fields are not tracked.
+    instance._stored_blobs = {
+        name: getattr(instance.__dict__[name], 'name', instance.__dict__[name]) or None
+        for name in SCAN_BLOB_FIELDS if name in instance.__dict__
+    }
+
+@receiver(post_save, sender=ScanReport)
+def update_scan_blob_references(sender, instance, update_fields=None, **kwargs):
+    from .storage import release_blob, retain_blob
+    for field_name, previous in list(instance._stored_blobs.items()):
+        if update_fields is not None and field_name not in update_fields:
+            continue
+        name = getattr(instance, field_name).name or None
+        if name == previous:
+            continue
+        if name:
+            retain_blob(name)
+        if previous:
+            release_blob(previous)
+        instance._stored_blobs[field_name] = name
+
+@receiver(post_delete, sender=ScanReport)
+def release_scan_blobs(sender, instance, **kwargs):
+    from .storage import release_blob
+    for name in instance._stored_blobs.values():
+        if name:
+            release_blob(name)
+
+# --- Live events (pulmoscan.events, /api/events/) ---
+@receiver(post_init, sender=ScanReport)
+def remember_scan_diagnosis(sender, instance, **kwargs):
+    instance._published_diagnosis = instance.__dict__.get('diagnosis')
+
+@receiver(post_save, sender=ScanReport)
+def publish_scan_event(sender, instance, created, **kwargs):
+    # New reports ("Pending Analysis") and every change of diagnosis
+    if not created and instance.diagnosis == instance._published_diagnosis:
+        return
+    instance._published_diagnosis = instance.diagnosis
+    from .events import publish_event
+    publish_event(
+        'scan', id=instance.pk, patient_name=instance.patient_name, diagnosis=instance.diagnosis,
+        confidence=instance.confidence, date_uploaded=instance.date_uploaded,
+    )
 
+def _publish_stock_event(medicine_ids):
+    from .events import publish_event, STOCK_EVENT_MAX_IDS
+    medicine_ids = list(medicine_ids)
+    publish_event('stock', medicines=medicine_ids if len(medicine_ids) <= STOCK_EVENT_MAX_IDS else None)
 
+@receiver([post_save, post_delete], sender=Medicine)
+def publish_medicine_stock_event(sender, instance, **kwargs):
+    _publish_stock_event([instance.pk])
 
+@receiver(stock_changed)
+def publish_bulk_stock_event(sender, medicine_ids, **kwargs):
+    _publish_stock_event(medicine_ids)
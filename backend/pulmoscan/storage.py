@@ -0,0 +1,113 @@
+# pulmoscan/storage.py
+import hashlib
+import os
+import posixpath
+import tempfile
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+# An unreferenced blob younger than this may be about to be referenced by
+# an upload still being saved, so it is left for `gc_scan_blobs`.
+BLOB_GRACE_PERIOD = timedelta(minutes=5)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File storage naming every file by the SHA-256 of its content, sharded
+    two levels deep: `scans/ab/cd/abcd...<64 hex>.png`.
+
+    Saving content that is already stored writes nothing and returns the
+    existing name, so identical uploads share one file, names never get
+    mangled, and a name always denotes the same bytes (cacheable forever).
+    Each stored file has a ScanBlob row counting the ScanReports using it;
+    files are only deleted through `release_blob` once nothing refers to
+    them.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The real name is only known once the content is hashed in _save
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(posixpath.dirname(name), digest[:2], digest[2:4], digest + extension)
+
+        ScanBlob = apps.get_model('pulmoscan', 'ScanBlob')
+        with transaction.atomic():
+            ScanBlob.objects.get_or_create(name=name)
+            # The row lock serializes this with release_blob deleting the file
+            blob = ScanBlob.objects.select_for_update().get(name=name)
+            if not self.exists(name):
+                self._write_atomically(name, content)
+            blob.size = self.size(name)
+            blob.last_seen = timezone.now()
+            blob.save(update_fields=['size', 'last_seen'])
+        return name
+
+    def _write_atomically(self, name, content):
+        # Readers never see a partial file: write aside, then rename into place
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        with tempfile.NamedTemporaryFile(dir=directory, prefix='.upload-', delete=False) as temporary:
+            try:
+                for chunk in content.chunks():
+                    temporary.write(chunk)
+            except BaseException:
+                os.unlink(temporary.name)
+                raise
+        if self.file_permissions_mode is not None:
+            os.chmod(temporary.name, self.file_permissions_mode)
+        os.replace(temporary.name, path)
+
+
+scan_storage = ContentAddressedStorage()
+
+
+# --- Reference counting ---
+def retain_blob(name):
+    ScanBlob = apps.get_model('pulmoscan', 'ScanBlob')
+    if not ScanBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        # Files stored before content addressing, or assigned by name
+        ScanBlob.objects.get_or_create(name=name, defaults={'refcount': 1})
+
+
+def release_blob(name):
+    """
+    Drops one reference to `name`; after commit, deletes the file if that
+    was the last one.
+    """
+    ScanBlob = apps.get_model('pulmoscan', 'ScanBlob')
+    ScanBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+    transaction.on_commit(lambda: delete_unreferenced_blob(name))
+
+
+def delete_unreferenced_blob(name, grace_period=BLOB_GRACE_PERIOD):
+    """
+    Deletes the file and ScanBlob row for `name` if no ScanReport uses it
+    and it was not stored or deduplicated within `grace_period`. Returns
+    whether it was deleted.
+    """
+    ScanBlob = apps.get_model('pulmoscan', 'ScanBlob')
+    with transaction.atomic():
+        blob = ScanBlob.objects.select_for_update().filter(
+            name=name, refcount=0, last_seen__lt=timezone.now() - grace_period,
+        ).first()
+        if blob is None:
+            return False
+        scan_storage.delete(name)
+        blob.delete()
+    return True
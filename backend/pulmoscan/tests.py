@@ -1,3 +1,1518 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import warnings
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import torch
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import pre_delete
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from torchvision.models import resnet18
+
+from . import admin as pulmoscan_admin
+from .admission import AdmissionController
+from .alerts import EXPIRY_WARNING_DAYS, LOW_STOCK_THRESHOLD
+from .analytics import rollup_consumption, stock_forecast
+from .archive import archive_database, archived_report, read_cold_blob
+from .authentication import ClaimsJWTAuthentication, ClaimsUser, _full_users, full_user
+from .calibration import confusion_at, fit_temperature, negative_log_likelihood, rederive_diagnoses, roc_curve
+from .dicom import DicomError, read_header, read_study, to_display
+from .embeddings import EmbeddingStore, normalise
+from .events import SUBSCRIBER_QUEUE_SIZE, TICKET_MAX_AGE, EventHub, hub, issue_ticket, read_ticket
+from .imaging import MAX_SCAN_PIXELS, ScanImageError, load_scan_image
+from .inference import (
+    MAX_REQUEST_FRAMES, PROTOCOL_MAGIC, REQUEST_HEADER, RESPONSE_HEADER, STATUS_OK, InferenceUnavailable, LocalModel,
+    SidecarClient, analyse_frames, diagnose, recv_exactly,
+)
+from .imports import import_medicines, upsert_chunk, validate_chunk
+from .inventory import InsufficientStockError, allocate_fefo, end_of_day, ledger_delta, stock_at, take_snapshot
+from .management.commands.export_dataset import exported_labels
+from .media import MEDIA_URL_BUCKET, MEDIA_URL_MAX_AGE, sign_media_name, signed_media_url
+from .models import (
+    ArchivedScanReport, DailyConsumption, DiagnosisCalibration, InventoryTransaction, Medicine, MedicineAlert,
+    ScanBlob, ScanReport, StockSnapshot,
+)
+from .permissions import IsAdminUserCustom, IsDoctor, IsPharmacist
+from .revocation import FilteredRefreshToken, RevocationFilter
+from .serializers import (
+    CustomTokenObtainPairSerializer, InventoryTransactionReadSerializer, InventoryTransactionSerializer,
+    MedicineReadSerializer, MedicineSerializer, ScanReportReadSerializer, ScanReportSerializer,
+)
+from .storage import scan_storage
+from . import utils
+from .utils import ModelUnavailable, class_names, transform
+
+
+def user_with_role(username, role, **fields):
+    user = User.objects.create_user(username, password='secret', **fields)
+    user.profile.role = role
+    user.profile.save()
+    return user
+
+
+def synthetic_radiograph(width, height):
+    # Smooth anatomy-like shading plus fine texture, so the reduced decode
+    # has real high-frequency content to average away
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    body = 200 * np.exp(-(((x - width / 2) / (width / 3)) ** 2 + ((y - height / 2) / (height / 2.5)) ** 2))
+    ribs = 25 * np.sin(y / height * 60) * (np.abs(x - width / 2) > width / 12)
+    noise = np.random.default_rng(0).normal(0, 8, size=(height, width))
+    return Image.fromarray(np.clip(body + ribs + noise + 20, 0, 255).astype(np.uint8)).convert('RGB')
+
+
+class ReducedDecodeTests(SimpleTestCase):
+    """
+    The reduced-resolution decode must not change what the model sees in
+    any way that matters: class probabilities from a fixed-seed network
+    stay within 0.02 of the full-resolution path.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        image = synthetic_radiograph(3000, 2600)
+        cls.paths = {}
+        for extension, options in (('png', {}), ('jpg', {'quality': 92}), ('tif', {})):
+            path = os.path.join(cls.directory, f'scan.{extension}')
+            image.save(path, **options)
+            cls.paths[extension] = path
+
+        torch.manual_seed(0)
+        cls.model = resnet18(weights=None)
+        cls.model.fc = torch.nn.Linear(cls.model.fc.in_features, len(class_names))
+        cls.model.eval()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def probabilities(self, image):
+        with torch.no_grad():
+            return torch.softmax(self.model(transform(image).unsqueeze(0)), dim=1)[0]
+
+    def test_model_outputs_within_tolerance(self):
+        for extension, path in self.paths.items():
+            with self.subTest(format=extension):
+                full = transform(Image.open(path).convert('RGB'))
+                reduced_image = load_scan_image(path)
+                reduced = transform(reduced_image)
+
+                self.assertLess(max(reduced_image.size), 1000)
+                self.assertLess((full - reduced).abs().mean().item(), 0.05)
+                expected = self.probabilities(Image.open(path).convert('RGB'))
+                actual = self.probabilities(reduced_image)
+                self.assertLess((expected - actual).abs().max().item(), 0.02)
+
+    def test_sixteen_bit_images_match_rgb_conversion(self):
+        path = os.path.join(self.directory, 'scan16.png')
+        Image.fromarray((np.arange(1200 * 1200, dtype=np.uint32) % 65536).astype(np.uint16).reshape(1200, 1200)).save(path)
+        full = transform(Image.open(path).convert('RGB'))
+        reduced = transform(load_scan_image(path))
+        self.assertLess((full - reduced).abs().mean().item(), 0.05)
+
+    def test_oversized_images_are_rejected_before_decoding(self):
+        side = int(MAX_SCAN_PIXELS ** 0.5) + 1
+        path = os.path.join(self.directory, 'huge.png')
+        # A tiny file whose header claims more pixels than allowed
+        Image.new('L', (side, side)).save(path, optimize=True)
+        with self.assertRaises(ScanImageError):
+            load_scan_image(path)
+
+
+def dicom_file(frames, **elements):
+    """
+    DICOM Part 10 bytes holding `frames` (uint16, frames x rows x
+    columns, or None for no pixel data) with the given header elements.
+    """
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    header = Dataset()
+    header.file_meta = meta
+    header.SamplesPerPixel, header.PhotometricInterpretation = 1, 'MONOCHROME2'
+    header.BitsAllocated, header.BitsStored, header.HighBit, header.PixelRepresentation = 16, 12, 11, 0
+    if frames is not None:
+        header.Rows, header.Columns = frames.shape[1:]
+        header.NumberOfFrames = len(frames)
+        header.PixelData = frames.astype('<u2').tobytes()
+    for keyword, value in elements.items():
+        setattr(header, keyword, value)
+    buffer = io.BytesIO()
+    header.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+class DicomTests(SimpleTestCase):
+    def header(self, **elements):
+        header = Dataset()
+        for keyword, value in elements.items():
+            setattr(header, keyword, value)
+        return header
+
+    def test_windowing_rescale_and_monochrome1_inversion(self):
+        frame = np.array([[-10.0, 49.5, 250.0]], dtype=np.float32)
+        window = {'WindowCenter': 100, 'WindowWidth': 201}
+        np.testing.assert_array_equal(to_display(frame, self.header(**window)), [[0, 64, 255]])
+        inverted = to_display(frame, self.header(PhotometricInterpretation='MONOCHROME1', **window))
+        np.testing.assert_array_equal(inverted, [[255, 191, 0]])
+        # Stored values that rescale to the same modality values
+        stored = (frame + 10) / 2
+        rescaled = to_display(stored, self.header(RescaleSlope=2, RescaleIntercept=-10, **window))
+        np.testing.assert_array_equal(rescaled, [[0, 64, 255]])
+        # No window in the header: the 1st-99th percentile range
+        ramp = np.arange(1000, dtype=np.float32).reshape(10, 100)
+        display = to_display(ramp, self.header())
+        self.assertEqual((display.min(), display.max()), (0, 255))
+        self.assertEqual((display[0, 5], display[-1, -5]), (0, 255))
+
+    def test_multi_frame_study_is_reduced_per_frame(self):
+        frames = np.stack([np.full((600, 500), 500 * (i + 1), dtype=np.uint16) for i in range(3)])
+        frames[:, :300] += 100
+        content = dicom_file(frames, Modality='CR', StudyDate='20260102', PixelSpacing=[0.14, 0.14],
+                             WindowCenter=1000, WindowWidth=2000)
+        study = read_study(SimpleUploadedFile('study.dcm', content))
+
+        self.assertEqual(study.metadata, {
+            'Modality': 'CR', 'StudyDate': '20260102', 'PixelSpacing': [0.14, 0.14], 'Rows': 600, 'Columns': 500,
+            'NumberOfFrames': 3, 'BitsStored': 12, 'PhotometricInterpretation': 'MONOCHROME2',
+        })
+        self.assertEqual([frame.shape for frame in study.frames], [(224, 224)] * 3)
+        self.assertEqual([frame.dtype for frame in study.frames], [np.uint8] * 3)
+        means = [frame.mean() for frame in study.frames]
+        self.assertEqual(means, sorted(means))
+        # Upper half brighter than the lower half, in every frame
+        self.assertTrue(all(frame[:100].mean() > frame[-100:].mean() for frame in study.frames))
+        preview = Image.open(study.preview)
+        self.assertEqual((preview.size, study.preview.name), ((500, 600), 'study.png'))
+
+    def test_oversized_studies_are_refused_from_the_header(self):
+        too_many = dicom_file(None, Rows=8, Columns=8, NumberOfFrames=MAX_REQUEST_FRAMES + 1)
+        too_large = dicom_file(None, Rows=8000, Columns=8000, NumberOfFrames=1)
+        for content in (too_many, too_large):
+            with mock.patch('pulmoscan.dicom.iter_pixels') as iter_pixels, self.assertRaises(DicomError):
+                read_study(SimpleUploadedFile('study.dcm', content))
+            iter_pixels.assert_not_called()
+
+    def test_decoding_failures_only_are_dicom_errors(self):
+        with self.assertRaisesRegex(DicomError, 'Could not decode'):
+            read_study(SimpleUploadedFile('study.dcm', dicom_file(None, Rows=8, Columns=8)))
+        content = dicom_file(np.zeros((1, 8, 8), dtype=np.uint16))
+        with mock.patch('pulmoscan.dicom.to_display', side_effect=TypeError('bug')), self.assertRaises(TypeError):
+            read_study(SimpleUploadedFile('study.dcm', content))
+
+
+class FixedBackend:
+    """
+    Inference backend answering every frame of a given size with fixed
+    (normal, pneumonia) logits; records the frame sizes it was asked for.
+    """
+
+    def __init__(self, logits_by_size):
+        self.logits_by_size = logits_by_size
+        self.sizes = []
+
+    def predict(self, frames):
+        size = frames.shape[-1]
+        self.sizes.append(size)
+        logits = np.tile(np.asarray(self.logits_by_size[size], dtype=np.float32), (len(frames), 1))
+        return logits, np.full((len(frames), 512), size, dtype=np.float16)
+
+
+class CascadeTests(SimpleTestCase):
+    frames = np.zeros((1, 224, 224), dtype=np.uint8)
+    plan = (112, (0.2, 0.9))
+
+    def test_screen_decision_returns_no_logits_or_embedding(self):
+        # Screen: pneumonia probability ~0.05, below the band
+        backend = FixedBackend({112: (3.0, 0.0)})
+        result = analyse_frames(self.frames, backend, cascade=self.plan)
+        self.assertEqual(result['stage'], 'screen')
+        self.assertEqual(result['diagnosis'], 'Normal')
+        self.assertNotIn('logits', result)
+        self.assertNotIn('embedding', result)
+        self.assertEqual(backend.sizes, [112])
+
+    def test_uncertain_screen_escalates_to_full_resolution(self):
+        backend = FixedBackend({112: (0.0, 0.0), 224: (0.0, 2.0)})
+        result = analyse_frames(self.frames, backend, cascade=self.plan)
+        self.assertEqual(result['stage'], 'full')
+        self.assertEqual(backend.sizes, [112, 224])
+        np.testing.assert_allclose(result['logits'], (0.0, 2.0))
+        self.assertEqual(result['embedding'][0], 224)
+
+    def test_band_follows_a_calibrated_threshold(self):
+        # Screen probability ~0.92: above the band, but below a calibrated
+        # threshold of 0.95, so the screen must not decide it
+        backend = FixedBackend({112: (0.0, 2.45), 224: (0.0, 3.5)})
+        result = analyse_frames(self.frames, backend, cascade=self.plan, calibration=(0.95, 1.0))
+        self.assertEqual(result['stage'], 'full')
+        self.assertEqual(result['diagnosis'], 'Pneumonia')
+
+        backend = FixedBackend({112: (0.0, 2.45)})
+        result = analyse_frames(self.frames, backend, cascade=self.plan)
+        self.assertEqual((result['stage'], result['diagnosis']), ('screen', 'Pneumonia'))
+
+
+class ArchiveTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(
+            MEDIA_ROOT=os.path.join(self.directory, 'media'),
+            SCAN_COLD_STORAGE_DIR=os.path.join(self.directory, 'cold'),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_archived_model_has_every_scan_report_column(self):
+        archived = {field.attname for field in ArchivedScanReport._meta.concrete_fields} - {'archived_at'}
+        self.assertEqual(archived, {field.attname for field in ScanReport._meta.concrete_fields})
+
+    def test_old_reports_move_to_cold_storage_and_stay_readable(self):
+        # One compressible file (DICOM-like) and one that is not (random bytes)
+        contents = [bytes(range(256)) * 400, os.urandom(5000)]
+        reports = []
+        for number, content in enumerate(contents):
+            report = ScanReport(patient_name=f'Old {number}', diagnosis='Normal', confidence=80.0,
+                                dicom_metadata={'Modality': 'CR'})
+            report.scan_image.save(f'old{number}.png', ContentFile(content), save=True)
+            reports.append(report)
+        recent = ScanReport(patient_name='Recent')
+        recent.scan_image.save('recent.png', ContentFile(b'recent'), save=True)
+        long_ago = timezone.now() - timedelta(days=400)
+        ScanReport.objects.filter(pk__in=[report.pk for report in reports]).update(date_uploaded=long_ago)
+        ScanBlob.objects.update(last_seen=long_ago)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_scans', '--older-than', '365', stdout=io.StringIO())
+
+        self.assertEqual(list(ScanReport.objects.values_list('pk', flat=True)), [recent.pk])
+        for report, content in zip(reports, contents):
+            archived = archived_report(report.pk)
+            self.assertEqual(
+                (archived.patient_name, archived.diagnosis, archived.dicom_metadata, archived.date_uploaded),
+                (report.patient_name, 'Normal', {'Modality': 'CR'}, long_ago),
+            )
+            self.assertEqual(read_cold_blob(report.scan_image.name), content)
+            self.assertFalse(scan_storage.exists(report.scan_image.name))
+        self.assertIsNone(archived_report(recent.pk))
+        self.assertIsNone(read_cold_blob(recent.scan_image.name))
+
+    def test_rerun_finishes_a_move_that_failed_before_the_hot_delete(self):
+        contents = [os.urandom(1000), os.urandom(1000)]
+        reports = []
+        for number, content in enumerate(contents):
+            report = ScanReport(patient_name=f'Old {number}', diagnosis='Normal', confidence=80.0)
+            report.scan_image.save(f'old{number}.png', ContentFile(content), save=True)
+            reports.append(report)
+        long_ago = timezone.now() - timedelta(days=400)
+        ScanReport.objects.update(date_uploaded=long_ago)
+        ScanBlob.objects.update(last_seen=long_ago)
+
+        def fail(**kwargs):
+            raise RuntimeError('connection lost')
+
+        pre_delete.connect(fail, sender=ScanReport, dispatch_uid='archive-test-failure')
+        try:
+            with self.assertRaises(RuntimeError):
+                call_command('archive_scans', '--older-than', '365', stdout=io.StringIO())
+        finally:
+            pre_delete.disconnect(sender=ScanReport, dispatch_uid='archive-test-failure')
+        self.assertEqual(ScanReport.objects.count(), 2)
+        if archive_database() != DEFAULT_DB_ALIAS:
+            # The archive copy had committed: the reports are in both tables
+            self.assertEqual(ArchivedScanReport.objects.count(), 2)
+        ScanReport.objects.filter(pk=reports[0].pk).update(confirmed_diagnosis='Pneumonia')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_scans', '--older-than', '365', stdout=io.StringIO())
+
+        self.assertFalse(ScanReport.objects.exists())
+        self.assertEqual(ArchivedScanReport.objects.count(), 2)
+        self.assertEqual(archived_report(reports[0].pk).confirmed_diagnosis, 'Pneumonia')
+        for report, content in zip(reports, contents):
+            self.assertEqual(read_cold_blob(report.scan_image.name), content)
+            self.assertFalse(scan_storage.exists(report.scan_image.name))
+
+
+class ConsumptionRollupTests(TestCase):
+    def setUp(self):
+        self.medicine = Medicine.objects.create(
+            name='Amoxicillin', batch_number='A1', expiry_date=date.today() + timedelta(days=365),
+            quantity=100, price='2.50', supplier='Acme',
+        )
+
+    def sell(self, quantity, when, pk=None):
+        sale = InventoryTransaction.objects.create(
+            pk=pk, medicine=self.medicine, transaction_type='sale', quantity=quantity,
+        )
+        InventoryTransaction.objects.filter(pk=sale.pk).update(date=when)
+
+    def rolled_up(self):
+        return list(DailyConsumption.objects.order_by('day').values_list('day', 'quantity'))
+
+    def test_late_committed_sales_are_counted_once(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        self.sell(3, yesterday, pk=10)
+        first_run = timezone.now()
+        rollup_consumption(now=first_run)
+
+        # Created (and numbered) before the first run, but committed after it
+        self.sell(4, first_run - timedelta(minutes=5), pk=5)
+        self.sell(2, yesterday)
+        rollup_consumption()
+        rollup_consumption()
+
+        by_day = {}
+        for when, quantity in ((yesterday, 5), (first_run - timedelta(minutes=5), 4)):
+            day = timezone.localdate(when)
+            by_day[day] = by_day.get(day, 0) + quantity
+        self.assertEqual(self.rolled_up(), sorted(by_day.items()))
+
+    def test_forecast_only_reads_the_rollup(self):
+        self.sell(3, timezone.now() - timedelta(days=1))
+        forecast = stock_forecast()
+        self.assertEqual(forecast[0]['avg_daily_window'], 0)
+        self.assertEqual(self.rolled_up(), [])
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        self.addCleanup(_full_users.clear)
+
+    def login(self, username):
+        client = APIClient()
+        tokens = client.post('/api/auth/token/', {'username': username, 'password': 'secret'}).data
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        return client, tokens
+
+    def claims_user(self, user):
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        return ClaimsJWTAuthentication().get_user(ClaimsJWTAuthentication().get_validated_token(str(token)))
+
+    def test_permissions_follow_the_role_and_staff_claims(self):
+        cases = (
+            (user_with_role('doctor', 'doctor'), (True, False, False)),
+            (user_with_role('pharmacist', 'pharmacist'), (False, True, False)),
+            (user_with_role('staff', 'doctor', is_staff=True), (True, True, True)),
+            (user_with_role('admin', 'admin'), (False, False, False)),
+        )
+        for user, expected in cases:
+            with self.subTest(user=user.username):
+                claims_user = self.claims_user(user)
+                self.assertIsInstance(claims_user, ClaimsUser)
+                request = SimpleNamespace(user=claims_user)
+                self.assertEqual(tuple(
+                    permission().has_permission(request, None)
+                    for permission in (IsDoctor, IsPharmacist, IsAdminUserCustom)
+                ), expected)
+
+    def test_requests_are_authorized_without_user_queries(self):
+        user_with_role('doctor', 'doctor')
+        client, _ = self.login('doctor')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get('/api/scan-reports/').status_code, 200)
+            self.assertEqual(client.get('/api/medicines/').status_code, 403)
+        self.assertFalse([query for query in queries if 'auth_user' in query['sql'] or 'userprofile' in query['sql']])
+
+    def test_role_changes_apply_at_next_login_and_inactive_users_cannot_refresh(self):
+        user = user_with_role('doctor', 'doctor')
+        client, tokens = self.login('doctor')
+        user.profile.role = 'pharmacist'
+        user.profile.save()
+        # Claims are trusted until the access token expires; refreshing keeps them
+        self.assertEqual(client.get('/api/scan-reports/').status_code, 200)
+        refreshed = client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']})
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {refreshed.data['access']}")
+        self.assertEqual(client.get('/api/scan-reports/').status_code, 200)
+        client, tokens = self.login('doctor')
+        self.assertEqual(client.get('/api/scan-reports/').status_code, 403)
+        self.assertEqual(client.get('/api/medicines/').status_code, 200)
+
+        user.is_active = False
+        user.save()
+        self.assertEqual(client.get('/api/medicines/').status_code, 200)
+        self.assertEqual(client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+
+    def test_full_user_is_cached_for_a_minute(self):
+        user = user_with_role('doctor', 'doctor')
+        request = SimpleNamespace(user=self.claims_user(user))
+        with mock.patch('pulmoscan.authentication.time.monotonic', return_value=1000.0):
+            with self.assertNumQueries(1):
+                self.assertEqual(full_user(request), user)
+                self.assertEqual(full_user(request), user)
+        User.objects.filter(pk=user.pk).update(first_name='Renamed')
+        with mock.patch('pulmoscan.authentication.time.monotonic', return_value=1059.0), self.assertNumQueries(0):
+            self.assertEqual(full_user(request).first_name, '')
+        with mock.patch('pulmoscan.authentication.time.monotonic', return_value=1061.0), self.assertNumQueries(1):
+            self.assertEqual(full_user(request).first_name, 'Renamed')
+        # Real users (admin sessions, force_authenticate) are returned as they are
+        with self.assertNumQueries(0):
+            self.assertIs(full_user(SimpleNamespace(user=user)), user)
+
+
+class RevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pharmacist', password='secret')
+
+    def blacklist(self, token, pk=None):
+        # A raw row, as another worker's logout would leave it
+        outstanding = OutstandingToken.objects.get(jti=token['jti'])
+        BlacklistedToken.objects.create(pk=pk, token=outstanding)
+
+    def test_revoked_refresh_token_is_rejected(self):
+        client = APIClient()
+        tokens = client.post('/api/auth/token/', {'username': 'pharmacist', 'password': 'secret'}).data
+        rotated = client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(rotated.status_code, 200)
+        # Rotation blacklists the refresh token it replaces
+        self.assertEqual(client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(client.post('/api/auth/logout/', {'refresh': rotated.data['refresh']}).status_code, 205)
+        self.assertEqual(client.post('/api/auth/token/refresh/', {'refresh': rotated.data['refresh']}).status_code, 401)
+
+    def test_blacklist_rows_committed_out_of_order_are_seen(self):
+        revocations = RevocationFilter()
+        first, late = FilteredRefreshToken.for_user(self.user), FilteredRefreshToken.for_user(self.user)
+        self.blacklist(first, pk=10)
+        with mock.patch('pulmoscan.revocation.time.monotonic', return_value=1000.0):
+            self.assertTrue(revocations.is_revoked(first['jti']))
+            self.assertFalse(revocations.is_revoked(late['jti']))
+
+        # Numbered before the row above, committed after the filter read it
+        self.blacklist(late, pk=5)
+        with mock.patch('pulmoscan.revocation.time.monotonic', return_value=1003.0):
+            self.assertTrue(revocations.is_revoked(late['jti']))
+
+
+class ExportDatasetTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.output = os.path.join(self.directory, 'dataset')
+
+    def report(self, name, label, content=None):
+        if content is None:
+            buffer = io.BytesIO()
+            synthetic_radiograph(256, 256).save(buffer, format='PNG')
+            content = buffer.getvalue()
+        report = ScanReport(patient_name=name, diagnosis='Normal', confidence=90.0, confirmed_diagnosis=label)
+        report.scan_image.save(f'{name}.png', ContentFile(content), save=True)
+        return report
+
+    def export(self):
+        self.errors = io.StringIO()
+        call_command('export_dataset', self.output, '--labelled-only', '--workers', '1',
+                     stdout=io.StringIO(), stderr=self.errors)
+        with open(os.path.join(self.output, 'manifest.json')) as source:
+            manifest = json.load(source)
+        return manifest, exported_labels(self.output, manifest)
+
+    def test_later_confirmations_fixes_and_label_changes_are_exported(self):
+        confirmed = self.report('confirmed', 'Pneumonia')
+        pending = self.report('pending', None)
+        broken = self.report('broken', 'Pneumonia', content=b'not an image')
+        manifest, labels = self.export()
+        self.assertEqual(labels, {confirmed.pk: 'Pneumonia'})
+        self.assertIn(f'Skipping scan report {broken.pk}:', self.errors.getvalue())
+
+        ScanReport.objects.filter(pk=pending.pk).update(confirmed_diagnosis='Normal')
+        ScanReport.objects.filter(pk=confirmed.pk).update(confirmed_diagnosis='Normal')
+        buffer = io.BytesIO()
+        synthetic_radiograph(256, 256).save(buffer, format='PNG')
+        with open(broken.scan_image.path, 'wb') as out:
+            out.write(buffer.getvalue())
+        manifest, labels = self.export()
+        self.assertEqual(labels, {confirmed.pk: 'Normal', pending.pk: 'Normal', broken.pk: 'Pneumonia'})
+        self.assertEqual((manifest['rows'], len(manifest['shards'])), (3, 2))
+        with open(os.path.join(self.output, 'labels-00000.csv'), newline='') as source:
+            self.assertEqual(list(csv.reader(source)), [['report_id', 'label'], [str(confirmed.pk), 'Normal']])
+
+        # Nothing changed: nothing new is written
+        self.assertEqual(self.export(), (manifest, labels))
+
+
+class CalibrationTests(TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_temperature_fit_on_separable_labels_stops_at_the_bound(self):
+        margins = self.rng.normal(0, 3, 500)
+        self.assertAlmostEqual(fit_temperature(margins, margins > 0), 0.05)
+
+    def test_temperature_fit_minimises_the_likelihood(self):
+        margins = self.rng.normal(0, 4, 20000)
+        labels = self.rng.random(20000) < 1 / (1 + np.exp(-margins / 2.5))
+        temperature = fit_temperature(margins, labels)
+        self.assertAlmostEqual(temperature, 2.5, delta=0.15)
+        grid = np.linspace(0.5, 10, 2000)
+        best = grid[np.argmin([negative_log_likelihood(margins, labels, t) for t in grid])]
+        self.assertAlmostEqual(temperature, best, delta=0.01)
+
+    def test_roc_curve_with_ties_matches_brute_force(self):
+        probabilities = self.rng.integers(0, 20, 400) / 20
+        labels = self.rng.random(400) < probabilities
+        roc = roc_curve(probabilities, labels)
+
+        np.testing.assert_array_equal(roc['thresholds'], np.unique(probabilities)[::-1])
+        for i, threshold in enumerate(roc['thresholds']):
+            counts = confusion_at(probabilities, labels, threshold)
+            self.assertEqual(counts, {key: int(roc[key][i]) for key in ('tp', 'fp', 'tn', 'fn')})
+
+        # AUC: chance a positive outscores a negative, ties counting half
+        positives, negatives = probabilities[labels], probabilities[~labels]
+        wins = (positives[:, None] > negatives).sum() + 0.5 * (positives[:, None] == negatives).sum()
+        self.assertAlmostEqual(roc['auc'], wins / (len(positives) * len(negatives)))
+
+    def test_sql_rederivation_matches_diagnose(self):
+        normal = self.rng.normal(0, 3, 200).tolist() + [0.0, 0.0]
+        pneumonia = self.rng.normal(0, 3, 200).tolist() + [2000.0, -2000.0]
+        ScanReport.objects.bulk_create([
+            ScanReport(patient_name=f'P{i}', normal_logit=n, pneumonia_logit=p) for i, (n, p) in enumerate(zip(normal, pneumonia))
+        ])
+        for threshold, temperature in ((0.5, 1.0), (0.3, 2.5), (0.8, 0.4)):
+            self.assertEqual(rederive_diagnoses(threshold, temperature), len(normal))
+            for n, p, diagnosis, confidence in ScanReport.objects.values_list(
+                'normal_logit', 'pneumonia_logit', 'diagnosis', 'confidence',
+            ):
+                expected, _ = diagnose(np.array([[n, p]]), threshold, temperature)
+                self.assertEqual(diagnosis, expected['diagnosis'])
+                self.assertAlmostEqual(confidence, expected['confidence'], delta=0.011)
+
+    def test_failed_rederivation_does_not_save_the_calibration(self):
+        ScanReport.objects.bulk_create([
+            ScanReport(patient_name=f'P{i}', normal_logit=-margin, pneumonia_logit=margin,
+                       confirmed_diagnosis='Pneumonia' if margin > 0 else 'Normal')
+            for i, margin in enumerate(self.rng.normal(0, 3, 50))
+        ])
+        with mock.patch('pulmoscan.management.commands.calibrate_threshold.rederive_diagnoses',
+                        side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            call_command('calibrate_threshold', stdout=io.StringIO())
+        self.assertFalse(DiagnosisCalibration.objects.exists())
+
+        call_command('calibrate_threshold', stdout=io.StringIO())
+        self.assertEqual(DiagnosisCalibration.objects.count(), 1)
+        self.assertFalse(ScanReport.objects.filter(diagnosis='Pending Analysis').exists())
+
+
+class FefoSaleTests(TestCase):
+    def setUp(self):
+        today = date.today()
+        self.batches = {
+            number: Medicine.objects.create(
+                name='Amoxicillin', batch_number=number, expiry_date=today + timedelta(days=days),
+                quantity=quantity, price='2.50', supplier='Acme',
+            )
+            for number, days, quantity in (('late', 300, 10), ('early', 30, 4), ('expired', -1, 50), ('empty', 10, 0))
+        }
+
+    def quantities(self):
+        return dict(Medicine.objects.values_list('batch_number', 'quantity'))
+
+    def test_sale_takes_the_earliest_expiring_batches_first(self):
+        sales = allocate_fefo('Amoxicillin', 7)
+        self.assertEqual([(sale.medicine.batch_number, sale.quantity) for sale in sales], [('early', 4), ('late', 3)])
+        self.assertEqual(self.quantities(), {'late': 7, 'early': 0, 'expired': 50, 'empty': 0})
+
+    def test_insufficient_stock_changes_nothing(self):
+        with self.assertRaises(InsufficientStockError) as raised:
+            allocate_fefo('Amoxicillin', 15)
+        self.assertEqual((raised.exception.requested, raised.exception.available), (15, 14))
+
+        pharmacist = User.objects.create_user('pharmacist')
+        pharmacist.profile.role = 'pharmacist'
+        pharmacist.profile.save()
+        client = APIClient()
+        client.force_authenticate(pharmacist)
+        response = client.post('/api/inventory-transactions/fefo-sale/', {'name': 'Amoxicillin', 'quantity': 15})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), {'late': 10, 'early': 4, 'expired': 50, 'empty': 0})
+        self.assertFalse(InventoryTransaction.objects.exists())
+
+
+class StockAtTests(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.client = APIClient()
+        self.client.force_authenticate(user_with_role('pharmacist', 'pharmacist'))
+        response = self.client.post('/api/medicines/', {
+            'name': 'Amoxicillin', 'batch_number': 'A1', 'expiry_date': self.today + timedelta(days=365),
+            'quantity': 10, 'price': '2.50', 'supplier': 'Acme',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.medicine = Medicine.objects.get(pk=response.data['id'])
+        # Created 10 days ago; sold 4 on day -6, bought 6 on day -3
+        self.move(InventoryTransaction.objects.get(medicine=self.medicine), days_ago=10)
+        self.record('sale', 4, days_ago=6)
+        self.record('purchase', 6, days_ago=3)
+        Medicine.objects.filter(pk=self.medicine.pk).update(quantity=12)
+        self.expected = {11: 0, 10: 10, 7: 10, 6: 6, 4: 6, 3: 12, 0: 12}
+
+    def move(self, transaction, days_ago):
+        InventoryTransaction.objects.filter(pk=transaction.pk).update(
+            date=end_of_day(self.today - timedelta(days=days_ago)) - timedelta(hours=12),
+        )
+
+    def record(self, transaction_type, quantity, days_ago):
+        self.move(InventoryTransaction.objects.create(
+            medicine=self.medicine, transaction_type=transaction_type, quantity=quantity,
+        ), days_ago)
+
+    def day(self, days_ago):
+        return self.today - timedelta(days=days_ago)
+
+    def assertStock(self, anchors=None):
+        for days_ago, quantity in self.expected.items():
+            quantities, anchor = stock_at(self.day(days_ago))
+            self.assertEqual(quantities, {self.medicine.pk: quantity}, f'{days_ago} days ago')
+            if anchors is not None:
+                self.assertEqual(anchor, anchors[days_ago], f'{days_ago} days ago')
+
+    def test_ledger_delta_is_half_open(self):
+        self.assertEqual(ledger_delta(), {self.medicine.pk: 12})
+        self.assertEqual(ledger_delta(start=end_of_day(self.day(6))), {self.medicine.pk: 6})
+        self.assertEqual(ledger_delta(start=end_of_day(self.day(7)), end=end_of_day(self.day(6))), {self.medicine.pk: -4})
+        self.assertEqual(ledger_delta(start=end_of_day(self.day(6)), end=end_of_day(self.day(4))), {})
+
+    def test_stock_without_snapshots_rolls_back_from_live(self):
+        self.assertStock(anchors=dict.fromkeys(self.expected))
+
+    def test_snapshots_match_the_ledger_and_the_nearest_anchor_is_used(self):
+        for days_ago in (8, 5):
+            self.assertEqual(take_snapshot(self.day(days_ago)), 1)
+        self.assertEqual(
+            dict(StockSnapshot.objects.values_list('date', 'quantity')), {self.day(8): 10, self.day(5): 6},
+        )
+        self.assertStock(anchors={11: self.day(8), 10: self.day(8), 7: self.day(8), 6: self.day(5),
+                                  4: self.day(5), 3: self.day(5), 0: None})
+
+        # Catching up later gives the same snapshot
+        self.record('sale', 12, days_ago=0)
+        Medicine.objects.filter(pk=self.medicine.pk).update(quantity=0)
+        take_snapshot(self.day(5))
+        self.assertEqual(StockSnapshot.objects.get(date=self.day(5)).quantity, 6)
+
+    def test_stock_at_endpoint(self):
+        response = self.client.get('/api/medicines/stock-at/', {'date': self.day(6).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_quantity'], 6)
+        self.assertEqual(response.data['medicines'], [
+            {'id': self.medicine.pk, 'name': 'Amoxicillin', 'batch_number': 'A1', 'quantity': 6},
+        ])
+        for value in ('', 'yesterday', '2024-02-30'):
+            self.assertEqual(self.client.get('/api/medicines/stock-at/', {'date': value}).status_code, 400)
+
+    def test_direct_quantity_edits_are_outside_the_ledger(self):
+        response = self.client.patch(f'/api/medicines/{self.medicine.pk}/', {'quantity': 20})
+        self.assertEqual(response.status_code, 200)
+        # Every day after creation reports the 8 extra units
+        self.assertEqual(stock_at(self.day(6))[0], {self.medicine.pk: 14})
+        self.assertEqual(stock_at(self.day(11))[0], {self.medicine.pk: 8})
+
+
+class MedicineAlertTests(TestCase):
+    def setUp(self):
+        today = date.today()
+        self.batches = {
+            number: Medicine.objects.create(
+                name='Amoxicillin', batch_number=number, expiry_date=today + timedelta(days=days),
+                quantity=quantity, price='2.50', supplier='Acme',
+            )
+            for number, days, quantity in (
+                ('low', 365, LOW_STOCK_THRESHOLD), ('stocked', 365, LOW_STOCK_THRESHOLD + 1),
+                ('expiring', EXPIRY_WARNING_DAYS, 50), ('later', EXPIRY_WARNING_DAYS + 1, 50),
+                ('today', 0, 50), ('expired', -1, 50),
+            )
+        }
+
+    def alerts(self):
+        return set(MedicineAlert.objects.values_list('medicine__batch_number', 'kind'))
+
+    def test_boundaries(self):
+        self.assertEqual(self.alerts(), {
+            ('low', 'low_stock'), ('expiring', 'expiring_soon'), ('today', 'expiring_soon'), ('expired', 'expired'),
+        })
+
+        client = APIClient()
+        client.force_authenticate(user_with_role('doctor', 'doctor'))
+        response = client.get('/api/medicines/alerts/')
+        self.assertEqual([row['batch_number'] for row in response.data['low_stock']], ['low'])
+        self.assertEqual([row['batch_number'] for row in response.data['expired']], ['expired'])
+
+    def test_writes_add_and_resolve_alerts(self):
+        low = self.batches['low']
+        low.quantity = 40
+        low.save()
+        # A FEFO sale goes through stock_changed, not Medicine.save()
+        allocate_fefo('Amoxicillin', 50)
+        self.assertEqual(Medicine.objects.get(pk=self.batches['today'].pk).quantity, 0)
+        self.assertEqual(self.alerts(), {
+            ('today', 'low_stock'), ('expiring', 'expiring_soon'), ('today', 'expiring_soon'), ('expired', 'expired'),
+        })
+
+    def test_sweep_agrees_with_the_write_path(self):
+        later = date.today() + timedelta(days=2)
+        with mock.patch('pulmoscan.alerts.date') as patched:
+            patched.today.return_value = later
+            call_command('sweep_alerts', stdout=io.StringIO())
+            swept = self.alerts()
+            MedicineAlert.objects.all().delete()
+            for medicine in Medicine.objects.all():
+                medicine.save()
+        self.assertEqual(self.alerts(), swept)
+        self.assertIn(('later', 'expiring_soon'), swept)
+        self.assertIn(('today', 'expired'), swept)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user_with_role('pharmacist', 'pharmacist'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create('A1')
+
+    def create(self, batch_number):
+        return Medicine.objects.create(
+            name='Amoxicillin', batch_number=batch_number, expiry_date=date.today() + timedelta(days=365),
+            quantity=50, price='2.50', supplier='Acme',
+        )
+
+    def get(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/api/medicines/', **headers)
+
+    def test_unchanged_resource_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        not_modified = self.get(response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(f"/api/medicines/{Medicine.objects.get().pk}/",
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_etag_changes_only_once_a_write_commits(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.create('A2')
+            self.assertEqual(self.get(etag).status_code, 304)
+        for callback in callbacks:
+            callback()
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 2)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            with contextlib.suppress(RuntimeError), transaction.atomic():
+                self.create('A3')
+                raise RuntimeError
+        self.assertEqual(self.get(etag).status_code, 304)
+
+    def test_etag_changes_at_midnight(self):
+        etag = self.get()['ETag']
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        with mock.patch('pulmoscan.conditional.timezone.localdate', return_value=tomorrow):
+            response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith(f'"{tomorrow:%Y%m%d}-'))
+
+
+class ValuesSerializerTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(MEDIA_ROOT=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        user = user_with_role('doctor', 'doctor')
+        for number, price in enumerate(('2.5', '1234567.89', '0')):
+            medicine = Medicine.objects.create(
+                name=f'Medicine {number}', batch_number='A1', expiry_date=date(2026, 1, number + 1),
+                quantity=number, price=price, supplier='Acme',
+            )
+            InventoryTransaction.objects.create(medicine=medicine, transaction_type='purchase', quantity=5,
+                                                user=user if number else None)
+        report = ScanReport(patient_name='Patient', diagnosis='Normal', confidence=87.25, user=user,
+                            dicom_metadata={'Modality': 'CR', 'PixelSpacing': [0.1, 0.1], 'Study': {'Frames': 2}})
+        report.scan_image.save('scan.png', ContentFile(b'scan'), save=True)
+        ScanReport.objects.create(patient_name='Pending')
+        ScanReport.objects.update(date_uploaded=timezone.now().replace(microsecond=123456))
+        self.request = Request(APIRequestFactory().get('/api/scan-reports/'))
+
+    def test_output_matches_the_model_serializers(self):
+        pairs = (
+            (Medicine, MedicineSerializer, MedicineReadSerializer),
+            (InventoryTransaction, InventoryTransactionSerializer, InventoryTransactionReadSerializer),
+            (ScanReport, ScanReportSerializer, ScanReportReadSerializer),
+        )
+        for time_zone in ('UTC', 'Asia/Kolkata'):
+            with timezone.override(time_zone):
+                for model, serializer, read_serializer in pairs:
+                    with self.subTest(model=model.__name__, time_zone=time_zone):
+                        queryset = model.objects.order_by('id')
+                        expected = serializer(queryset, many=True, context={'request': self.request}).data
+                        self.assertEqual(
+                            read_serializer(self.request).serialize(queryset), [dict(row) for row in expected],
+                        )
+
+    def test_sparse_fieldsets(self):
+        client = APIClient()
+        client.force_authenticate(user_with_role('pharmacist', 'pharmacist'))
+        response = client.get('/api/medicines/?fields=price,name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0], {'name': 'Medicine 0', 'price': '2.50'})
+        response = client.get('/api/medicines/?fields=name,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['fields'])
+
+
+class MedicineImportTests(TestCase):
+    header = 'name,batch_number,expiry_date,quantity,price,supplier\n'
+
+    def import_csv(self, text, **kwargs):
+        return import_medicines(io.BytesIO((self.header + text).encode()), 'stock.csv', **kwargs)
+
+    def batches(self):
+        return {
+            (name, batch_number): (expiry_date.isoformat(), quantity, str(price), supplier)
+            for name, batch_number, expiry_date, quantity, price, supplier in Medicine.objects.values_list(
+                'name', 'batch_number', 'expiry_date', 'quantity', 'price', 'supplier',
+            )
+        }
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        rows = [
+            ('Amoxicillin', 'A1', '2027-01-31', '10', '2.50', 'Acme'),
+            ('', 'A2', '2027-01-31', '10', '2.50', 'Acme'),
+            ('Amoxicillin', 'B' * 51, '2024-02-30', '0', '1.234', 'Acme'),
+            ('Amoxicillin', 'A3', '31/01/2027', '1.5', '123456789', ''),
+            ('Amoxicillin', 'A4', '2027-01-31', '²', '-1', 'Acme'),
+            ('Amoxicillin', 'A5', '2027-01-31', '1000000000', '12345678.99', 'Acme'),
+        ]
+        valid, errors = validate_chunk(list(enumerate(rows, start=2)))
+        self.assertEqual(valid, [
+            (2, 'Amoxicillin', 'A1', date(2027, 1, 31), 10, '2.50', 'Acme'),
+        ])
+        self.assertEqual([(error['row'], sorted(error['errors'])) for error in errors], [
+            (3, ['name']),
+            (4, ['batch_number', 'expiry_date', 'price', 'quantity']),
+            (5, ['expiry_date', 'price', 'quantity', 'supplier']),
+            (6, ['price', 'quantity']),
+            (7, ['quantity']),
+        ])
+        self.assertEqual(errors[1]['errors']['quantity'], 'Ensure this value is greater than or equal to 1.')
+        self.assertEqual(errors[2]['errors']['quantity'], 'Enter a whole number.')
+
+    def test_existing_batches_are_topped_up_with_purchases_recorded(self):
+        pharmacist = user_with_role('pharmacist', 'pharmacist')
+        Medicine.objects.create(name='Amoxicillin', batch_number='A1', expiry_date=date(2026, 6, 30),
+                                quantity=5, price='2.00', supplier='Old')
+        summary = self.import_csv(
+            'Amoxicillin,A1,2027-01-31,10,2.50,Acme\n'
+            'Ibuprofen,I1,2026-12-31,20,1.00,Acme\n'
+            ',,,,,\n'
+            'Amoxicillin,A1,2027-02-28,3,2.75,Acme\n'
+            'Ibuprofen,I2,never,20,1.00,Acme\n',
+            user=pharmacist, chunk_size=2,
+        )
+        self.assertEqual(summary['rows'], 4)
+        self.assertEqual((summary['created'], summary['updated']), (1, 2))
+        self.assertEqual([error['row'] for error in summary['errors']], [6])
+        self.assertEqual(self.batches(), {
+            ('Amoxicillin', 'A1'): ('2027-02-28', 18, '2.75', 'Acme'),
+            ('Ibuprofen', 'I1'): ('2026-12-31', 20, '1.00', 'Acme'),
+        })
+        self.assertEqual(sorted(InventoryTransaction.objects.values_list(
+            'medicine__batch_number', 'transaction_type', 'quantity', 'user',
+        )), [('A1', 'purchase', 3, pharmacist.pk), ('A1', 'purchase', 10, pharmacist.pk),
+             ('I1', 'purchase', 20, pharmacist.pk)])
+
+    def test_repeated_batches_within_a_chunk_are_summed(self):
+        valid, _ = validate_chunk([
+            (2, ('Amoxicillin', 'A1', '2027-01-31', '10', '2.50', 'Acme')),
+            (3, ('Amoxicillin', 'A1', '2027-03-31', '4', '2.60', 'Acme')),
+        ])
+        self.assertEqual(upsert_chunk(valid), (1, 0))
+        self.assertEqual(self.batches(), {('Amoxicillin', 'A1'): ('2027-03-31', 14, '2.60', 'Acme')})
+        self.assertEqual(sorted(InventoryTransaction.objects.values_list('quantity', flat=True)), [4, 10])
+
+
+class BatchUniquenessMigrationTests(TransactionTestCase):
+    before = [('pulmoscan', '0006_resource_versions')]
+    after = [('pulmoscan', '0007_medicine_batch_unique')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_duplicate_batches_are_renamed_not_merged(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        Medicine = executor.loader.project_state(self.before).apps.get_model('pulmoscan', 'Medicine')
+        rows = [Medicine.objects.create(name='Amoxicillin', batch_number='A1', expiry_date=date(2027, 1, 31),
+                                        quantity=quantity, price='2.50', supplier='Acme') for quantity in (5, 7, 9)]
+        Medicine.objects.create(name='Ibuprofen', batch_number='A1', expiry_date=date(2027, 1, 31),
+                                quantity=1, price='1.00', supplier='Acme')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        Medicine = executor.loader.project_state(self.after).apps.get_model('pulmoscan', 'Medicine')
+        self.assertEqual(sorted(Medicine.objects.values_list('name', 'batch_number', 'quantity')), [
+            ('Amoxicillin', 'A1', 5), ('Amoxicillin', f'A1-{rows[1].pk}', 7), ('Amoxicillin', f'A1-{rows[2].pk}', 9),
+            ('Ibuprofen', 'A1', 1),
+        ])
+
+
+class ProtectedMediaTests(TestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(MEDIA_ROOT=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(directory, 'scans'))
+        with open(os.path.join(directory, 'scans', 'scan.png'), 'wb') as out:
+            out.write(self.content)
+        self.name = 'scans/scan.png'
+        self.client = APIClient()
+
+    def get(self, name=None, signature=None, **headers):
+        name = name or self.name
+        url = signed_media_url(name) if signature is None else f'/api/media/{name}?sig={signature}'
+        response = self.client.get(url, **headers)
+        # Draining closes the file; response.close() on its own would also
+        # close the database connection mid-test on PostgreSQL
+        self.addCleanup(self.body, response)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def bearer(self, role):
+        user = user_with_role(role, role)
+        return {'HTTP_AUTHORIZATION': f'Bearer {CustomTokenObtainPairSerializer.get_token(user).access_token}'}
+
+    def test_signatures(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+        signature = sign_media_name(self.name)
+        self.assertEqual(self.get(signature=signature[:-1] + ('A' if signature[-1] != 'A' else 'B')).status_code, 401)
+        self.assertEqual(self.get('scans/other.png', signature=signature).status_code, 401)
+        with mock.patch('pulmoscan.media.time.time', return_value=time.time() - MEDIA_URL_MAX_AGE - MEDIA_URL_BUCKET):
+            expired = sign_media_name(self.name)
+        self.assertEqual(self.get(signature=expired).status_code, 401)
+
+    def test_bearer_tokens_need_the_doctor_role(self):
+        self.assertEqual(self.client.get(f'/api/media/{self.name}').status_code, 401)
+        self.assertEqual(self.client.get(f'/api/media/{self.name}', **self.bearer('pharmacist')).status_code, 403)
+        response = self.client.get(f'/api/media/{self.name}', **self.bearer('doctor'))
+        self.addCleanup(self.body, response)
+        self.assertEqual(response.status_code, 200)
+
+    def test_ranges_and_conditional_requests(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, f'bytes 10-19/{len(self.content)}'))
+        self.assertEqual(self.body(response), self.content[10:20])
+        self.assertEqual(self.body(self.get(HTTP_RANGE='bytes=-5')), self.content[-5:])
+
+        response = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.content)}'))
+        # Malformed and multi-range headers get the whole file
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-1,4-5').status_code, 200)
+
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_RANGE=etag, HTTP_RANGE='bytes=0-3').status_code, 206)
+        # A stale If-Range validator means the client's copy changed: send it whole
+        response = self.get(HTTP_IF_RANGE='"stale"', HTTP_RANGE='bytes=0-3')
+        self.assertEqual((response.status_code, self.body(response)), (200, self.content))
+
+    def test_content_addressed_files_are_immutable(self):
+        report = ScanReport(patient_name='Patient')
+        report.scan_image.save('scan.png', ContentFile(self.content), save=True)
+        response = self.get(report.scan_image.name)
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(self.content).hexdigest()}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag'], name=report.scan_image.name).status_code, 304)
+
+    def test_front_server_offload(self):
+        with override_settings(MEDIA_ACCEL='nginx', MEDIA_ACCEL_PREFIX='/internal-media/'):
+            response = self.get()
+        self.assertEqual((response.status_code, response.content), (200, b''))
+        self.assertEqual(response['X-Accel-Redirect'], f'/internal-media/{self.name}')
+        with override_settings(MEDIA_ACCEL='sendfile'):
+            response = self.get()
+        self.assertEqual(response['X-Sendfile'], os.path.join(scan_storage.location, self.name))
+        self.assertNotIn('X-Accel-Redirect', response)
+
+
+class DicomUploadTests(TestCase):
+    def validate(self, content):
+        serializer = ScanReportSerializer(data={
+            'patient_name': 'Patient', 'scan_image': SimpleUploadedFile('study.dcm', content),
+        })
+        return serializer.is_valid(), serializer.errors
+
+    def test_serializer_accepts_readable_dicom_only(self):
+        self.assertEqual(self.validate(dicom_file(np.zeros((2, 64, 64), dtype=np.uint16))), (True, {}))
+        for content in (
+            dicom_file(None, Rows=8, Columns=8, NumberOfFrames=MAX_REQUEST_FRAMES + 1),
+            b'\0' * 128 + b'DICM' + b'\xff' * 16,
+            b'neither an image nor DICOM',
+        ):
+            with warnings.catch_warnings():
+                # pydicom warns while parsing the junk after the DICM marker
+                warnings.simplefilter('ignore')
+                valid, errors = self.validate(content)
+            self.assertFalse(valid)
+            self.assertIn('scan_image', errors)
+
+
+class EventStreamTests(TestCase):
+    def test_tickets(self):
+        user = user_with_role('doctor', 'doctor')
+        ticket = issue_ticket(user, 'doctor')
+        self.assertEqual(read_ticket(ticket), (user.pk, 'doctor', False))
+        self.assertIsNone(read_ticket(ticket[:-2] + ticket[-1] + ticket[-2]))
+        self.assertIsNone(read_ticket('not a ticket'))
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + TICKET_MAX_AGE + 1):
+            self.assertIsNone(read_ticket(ticket))
+
+    async def test_events_reach_only_their_audience(self):
+        events = EventHub()
+        doctor, pharmacist, staff = (
+            events.subscribe('doctor', False), events.subscribe('pharmacist', False), events.subscribe('doctor', True),
+        )
+        for event_type in ('scan', 'stock', 'alerts', 'resync'):
+            events.publish({'type': event_type})
+        await asyncio.sleep(0)
+
+        def received(subscription):
+            return [subscription.queue.get_nowait()['type'] for _ in range(subscription.queue.qsize())]
+
+        self.assertEqual(received(doctor), ['scan', 'resync'])
+        self.assertEqual(received(pharmacist), ['stock', 'alerts', 'resync'])
+        self.assertEqual(received(staff), ['scan', 'stock', 'alerts', 'resync'])
+
+        # A subscriber that falls behind gets a single resync instead
+        for number in range(SUBSCRIBER_QUEUE_SIZE + 1):
+            events.publish({'type': 'scan', 'id': number})
+        await asyncio.sleep(0)
+        self.assertEqual(received(doctor), ['resync'])
+
+    def test_events_are_published_only_after_commit(self):
+        with mock.patch.object(hub, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                with contextlib.suppress(RuntimeError), transaction.atomic():
+                    ScanReport.objects.create(patient_name='Rolled back')
+                    raise RuntimeError
+            publish.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                report = ScanReport.objects.create(patient_name='Committed')
+        self.assertEqual(publish.call_count, 1)
+        event = publish.call_args.args[0]
+        self.assertEqual((event['type'], event['id'], event['patient_name']), ('scan', report.pk, 'Committed'))
+
+    @override_settings(SERVER_MODE='asgi')
+    async def test_stream_with_a_ticket(self):
+        doctor = await sync_to_async(user_with_role)('doctor', 'doctor')
+        client = AsyncClient()
+        for ticket in ('forged', issue_ticket(doctor, 'doctor')[:-1]):
+            self.assertEqual((await client.get('/api/events/', {'ticket': ticket})).status_code, 401)
+
+        with mock.patch('pulmoscan.events.hub', EventHub()) as events, \
+                mock.patch('pulmoscan.async_views.hub', events):
+            response = await client.get('/api/events/', {'ticket': issue_ticket(doctor, 'doctor')})
+            self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/event-stream'))
+            messages = aiter(response.streaming_content)
+            self.assertTrue((await anext(messages)).startswith(b'retry: '))
+            events.publish({'type': 'stock', 'medicines': [1]})
+            events.publish({'type': 'scan', 'id': 7})
+            message = (await anext(messages)).decode()
+            await messages.aclose()
+        # The pharmacists' stock event was filtered out
+        self.assertEqual(message.split('\n')[1:], ['event: scan', 'data: {"type":"scan","id":7}', '', ''])
+
+
+class ScanBlobReferenceTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(MEDIA_ROOT=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def report(self, content):
+        report = ScanReport(patient_name='Patient')
+        report.scan_image.save('scan.png', ContentFile(content), save=True)
+        return report
+
+    def refcounts(self):
+        return dict(ScanBlob.objects.values_list('name', 'refcount'))
+
+    def test_saves_and_deletes_keep_reference_counts(self):
+        first, second = self.report(b'same scan'), self.report(b'same scan')
+        shared = first.scan_image.name
+        self.assertEqual(second.scan_image.name, shared)
+        self.assertEqual(self.refcounts(), {shared: 2})
+
+        # Saving other fields leaves the counts alone
+        first.patient_name = 'Renamed'
+        first.save(update_fields=['patient_name'])
+        first.save()
+        self.assertEqual(self.refcounts(), {shared: 2})
+
+        second.scan_image.save('scan.png', ContentFile(b'replacement'), save=True)
+        replacement = second.scan_image.name
+        self.assertEqual(self.refcounts(), {shared: 1, replacement: 1})
+
+        # The last reference going away deletes the file once past the grace period
+        ScanBlob.objects.update(last_seen=timezone.now() - timedelta(hours=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            ScanReport.objects.get(pk=first.pk).delete()
+        self.assertEqual(self.refcounts(), {replacement: 1})
+        self.assertFalse(scan_storage.exists(shared))
+        self.assertTrue(scan_storage.exists(replacement))
+
+
+class EmbeddingSearchTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.store = EmbeddingStore(directory)
+        # Scans of similar lungs cluster: 40 groups of 50
+        rng = np.random.default_rng(0)
+        centres = rng.normal(size=(40, self.store.dim))
+        self.vectors = normalise(np.repeat(centres, 50, axis=0) + rng.normal(scale=0.6, size=(2000, self.store.dim)))
+        for scan_id, vector in enumerate(self.vectors, start=1):
+            self.store.append(scan_id, vector)
+        self.queries = normalise(centres[:10] + rng.normal(scale=0.6, size=(10, self.store.dim)))
+
+    def brute_force(self, query, k, exclude=()):
+        # Same float16 rows the store holds
+        scores = self.vectors.astype(np.float16).astype(np.float32) @ query
+        ranked = [int(i) + 1 for i in np.argsort(-scores, kind='stable') if int(i) + 1 not in exclude]
+        return ranked[:k]
+
+    def test_exact_search_matches_brute_force(self):
+        for query in self.queries:
+            results = self.store.search(query, 10, exclude={1, 2})
+            self.assertEqual([scan_id for scan_id, _ in results], self.brute_force(query, 10, exclude={1, 2}))
+            scores = [score for _, score in results]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+        # A scan analysed again is returned once
+        self.store.append(5, self.vectors[4])
+        ids = [scan_id for scan_id, _ in self.store.search(self.vectors[4], 5)]
+        self.assertEqual(ids.count(5), 1)
+
+    def test_ivf_search_recalls_the_exact_neighbours(self):
+        _, lists = self.store.build_index()
+        found = 0
+        for query in self.queries:
+            exact = self.brute_force(query, 10)
+            # Probing every list is exhaustive again
+            self.assertEqual([scan_id for scan_id, _ in self.store.search(query, 10, nprobe=lists)], exact)
+            found += len({scan_id for scan_id, _ in self.store.search(query, 10)} & set(exact))
+        self.assertGreaterEqual(found / (10 * len(self.queries)), 0.9)
+
+        # Rows appended after the build are searched exhaustively
+        self.store.append(5000, self.queries[0])
+        self.assertEqual(self.store.search(self.queries[0], 1)[0][0], 5000)
+
+
+class AdmissionTests(TestCase):
+    def test_full_queue_turns_uploads_away_with_503(self):
+        controller = AdmissionController(capacity=1, queue_limit=0, queue_timeout=1)
+        doctor = User.objects.create_user('doctor')
+        doctor.profile.role = 'doctor'
+        doctor.profile.save()
+        client = APIClient()
+        client.force_authenticate(doctor)
+
+        with mock.patch('pulmoscan.views.admission', controller), controller.admit('urgent'):
+            response = client.post('/api/scan-reports/?priority=urgent', {'patient_name': 'Queued'})
+        self.assertEqual(response.status_code, 503)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(controller.stats()['rejected']['queue_full'], 1)
+        self.assertFalse(ScanReport.objects.exists())
+
+    def test_released_slot_passes_to_the_next_waiter_urgent_first(self):
+        controller = AdmissionController(capacity=1, queue_limit=4, queue_timeout=10)
+        order, running = [], []
+
+        def upload(lane):
+            with controller.admit(lane):
+                order.append(lane)
+                running.append(controller.stats()['running'])
+
+        with controller.admit('routine'):
+            threads = []
+            for lane in ('routine', 'urgent'):
+                threads.append(threading.Thread(target=upload, args=(lane,)))
+                threads[-1].start()
+                while sum(controller.stats()['queued'].values()) < len(threads):
+                    time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ['urgent', 'routine'])
+        # Handed over, never freed and re-taken: one scan ran at a time
+        self.assertEqual(running, [1, 1])
+        stats = controller.stats()
+        self.assertEqual((stats['running'], stats['admitted']), (0, {'urgent': 1, 'routine': 2}))
+
+
+class ExportTests(TestCase):
+    def test_errors_are_json_and_exports_csv(self):
+        client = APIClient()
+        response = client.get('/api/scan-reports/export/')
+        self.assertEqual((response.status_code, response['Content-Type']), (401, 'application/json'))
+
+        pharmacist = User.objects.create_user('pharmacist')
+        pharmacist.profile.role = 'pharmacist'
+        pharmacist.profile.save()
+        client.force_authenticate(pharmacist)
+        response = client.get('/api/scan-reports/export/?format=ndjson')
+        self.assertEqual((response.status_code, response['Content-Type']), (403, 'application/json'))
+        self.assertIn('detail', response.json())
+
+        response = client.get('/api/inventory-transactions/export/')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/csv; charset=utf-8'))
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'id,'))
+
+    @override_settings(SERVER_MODE='asgi')
+    @mock.patch('pulmoscan.exports.EXPORT_WRITE_BATCH', 1)
+    async def test_asgi_export_is_streamed_row_by_row(self):
+        token = await sync_to_async(self.create_transactions)(5)
+        fetched = []
+        original_rows = InventoryTransactionReadSerializer.rows
+
+        def rows(serializer, *args, **kwargs):
+            names, rows = original_rows(serializer, *args, **kwargs)
+            return names, (fetched.append(row) or row for row in rows)
+
+        with mock.patch.object(InventoryTransactionReadSerializer, 'rows', rows):
+            response = await AsyncClient().get(
+                '/api/inventory-transactions/export/', headers={'Authorization': f'Bearer {token}'},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            chunks = aiter(response.streaming_content)
+            self.assertTrue((await anext(chunks)).startswith(b'id,'))
+            await anext(chunks)
+            self.assertEqual(len(fetched), 1)
+            rest = [chunk async for chunk in chunks]
+        self.assertEqual((len(rest), len(fetched)), (4, 5))
+
+    def create_transactions(self, count):
+        pharmacist = user_with_role('pharmacist', 'pharmacist')
+        medicine = Medicine.objects.create(name='Amoxicillin', batch_number='A1', expiry_date=date(2030, 1, 1),
+                                           quantity=count, price='2.50', supplier='Acme')
+        InventoryTransaction.objects.bulk_create([
+            InventoryTransaction(medicine=medicine, transaction_type='purchase', quantity=1) for _ in range(count)
+        ])
+        return CustomTokenObtainPairSerializer.get_token(pharmacist).access_token
+
+
+class FakeSidecar:
+    """
+    Answers every request on a Unix socket with zero logits (or never,
+    while `hang` is set) and counts the requests it received.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.requests = 0
+        self.hang = False
+        self.connections = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(8)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        while True:
+            try:
+                _, count, height, width = REQUEST_HEADER.unpack(recv_exactly(connection, REQUEST_HEADER.size))
+                recv_exactly(connection, count * height * width)
+                self.requests += 1
+                if not self.hang:
+                    connection.sendall(
+                        RESPONSE_HEADER.pack(PROTOCOL_MAGIC, STATUS_OK, count, 2, 4)
+                        + np.zeros((count, 2), '<f4').tobytes() + np.zeros((count, 4), '<f2').tobytes()
+                    )
+            except OSError:
+                return
+
+    def drop_connections(self):
+        # As a restart would: every pooled client connection goes stale
+        for connection in self.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+            connection.close()
+        self.connections = []
+
+    def stop(self):
+        self.drop_connections()
+        self.server.close()
+        os.unlink(self.path)
+
+
+class SidecarClientTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'inference.sock')
+        self.sidecar = FakeSidecar(self.path)
+        self.addCleanup(self.sidecar.server.close)
+        self.client = SidecarClient(self.path, pool_size=4, timeout=0.5)
+        self.frames = np.zeros((1, 32, 32), dtype=np.uint8)
+
+    def test_dropped_pooled_connection_is_retried_on_a_fresh_one(self):
+        self.client.predict(self.frames)
+        self.sidecar.drop_connections()
+        logits, embeddings = self.client.predict(self.frames)
+        self.assertEqual((logits.shape, embeddings.shape), ((1, 2), (1, 4)))
+        self.assertEqual(self.sidecar.requests, 2)
+
+    def test_retries_at_most_once(self):
+        for _ in range(3):
+            self.client._idle.put(self.client._connect())
+        self.sidecar.stop()
+        with self.assertRaises(InferenceUnavailable):
+            self.client.predict(self.frames)
+        # One stale connection tried, then the fresh one failed: no more
+        self.assertEqual(self.client._idle.qsize(), 2)
+
+    def test_timeouts_are_not_retried(self):
+        self.client.predict(self.frames)
+        self.sidecar.hang = True
+        with self.assertRaises(InferenceUnavailable):
+            self.client.predict(self.frames)
+        self.assertEqual(self.sidecar.requests, 2)
+
+
+class ModelLoadingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.weights = os.path.join(self.directory, 'pulmoscan', 'model_weights', 'pneumonia_resnet18.pt')
+        os.makedirs(os.path.dirname(self.weights))
+        settings = override_settings(BASE_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patched = mock.patch.object(utils, 'model', None)
+        patched.start()
+        self.addCleanup(patched.stop)
+        self.frames = np.zeros((1, 224, 224), dtype=np.uint8)
+
+    def test_missing_or_broken_weights_leave_no_model(self):
+        for content in (None, b'not a state dict'):
+            if content is not None:
+                with open(self.weights, 'wb') as out:
+                    out.write(content)
+            with self.assertLogs('pulmoscan.utils', 'ERROR'), self.assertRaises(ModelUnavailable):
+                utils.predict(self.frames)
+            self.assertIsNone(utils.model)
+
+        with self.assertLogs('pulmoscan.inference', 'ERROR'):
+            result = analyse_frames(list(self.frames), backend=LocalModel(), cascade=())
+        self.assertEqual(result['diagnosis'], 'Error')
+
+    def test_loaded_model_is_in_eval_mode(self):
+        network = resnet18(weights=None)
+        network.fc = torch.nn.Linear(network.fc.in_features, len(class_names))
+        torch.save(network.state_dict(), self.weights)
+        logits, embeddings = utils.predict(self.frames)
+        self.assertFalse(utils.model.training)
+        self.assertEqual((logits.shape, embeddings.shape), ((1, 2), (1, 512)))
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        ScanReport.objects.bulk_create(
+            ScanReport(patient_name=f'P{i}', diagnosis='Pneumonia' if i % 2 else 'Normal') for i in range(6)
+        )
+        # Every table counts as large
+        patched = mock.patch.object(pulmoscan_admin, 'ESTIMATE_COUNT_ABOVE', 0)
+        patched.start()
+        self.addCleanup(patched.stop)
+
+    def count(self, queryset):
+        with CaptureQueriesContext(connection) as queries:
+            count = pulmoscan_admin.EstimatedCountPaginator(queryset, 2).count
+        return count, [query['sql'] for query in queries]
+
+    def test_filtered_lists_count_exactly(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            count, queries = self.count(ScanReport.objects.filter(diagnosis='Normal').order_by('pk'))
+        self.assertEqual(count, 3)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('COUNT(*)', queries[0])
+
+    def test_other_databases_count_exactly(self):
+        with mock.patch.object(connection, 'vendor', 'sqlite'):
+            count, queries = self.count(ScanReport.objects.order_by('pk'))
+        self.assertEqual(count, 6)
+        self.assertNotIn('pg_class', ' '.join(queries))
+
+    @skipUnless(connection.vendor == 'postgresql', 'planner statistics are PostgreSQL only')
+    def test_unfiltered_postgresql_lists_use_the_planner_estimate(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {ScanReport._meta.db_table}')
+        ScanReport.objects.create(patient_name='After ANALYZE')
+        self.assertEqual(self.count(ScanReport.objects.order_by('pk'))[0], 6)
+        self.assertEqual(self.count(ScanReport.objects.exclude(patient_name='').order_by('pk'))[0], 7)
@@ -1,8 +1,10 @@
 # medpharma/urls/dashboard_urls.py
 from django.urls import path
-from pulmoscan.views import stock_summary, doctor_dashboard_summary
+from pulmoscan.views import stock_summary, doctor_dashboard_summary, stock_forecast, inference_status
 
 urlpatterns = [
     path("stock-summary/", stock_summary, name="dashboard-stock-summary"),
     path("doctor-summary/", doctor_dashboard_summary, name="dashboard-doctor-summary"),
+    path("stock-forecast/", stock_forecast, name="dashboard-stock-forecast"),
+    path("inference-status/", inference_status, name="dashboard-inference-status"),
 ]
@@ -0,0 +1,9 @@
+# pulmoscan/urls/events_urls.py
+from django.urls import path
+from pulmoscan.async_views import event_stream
+from pulmoscan.views import event_ticket
+
+urlpatterns = [
+    path("", event_stream, name="event-stream"),
+    path("ticket/", event_ticket, name="event-ticket"),
+]
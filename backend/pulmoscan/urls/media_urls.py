@@ -0,0 +1,7 @@
+# pulmoscan/urls/media_urls.py
+from django.urls import path
+from pulmoscan.views import protected_media
+
+urlpatterns = [
+    path("<path:name>", protected_media, name="protected-media"),
+]
@@ -1,42 +1,57 @@
+import logging
+import threading
+
+import numpy as np
 import torch
 from torchvision import transforms
 from PIL import Image
 import os
 from django.conf import settings
 
+# The threshold and diagnosis logic live in the torch-free
+# pulmoscan.inference, shared with the web tier and the inference sidecar
+from pulmoscan.inference import (
+    class_names, PNEUMONIA_CONFIDENCE_THRESHOLD, LocalModel, analyse_frames, analyse_scan,
+)
+
+logger = logging.getLogger(__name__)
+
 model = None
+_model_lock = threading.Lock()
 
-class_names = ["Normal", "Pneumonia"]
 
-# Define a threshold for Pneumonia confidence
-# This value will need to be tuned based on your desired balance
-# between false positives (misclassifying Normal as Pneumonia)
-# and false negatives (misclassifying Pneumonia as Normal).
-# A good starting point might be higher than the 68.11% you observed for a normal image.
-PNEUMONIA_CONFIDENCE_THRESHOLD = 0.75 # Example: Only consider Pneumonia if confidence is 75% or higher
+class ModelUnavailable(RuntimeError):
+    pass
+
 
 def load_model():
+    """
+    Loads the weights into a fresh network and only then publishes it as
+    `model`, in eval mode. When the weights are missing or do not load,
+    `model` stays None, so predict raises ModelUnavailable instead of
+    running a randomly initialised network.
+    """
     global model
     from torchvision.models import resnet18
 
-    model = resnet18(pretrained=False)
-    model.fc = torch.nn.Linear(model.fc.in_features, len(class_names))
+    network = resnet18(weights=None)
+    network.fc = torch.nn.Linear(network.fc.in_features, len(class_names))
 
     model_path = os.path.join(settings.BASE_DIR, "pulmoscan", "model_weights", "pneumonia_resnet18.pt")
 
     if not os.path.exists(model_path):
-        print(f"ERROR: Model file not found at: {model_path}")
+        logger.error("Model file not found at: %s", model_path)
         return
 
     try:
-        model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')))
-        print(f"Model loaded successfully from: {model_path}")
+        network.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')))
     except Exception as e:
-        print(f"ERROR loading model state_dict: {e}")
+        logger.error("Could not load model weights from %s: %s", model_path, e)
         return
 
-    model.eval()
-    print("Model set to evaluation mode.")
+    network.eval()
+    model = network
+    logger.info("Model loaded from: %s", model_path)
 
 transform = transforms.Compose([
     transforms.Resize((224, 224)),
@@ -45,68 +60,61 @@ transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
-def run_ai_on_scan(image_path):
-    if not os.path.exists(image_path):
-        print(f"ERROR: Image file not found at: {image_path}")
-        return {"diagnosis": "Error", "confidence": 0, "message": "Image file not found"}
+# The tail of `transform` (Grayscale to 3 channels, ToTensor, Normalize)
+# applied to a whole uint8 batch at once
+_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
 
-    if model is None:
-        print("Model not loaded, attempting to load...")
-        load_model()
+# Frames per forward pass
+FRAME_BATCH_SIZE = 16
+
+def _forward(batch):
+    # resnet18.forward, keeping the pooled 512-d features fed to `fc`
+    x = model.maxpool(model.relu(model.bn1(model.conv1(batch))))
+    x = model.layer4(model.layer3(model.layer2(model.layer1(x))))
+    features = torch.flatten(model.avgpool(x), 1)
+    return model.fc(features), features
+
+def predict(frames):
+    """
+    Raw model outputs for n 224x224 uint8 grayscale frames: float32 logits
+    of shape (n, len(class_names)) and the (n, 512) penultimate-layer
+    embeddings from the same forward pass. Gives the same numbers as
+    `transform` applied to each frame as an 'L' image, without building
+    PIL images or per-frame tensors. Smaller square frames (cascade
+    screening) go through the same network; its pooling adapts.
+    """
+    with _model_lock:
         if model is None:
-            return {"diagnosis": "Error", "confidence": 0, "message": "Model failed to load"}
+            load_model()
+            if model is None:
+                raise ModelUnavailable("Model failed to load")
 
-    try:
-        image = Image.open(image_path).convert("RGB")
-        img_tensor = transform(image).unsqueeze(0)
+    frames = torch.from_numpy(np.require(frames, np.uint8, ['C_CONTIGUOUS', 'WRITEABLE']))
+    logits, embeddings = [], []
+    with torch.no_grad():
+        for start in range(0, len(frames), FRAME_BATCH_SIZE):
+            batch = frames[start:start + FRAME_BATCH_SIZE].float().div(255).unsqueeze(1).expand(-1, 3, -1, -1)
+            batch_logits, batch_embeddings = _forward((batch - _MEAN) / _STD)
+            logits.append(batch_logits)
+            embeddings.append(batch_embeddings)
+    return torch.cat(logits).numpy(), torch.cat(embeddings).numpy()
 
-        with torch.no_grad():
-            outputs = model(img_tensor)
-            
-            # --- DEBUG PRINTS (KEEP THESE FOR NOW) ---
-            print(f"--- AI Inference Debug for {image_path} ---")
-            print(f"Raw model outputs (logits): {outputs}")
-            
-            probabilities = torch.softmax(outputs, dim=1)[0]
-            print(f"Softmax probabilities: {probabilities}")
-
-            # Get the confidence for Pneumonia (Index 1)
-            pneumonia_confidence = probabilities[class_names.index("Pneumonia")].item()
-            normal_confidence = probabilities[class_names.index("Normal")].item()
-
-            # --- APPLY THRESHOLD LOGIC ---
-            final_diagnosis = "Normal"
-            final_confidence = round(normal_confidence * 100, 2)
-
-            if pneumonia_confidence >= PNEUMONIA_CONFIDENCE_THRESHOLD:
-                final_diagnosis = "Pneumonia"
-                final_confidence = round(pneumonia_confidence * 100, 2)
-            else:
-                # If pneumonia confidence is below threshold, but still the highest,
-                # we default to "Normal" and report the normal confidence.
-                # However, for clarity, you might want to report the pneumonia confidence
-                # even if it's below threshold and you label it normal.
-                # For this example, if it's below threshold, we're explicitly saying Normal.
-                pass # The defaults for final_diagnosis and final_confidence are already "Normal" and its confidence
-
-            # --- END THRESHOLD LOGIC ---
-
-            # Optional: You can still print what the raw model predicted before thresholding
-            _, raw_predicted_idx_tensor = torch.max(probabilities, 0)
-            raw_predicted_idx = raw_predicted_idx_tensor.item()
-            print(f"Raw model predicted index: {raw_predicted_idx} ({class_names[raw_predicted_idx]})")
-            print(f"Raw model predicted confidence: {probabilities[raw_predicted_idx].item()*100:.2f}%")
-            # --- END DEBUG PRINTS ---
 
-        print(f"Final Diagnosis (After Threshold): {final_diagnosis}, Final Confidence: {final_confidence}%")
+def run_ai_on_scan(image_path):
+    """
+    Analyses a scan image in this process (see pulmoscan.inference for the
+    sidecar-aware entry points the views use).
+    """
+    return analyse_scan(image_path, backend=LocalModel())
 
-        return {
-            "diagnosis": final_diagnosis,
-            "confidence": final_confidence
-        }
-    except Exception as e:
-        print(f"ERROR during AI inference: {e}")
-        return {"diagnosis": "Error", "confidence": 0, "message": f"Inference failed: {e}"}
+
+def run_ai_on_frames(frames):
+    """
+    Analyses the 224x224 8-bit grayscale frames of a DICOM study (see
+    pulmoscan.dicom.read_study) in this process.
+    """
+    return analyse_frames(frames, backend=LocalModel())
     
 
 
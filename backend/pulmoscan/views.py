@@ -2,17 +2,20 @@
 
 # C:\Users\91789\OneDrive\Desktop\MEDIPHARM360\medpharma360\medpharma\views.py
 
-from datetime import date, timedelta
 from rest_framework import viewsets, status, generics, serializers # Added 'serializers' for ValidationError
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated # Removed AllowAny as it's not generally used in class-based permission_classes directly
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import AuthenticationFailed
 
-from pulmoscan.utils import run_ai_on_scan
+from pulmoscan.inference import analyse_scan, analyse_frames
 
 # Import all models from your app
 from .models import Medicine, InventoryTransaction, ScanReport, UserProfile, CustomUser
@@ -21,11 +24,34 @@ from .serializers import (
     MedicineSerializer,
     InventoryTransactionSerializer,
     ScanReportSerializer,
+    FefoSaleSerializer,
+    MedicineReadSerializer,
+    InventoryTransactionReadSerializer,
+    ScanReportReadSerializer,
     UserProfileSerializer,
     CustomTokenObtainPairSerializer
 )
 # Import your custom permissions
-from .permissions import IsDoctor, IsPharmacist, IsAdminUserCustom
+from .permissions import IsDoctor, IsPharmacist, IsAdminUserCustom, user_role
+from .authentication import ClaimsJWTAuthentication, full_user
+from .revocation import FilteredRefreshToken
+from .alerts import current_alerts
+from .conditional import ConditionalGetMixin, conditional_on
+from .fastpath import FastListMixin
+from .dicom import DicomError, is_dicom, read_study
+from .exports import ExportMixin
+from .media import media_signature_valid, serve_content, serve_media
+from .events import issue_ticket, TICKET_MAX_AGE
+from .archive import archived_report, read_cold_blob
+from .embeddings import get_store
+from .calibration import calibrated_diagnosis, current_calibration
+from .admission import ScanUploadThrottle, controller as admission, upload_lane
+from .imports import import_medicines, ImportFileError
+from .inventory import allocate_fefo, InsufficientStockError, record_opening_stock, stock_at
+from .analytics import (
+    stock_forecast as compute_stock_forecast,
+    DEFAULT_WINDOW_DAYS, DEFAULT_LEAD_TIME_DAYS, DEFAULT_REVIEW_PERIOD_DAYS,
+)
 
 
 # --- JWT Token View ---
@@ -49,7 +75,7 @@ class LogoutView(APIView):
         if not refresh_token:
             return Response({"detail": "Missing refresh token"}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
             return Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception as e:
@@ -58,29 +84,82 @@ class LogoutView(APIView):
 
 
 # --- Medicine API ---
-class MedicineViewSet(viewsets.ModelViewSet):
+class MedicineViewSet(ConditionalGetMixin, FastListMixin, viewsets.ModelViewSet):
+    conditional_resources = ('medicines',)
     queryset = Medicine.objects.all()
     serializer_class = MedicineSerializer
+    read_serializer_class = MedicineReadSerializer
     permission_classes = [IsAuthenticated, IsPharmacist | IsAdminUserCustom] # Only pharmacists and admins can manage medicines
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            record_opening_stock(serializer.save(), user=full_user(self.request))
+
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated]) # Any authenticated user can view alerts
+    @conditional_on('medicines')
     def alerts(self, request):
-        low_stock = Medicine.objects.filter(quantity__lt=10)
-        expired = Medicine.objects.filter(expiry_date__lt=date.today())
+        alerts = current_alerts(MedicineReadSerializer(request))
         return Response({
-            'low_stock': MedicineSerializer(low_stock, many=True).data,
-            'expired': MedicineSerializer(expired, many=True).data
+            'low_stock': alerts['low_stock'],
+            'expired': alerts['expired']
+        })
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        """
+        Bulk-creates or tops up batches from an uploaded CSV/XLSX `file`
+        (columns name, batch_number, expiry_date, quantity, price,
+        supplier), recording a purchase transaction per row. Rows that fail
+        validation are skipped and listed in `errors`.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise serializers.ValidationError({'file': 'Upload a CSV or XLSX file.'})
+        try:
+            summary = import_medicines(upload.file, upload.name, user=full_user(request))
+        except ImportFileError as e:
+            raise serializers.ValidationError({'file': str(e)})
+        return Response(summary)
+
+    @action(detail=False, methods=['get'], url_path='stock-at', url_name='stock-at')
+    def stock_on_date(self, request):
+        """
+        Stock held per batch at the end of ?date=YYYY-MM-DD, rebuilt from the
+        nearest daily snapshot plus the ledger between it and that date.
+        """
+        try:
+            # parse_date raises on well-formed but impossible dates (2024-02-30)
+            day = parse_date(request.query_params.get('date') or '')
+        except ValueError:
+            day = None
+        if day is None:
+            raise serializers.ValidationError({'date': 'Provide a date as YYYY-MM-DD.'})
+
+        quantities, anchor_date = stock_at(day)
+        medicines = Medicine.objects.filter(id__in=quantities.keys()).values('id', 'name', 'batch_number')
+        rows = [
+            {**medicine, 'quantity': quantities[medicine['id']]}
+            for medicine in medicines.order_by('name', 'batch_number')
+        ]
+        return Response({
+            'date': day,
+            'snapshot_date': anchor_date,
+            'total_quantity': sum(row['quantity'] for row in rows),
+            'medicines': rows,
         })
 
 
 # --- Inventory Transaction API ---
-class InventoryTransactionViewSet(viewsets.ModelViewSet):
+class InventoryTransactionViewSet(ConditionalGetMixin, FastListMixin, ExportMixin, viewsets.ModelViewSet):
+    conditional_resources = ('inventory',)
+    export_name = 'inventory-transactions'
     queryset = InventoryTransaction.objects.all()
     serializer_class = InventoryTransactionSerializer
+    read_serializer_class = InventoryTransactionReadSerializer
     permission_classes = [IsAuthenticated, IsPharmacist | IsAdminUserCustom] # Only pharmacists and admins can manage transactions
 
     def perform_create(self, serializer):
-        instance = serializer.save(user=self.request.user) # Save with the current user. Remove the second instance.save() below.
+        instance = serializer.save(user=full_user(self.request)) # Save with the current user. Remove the second instance.save() below.
         medicine = instance.medicine
         if instance.transaction_type == 'purchase':
             medicine.quantity += instance.quantity
@@ -90,37 +169,159 @@ class InventoryTransactionViewSet(viewsets.ModelViewSet):
             medicine.quantity -= instance.quantity
         medicine.save()
 
+    @action(detail=False, methods=['post'], url_path='fefo-sale')
+    def fefo_sale(self, request):
+        """
+        Sells a quantity of a medicine by name, picking batches
+        first-expiry-first-out instead of naming one exact batch.
+        """
+        serializer = FefoSaleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            transactions = allocate_fefo(
+                serializer.validated_data['name'],
+                serializer.validated_data['quantity'],
+                user=full_user(request),
+            )
+        except InsufficientStockError as e:
+            raise serializers.ValidationError(str(e))
+        return Response(InventoryTransactionSerializer(transactions, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
 
 # --- Scan Report API ---
-class ScanReportViewSet(viewsets.ModelViewSet):
+class ScanReportViewSet(ConditionalGetMixin, FastListMixin, ExportMixin, viewsets.ModelViewSet):
+    conditional_resources = ('scans',)
+    export_name = 'scan-reports'
     queryset = ScanReport.objects.all()
     serializer_class = ScanReportSerializer
+    read_serializer_class = ScanReportReadSerializer
     parser_classes = [MultiPartParser]
     permission_classes = [IsAuthenticated, IsDoctor | IsAdminUserCustom] # Only doctors and admins can manage scan reports
 
     
-    def perform_create(self, serializer):
+    # The create path is split into steps so the ASGI view
+    # (pulmoscan.async_views) can run the CPU-bound ones off the event loop.
+    def read_upload(self, serializer):
+        """
+        Decodes a DICOM upload (None for plain images). CPU-bound, no DB.
+        """
+        upload = serializer.validated_data['scan_image']
+        if not is_dicom(upload):
+            return None
+        # Decoded once: the preview becomes scan_image, the model-sized
+        # frames go straight to the model, the original is kept as-is.
+        try:
+            return read_study(upload)
+        except DicomError as e:
+            raise serializers.ValidationError({'scan_image': str(e)})
+
+    def save_upload(self, serializer, study):
         # Step 1: Save the initial instance. This ensures the image is saved
         # and the 'instance' object has an ID and a path to the image.
-        instance = serializer.save(user=self.request.user)
-
+        if study is None:
+            return serializer.save(user=full_user(self.request))
+        return serializer.save(
+            user=full_user(self.request), scan_image=study.preview,
+            source_file=serializer.validated_data['scan_image'], dicom_metadata=study.metadata,
+        )
+
+    @staticmethod
+    def analyse(instance, study, calibration=None):
+        """
+        Runs the model on a saved scan, in the inference sidecar when one is
+        configured, under `calibration` (current_calibration()). Blocking,
+        no DB.
+        """
         try:
             # Step 2: Run AI analysis using the path of the saved image
-            prediction = run_ai_on_scan(instance.scan_image.path)
-
+            if study is None:
+                return analyse_scan(instance.scan_image.path, calibration=calibration)
+            return analyse_frames(study.frames, calibration=calibration)
+        except Exception as e:
+            print(f"Error running AI on scan for {instance.patient_name}: {e}")
+            return None
+
+    @staticmethod
+    def save_prediction(instance, prediction):
+        if prediction is not None:
+            if "logits" in prediction:
+                # Keep the raw outputs and apply the calibration in force
+                instance.normal_logit, instance.pneumonia_logit = (float(value) for value in prediction["logits"])
+                prediction = {**prediction, **calibrated_diagnosis(prediction["logits"])}
             # Step 3: Update the instance's diagnosis and confidence attributes
+            instance.analysis_stage = prediction.get("stage")
             instance.diagnosis = prediction["diagnosis"]
             instance.confidence = prediction["confidence"]
-
-        except Exception as e:
+            if "embedding" in prediction:
+                embedding = prediction["embedding"]
+                transaction.on_commit(lambda: get_store().append(instance.pk, embedding))
+        else:
             # Step 4 (Error Handling): If AI fails, set default/error values
             instance.diagnosis = "Analysis Failed (Error: AI model unavailable/failed)"
             instance.confidence = 0.0 # Set a default numerical value, not None
-            print(f"Error running AI on scan for {instance.patient_name}: {e}")
 
         # Step 5: IMPORTANT! Save the instance AGAIN to persist the updated
         # diagnosis and confidence values to the database.
         instance.save()
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            # Reports moved out of the hot table by `archive_scans` read the same
+            report = archived_report(kwargs.get(self.lookup_url_kwarg or self.lookup_field))
+            if report is None:
+                raise
+            self.check_object_permissions(request, report)
+            return Response(self.get_serializer(report).data)
+
+    def get_throttles(self):
+        if self.action == 'create':
+            return [*super().get_throttles(), ScanUploadThrottle()]
+        return super().get_throttles()
+
+    def create(self, request, *args, **kwargs):
+        # Waits for an analysis slot, or fails fast with 503 when the queue is full
+        with admission.admit(upload_lane(request)):
+            return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        study = self.read_upload(serializer)
+        instance = self.save_upload(serializer, study)
+        self.save_prediction(instance, self.analyse(instance, study, current_calibration()))
+
+    @action(detail=True, methods=['get'])
+    @conditional_on('scans')
+    def similar(self, request, pk=None):
+        """
+        The `k` (default 5, at most 50) past scans whose embeddings are
+        closest to this one's, most similar first, each with its cosine
+        `similarity`.
+        """
+        report = self.get_object()
+        try:
+            k = int(request.query_params.get('k', 5))
+        except ValueError:
+            raise serializers.ValidationError({'k': 'Must be an integer.'})
+        if not 1 <= k <= 50:
+            raise serializers.ValidationError({'k': 'Must be between 1 and 50.'})
+
+        store = get_store()
+        embedding = store.vector_for(report.pk)
+        if embedding is None:
+            return Response({"detail": "No embedding recorded for this scan report."}, status=status.HTTP_404_NOT_FOUND)
+        # A few spare matches in case some reports have since been deleted
+        matches = store.search(embedding, k + 10, exclude={report.pk})
+        rows = self.read_serializer_class(request).serialize(
+            ScanReport.objects.filter(pk__in=[scan_id for scan_id, _ in matches]), extra=('pk',)
+        )
+        by_id = {row.pop('pk'): row for row in rows}
+        return Response([
+            {**by_id[scan_id], "similarity": round(similarity, 4)}
+            for scan_id, similarity in matches if scan_id in by_id
+        ][:k])
+
     def get_queryset(self):
         queryset = super().get_queryset()
         patient_name = self.request.query_params.get('patient_name', None) # patient_name will be an empty string ''
@@ -139,12 +340,12 @@ class UserProfileViewSet(viewsets.ReadOnlyModelViewSet):
         # Admins can see all profiles, non-admins can only see their own
         if self.request.user.is_staff:
             return UserProfile.objects.all()
-        return UserProfile.objects.filter(user=self.request.user)
+        return UserProfile.objects.filter(user_id=self.request.user.id)
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         # Ensure user can only view their own profile unless they are an admin
-        if request.user == instance.user or request.user.is_staff:
+        if instance.user_id == request.user.id or request.user.is_staff:
             serializer = self.get_serializer(instance)
             return Response(serializer.data)
         return Response({"detail": "You do not have permission to access this profile."},
@@ -154,26 +355,23 @@ class UserProfileViewSet(viewsets.ReadOnlyModelViewSet):
 # --- Dashboard Summary APIs ---
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, IsPharmacist | IsAdminUserCustom]) # Only Pharmacists and Admins
+@conditional_on('medicines')
 def stock_summary(request):
-    today = date.today()
-    near_expiry_date = today + timedelta(days=30)
-
     total_medicines = Medicine.objects.count()
-    low_stock_medicines = Medicine.objects.filter(quantity__lte=10)
-    expired_medicines = Medicine.objects.filter(expiry_date__lt=today)
-    expiring_soon_medicines = Medicine.objects.filter(expiry_date__gte=today, expiry_date__lte=near_expiry_date)
+    alerts = current_alerts(MedicineReadSerializer(request))
 
     return Response({
         "total_medicines": total_medicines,
-        "low_stock_count": low_stock_medicines.count(),
-        "expired_count": expired_medicines.count(),
-        "expiring_soon_count": expiring_soon_medicines.count(),
-        "low_stock_medicines": MedicineSerializer(low_stock_medicines, many=True).data,
-        "expiring_soon_medicines": MedicineSerializer(expiring_soon_medicines, many=True).data,
+        "low_stock_count": len(alerts['low_stock']),
+        "expired_count": len(alerts['expired']),
+        "expiring_soon_count": len(alerts['expiring_soon']),
+        "low_stock_medicines": alerts['low_stock'],
+        "expiring_soon_medicines": alerts['expiring_soon'],
     })
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, IsDoctor | IsAdminUserCustom]) # Only Doctors and Admins
+@conditional_on('scans')
 def doctor_dashboard_summary(request):
     # If you want to filter scans by the doctor who uploaded them, use:
     # total_scans = ScanReport.objects.filter(user=request.user).count()
@@ -191,5 +389,90 @@ def doctor_dashboard_summary(request):
         "total_scans": total_scans,
         "pneumonia_cases": pneumonia_count,
         "normal_cases": normal_count,
-        "recent_scans": ScanReportSerializer(recent_scans, many=True).data,
-    })
\ No newline at end of file
+        "recent_scans": ScanReportReadSerializer(request).serialize(recent_scans),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsPharmacist | IsAdminUserCustom]) # Only Pharmacists and Admins
+@conditional_on('medicines', 'consumption')
+def stock_forecast(request):
+    def int_param(name, default, minimum, maximum):
+        try:
+            value = int(request.query_params.get(name, default))
+        except (TypeError, ValueError):
+            raise serializers.ValidationError({name: 'Must be an integer.'})
+        if not minimum <= value <= maximum:
+            raise serializers.ValidationError({name: f'Must be between {minimum} and {maximum}.'})
+        return value
+
+    window_days = int_param('window', DEFAULT_WINDOW_DAYS, 28, 730)
+    lead_time_days = int_param('lead_time', DEFAULT_LEAD_TIME_DAYS, 1, 180)
+    review_period_days = int_param('review_period', DEFAULT_REVIEW_PERIOD_DAYS, 1, 180)
+
+    return Response({
+        "window_days": window_days,
+        "lead_time_days": lead_time_days,
+        "review_period_days": review_period_days,
+        "medicines": compute_stock_forecast(window_days, lead_time_days, review_period_days),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsDoctor | IsAdminUserCustom])
+def inference_status(request):
+    """
+    Admission state of scan analysis in the worker process serving this
+    request: slots in use, queue depth per lane, admissions and rejections.
+    """
+    return Response(admission.stats())
+
+
+# --- Protected media ---
+def protected_media(request, name):
+    """
+    Serves an uploaded file (scan images) to doctors and admins, the same
+    audience as the scan report API. Access is granted by the `sig` query
+    parameter of the URLs the API hands out, so <img src> works without an
+    Authorization header, or by a Bearer token with the right role.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+
+    signature = request.GET.get('sig')
+    if not (signature and media_signature_valid(name, signature)):
+        try:
+            authenticated = ClaimsJWTAuthentication().authenticate(request)
+        except AuthenticationFailed as e:
+            detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            return JsonResponse(detail, status=401)
+        if authenticated is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        user = authenticated[0]
+        if not (user.is_staff or user_role(user) == 'doctor'):
+            return JsonResponse({'detail': 'You do not have permission to perform this action.'}, status=403)
+
+    try:
+        return serve_media(request, name)
+    except Http404:
+        # Files of archived scan reports are read back from cold storage packs
+        content = read_cold_blob(name)
+        if content is None:
+            raise
+        return serve_content(request, name, content)
+
+
+# --- Live events ---
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def event_ticket(request):
+    """
+    Short-lived ticket for opening the event stream (/api/events/) from an
+    EventSource, which cannot send an Authorization header.
+    """
+    if settings.SERVER_MODE != 'asgi':
+        # No stream to open; the client keeps fetching as usual
+        return Response({"detail": "The event stream is only available with SERVER_MODE=asgi."},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({
+        "ticket": issue_ticket(request.user, user_role(request.user)),
+        "expires_in": TICKET_MAX_AGE,
+    })
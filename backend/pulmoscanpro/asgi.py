@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pulmoscanpro.settings')
+# Enables the async scan upload path (pulmoscan.async_views)
+os.environ.setdefault('SERVER_MODE', 'asgi')
 
 application = get_asgi_application()
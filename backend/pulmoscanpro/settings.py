@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from datetime import timedelta 
 from pathlib import Path
 import os
+import tempfile
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,11 +53,16 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Builds request.user from the verified token claims, no user/profile queries
+        'pulmoscan.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'pulmoscan.renderers.FastJSONRenderer', # orjson when installed, stock JSON otherwise
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 
@@ -92,6 +98,10 @@ SIMPLE_JWT = {
 
     "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
+
+    # Revocation checks via an in-process filter (see pulmoscan/revocation.py).
+    # Expired rows are pruned by `manage.py prune_tokens`, run from cron.
+    "TOKEN_REFRESH_SERIALIZER": "pulmoscan.serializers.FilteredTokenRefreshSerializer",
 }
 
 MIDDLEWARE = [
@@ -126,6 +136,56 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'pulmoscanpro.wsgi.application'
 
+# 'wsgi' (sync gunicorn workers) or 'asgi' (uvicorn workers, set by
+# pulmoscanpro/asgi.py). In ASGI mode scan uploads are handled by an async
+# view that runs inference on a bounded thread pool; see gunicorn.conf.py.
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+# Scans analysed concurrently per worker process in ASGI mode
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', '1'))
+# Unix socket of the inference sidecar (`manage.py inference_sidecar`).
+# Unset, the model is loaded inside the web process on the first scan.
+INFERENCE_SOCKET = os.environ.get('INFERENCE_SOCKET')
+# Pooled connections per web process, and seconds to wait for a result
+INFERENCE_POOL_SIZE = int(os.environ.get('INFERENCE_POOL_SIZE', '4'))
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', '60'))
+# Cascade mode: every scan is first screened by the model at
+# CASCADE_SCREEN_SIZE pixels (0 = off, full model only); only screens whose
+# pneumonia probability lies in CASCADE_UNCERTAIN_BAND [low, high) go on to
+# the full 224x224 pass. Tune with `manage.py evaluate_cascade`.
+CASCADE_SCREEN_SIZE = int(os.environ.get('CASCADE_SCREEN_SIZE', '0'))
+CASCADE_UNCERTAIN_BAND = tuple(float(value) for value in os.environ.get('CASCADE_UNCERTAIN_BAND', '0.2,0.9').split(','))
+# Admission control for scan uploads (pulmoscan.admission), per worker
+# process: scans analysed at once, uploads allowed to wait for a slot (more
+# get 503 + Retry-After) and seconds one may wait. Defaults to
+# INFERENCE_WORKERS so the ASGI inference pool never builds its own queue.
+SCAN_ANALYSIS_CONCURRENCY = int(os.environ.get('SCAN_ANALYSIS_CONCURRENCY', str(INFERENCE_WORKERS)))
+SCAN_QUEUE_LIMIT = int(os.environ.get('SCAN_QUEUE_LIMIT', '8'))
+SCAN_QUEUE_TIMEOUT = float(os.environ.get('SCAN_QUEUE_TIMEOUT', '30'))
+# Per-user upload quota: a burst of SCAN_UPLOAD_BURST, then SCAN_UPLOAD_RATE
+# per minute (429 + Retry-After beyond; 0 turns the quota off)
+SCAN_UPLOAD_RATE = float(os.environ.get('SCAN_UPLOAD_RATE', '20'))
+SCAN_UPLOAD_BURST = int(os.environ.get('SCAN_UPLOAD_BURST', '10'))
+# Scan embeddings for "similar prior scans" (pulmoscan.embeddings). Shared by
+# all web processes, so on one host or a shared volume.
+EMBEDDINGS_DIR = os.environ.get('EMBEDDINGS_DIR', os.path.join(BASE_DIR, 'embeddings'))
+# Tiered archival (`manage.py archive_scans`, pulmoscan.archive): scan reports
+# older than SCAN_ARCHIVE_AFTER_DAYS leave the hot table, and their files go
+# into lzma-compressed packs in SCAN_COLD_STORAGE_DIR. The rows move to a
+# table partitioned by month on PostgreSQL, or to the SQLite file
+# SCAN_ARCHIVE_DATABASE on SQLite. Archived reports stay readable through the
+# scan report detail endpoint and /api/media/.
+SCAN_ARCHIVE_AFTER_DAYS = int(os.environ.get('SCAN_ARCHIVE_AFTER_DAYS', '365'))
+SCAN_COLD_STORAGE_DIR = os.environ.get('SCAN_COLD_STORAGE_DIR', os.path.join(BASE_DIR, 'coldstorage'))
+SCAN_ARCHIVE_DATABASE = os.environ.get('SCAN_ARCHIVE_DATABASE', os.path.join(BASE_DIR, 'archive.sqlite3'))
+
+# Live events (/api/events/, ASGI mode). A stream only sees events published
+# in its own worker process unless EVENTS_FANOUT relays them: 'unix'
+# (datagram sockets in EVENTS_SOCKET_DIR, for several workers on one host;
+# gunicorn.conf.py turns it on when WEB_CONCURRENCY > 1) or the dotted path
+# of a relay class with send(event) and listen(deliver).
+EVENTS_FANOUT = os.environ.get('EVENTS_FANOUT') # None, 'unix' or a dotted path
+EVENTS_SOCKET_DIR = os.environ.get('EVENTS_SOCKET_DIR', os.path.join(tempfile.gettempdir(), 'pulmoscan-events'))
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -146,6 +206,23 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Under ASGI each request runs its ORM calls on its own thread and
+    # connection. A deferred transaction that reads and then writes fails
+    # at once with "database is locked" if another connection is writing;
+    # taking the write lock up front makes it wait (busy timeout) instead.
+    DATABASES['default'].setdefault('OPTIONS', {})['transaction_mode'] = 'IMMEDIATE'
+    # Archived scan reports get their own file, only opened once there are
+    # some; create it with `manage.py migrate --database archive`
+    DATABASES['archive'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SCAN_ARCHIVE_DATABASE,
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    }
+
+# Sends the archive models to DATABASES['archive'] when there is one
+DATABASE_ROUTERS = ['pulmoscan.archive.ArchiveRouter']
+
 '''DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -213,12 +290,21 @@ CORS_ALLOWED_ORIGINS = [
 # Or, if you need to allow all for testing
 # CORS_ALLOW_ALL_ORIGINS = True # NOT for production!
 CORS_ALLOW_ALL_ORIGINS = False
+# Read by the upload page when scan analysis is busy (429/503)
+CORS_EXPOSE_HEADERS = ['Retry-After']
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'mediafiles') # If you have user-uploaded media like scans
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'mediafiles')) # If you have user-uploaded media like scans
+
+# Uploaded media is served through /api/media/ after a permission check.
+# Behind nginx set MEDIA_ACCEL=nginx and map MEDIA_ACCEL_PREFIX to an
+# `internal` location aliasing MEDIA_ROOT; behind Apache/lighttpd set
+# MEDIA_ACCEL=sendfile. Unset, Django streams the file itself.
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL') # 'nginx', 'sendfile' or None
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
 
 # For Whitenoise compressed files (optional, but good practice)
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
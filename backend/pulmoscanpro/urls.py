@@ -14,6 +14,12 @@ urlpatterns = [
 
     # Dashboards (stock summary, doctor dashboard)
     path('api/dashboard/', include('pulmoscan.urls.dashboard_urls')),
+
+    # Uploaded files (scan images), permission-checked in every environment
+    path('api/media/', include('pulmoscan.urls.media_urls')),
+
+    # Live updates (Server-Sent Events) for the dashboards
+    path('api/events/', include('pulmoscan.urls.events_urls')),
 ]
 
 if settings.DEBUG:
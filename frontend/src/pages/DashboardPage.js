@@ -10,6 +10,7 @@ import { useAuth } from '../context/AuthContext';
 import DebugUser from '../components/DebugUser';
 import './DashboardPage.css';
 import axiosInstance from '../utils/axiosInstance';
+import { useServerEvents } from '../utils/serverEvents';
 
 
 const COLORS = ['#0088FE', '#00C49F', '#FFBB28', '#FF8042'];
@@ -20,10 +21,14 @@ function DashboardPage() {
   const [doctorSummary, setDoctorSummary] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // Bumped by live events so the summaries are refetched only when they changed
+  const [updates, setUpdates] = useState(0);
+
+  useServerEvents(['scan', 'stock', 'alerts'], () => setUpdates((n) => n + 1));
 
   useEffect(() => {
     const fetchDashboardData = async () => {
-      setLoading(true);
+      if (updates === 0) setLoading(true); // no spinner for live refreshes
       setError(null);
 
       if (!user || !authTokens?.access) {
@@ -59,7 +64,7 @@ function DashboardPage() {
     };
 
     fetchDashboardData();
-  }, [user, authTokens]);
+  }, [user, authTokens, updates]);
 
   const stockChartData = stockSummary ? [
     { name: 'Low Stock', value: stockSummary.low_stock_count },
@@ -3,6 +3,7 @@ import axios from 'axios';
 import { Link } from 'react-router-dom';
 import { useAuth } from '../../context/AuthContext'; // <--- IMPORT useAuth
 import axiosInstance from '../../utils/axiosInstance'; // Adjust path as needed 
+import { useServerEvents } from '../../utils/serverEvents';
 import { // Retaining basic MUI imports for consistency in styling, remove if not needed at all
   Box,
   Typography,
@@ -65,6 +66,18 @@ function PatientHistoryPage() {
     }
   }, [authTokens]); // <--- ADD authTokens to dependency array
 
+  // Live diagnoses: known reports are updated in place, anything else
+  // (a new upload, missed events) refetches the current search
+  useServerEvents(['scan'], (type, event) => {
+    if (type === 'scan' && scanReports.some((report) => report.id === event.id)) {
+      setScanReports((reports) => reports.map((report) => (
+        report.id === event.id ? { ...report, diagnosis: event.diagnosis, confidence: event.confidence } : report
+      )));
+    } else {
+      fetchScanReports(patientNameSearch);
+    }
+  });
+
   const handleSearchSubmit = (e) => {
     e.preventDefault();
     fetchScanReports(patientNameSearch);
@@ -15,12 +15,15 @@ import {
   Card,
   CardContent,
   CardMedia,
+  Checkbox,
+  FormControlLabel,
 } from '@mui/material';
 
 function ScanUploadPage() {
   const { authTokens } = useAuth(); // Get authTokens
   const [patientName, setPatientName] = useState('');
   const [scanImage, setScanImage] = useState(null);
+  const [urgent, setUrgent] = useState(false);
   const [uploading, setUploading] = useState(false);
   const [result, setResult] = useState(null);
   const [error, setError] = useState('');
@@ -52,7 +55,8 @@ function ScanUploadPage() {
     formData.append('scan_image', scanImage);
 
     try {
-      const response = await axiosInstance.post('scan-reports/', formData, {
+      // Urgent scans are analysed ahead of routine ones when the server is busy
+      const response = await axiosInstance.post(`scan-reports/?priority=${urgent ? 'urgent' : 'routine'}`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
           'Authorization': `Bearer ${authTokens.access}`, // Add Authorization header
@@ -61,11 +65,17 @@ function ScanUploadPage() {
       setResult(response.data);
       setPatientName('');
       setScanImage(null);
+      setUrgent(false);
       document.getElementById('scanImageInput').value = '';
     } catch (err) {
       console.error('Scan upload failed:', err.response ? err.response.data : err.message);
       if (err.response?.status === 401 || err.response?.status === 403) {
           setError('Authentication failed or you do not have permission to upload scans. Please log in with a Doctor or Admin account.');
+      } else if (err.response?.status === 429 || err.response?.status === 503) {
+          const retryAfter = err.response.headers['retry-after'];
+          setError(err.response.status === 429
+            ? `You have uploaded too many scans in a short time. Please try again in ${retryAfter || 'a few'} seconds.`
+            : `The analysis service is busy. Please try again in ${retryAfter || 'a few'} seconds.`);
       } else {
           setError('Failed to upload scan or get diagnosis. Please try again.');
       }
@@ -103,6 +113,13 @@ function ScanUploadPage() {
             />
           </Box>
 
+          <Box mb={2}>
+            <FormControlLabel
+              control={<Checkbox checked={urgent} onChange={(e) => setUrgent(e.target.checked)} />}
+              label="Urgent (analyse ahead of routine scans)"
+            />
+          </Box>
+
           {error && (
             <Alert severity="error" sx={{ mb: 2 }}>
               {error}
@@ -0,0 +1,63 @@
+// src/utils/serverEvents.js
+import { useEffect, useRef } from 'react';
+import axiosInstance from './axiosInstance';
+
+const baseURL = process.env.REACT_APP_API_BASE_URL;
+
+// Calls onEvent(type, data) for every live event of the given types pushed by
+// the backend (/api/events/), plus 'resync' whenever events may have been
+// missed and the page should refetch once.
+//
+// EventSource cannot send the Authorization header, so a short-lived ticket is
+// fetched first (through axiosInstance, which keeps the access token fresh)
+// and again whenever the stream has to be reopened. If the backend has no
+// event stream (WSGI mode), the page simply keeps its usual fetching.
+export function useServerEvents(types, onEvent) {
+  const handler = useRef(onEvent);
+  handler.current = onEvent;
+  const typeList = types.join(',');
+
+  useEffect(() => {
+    let source = null;
+    let retryTimer = null;
+    let stopped = false;
+    let reopened = false;
+
+    const connect = async () => {
+      let ticket;
+      try {
+        const response = await axiosInstance.post('events/ticket/');
+        ticket = response.data.ticket;
+      } catch (err) {
+        return; // Live updates unavailable
+      }
+      if (stopped) return;
+
+      source = new EventSource(`${baseURL}events/?ticket=${encodeURIComponent(ticket)}`);
+      source.onopen = () => {
+        // A fresh EventSource does not send Last-Event-ID, so the server
+        // cannot tell we were away
+        if (reopened) handler.current('resync', { type: 'resync' });
+      };
+      [...typeList.split(','), 'resync'].forEach((type) => {
+        source.addEventListener(type, (e) => handler.current(type, JSON.parse(e.data)));
+      });
+      source.onerror = () => {
+        // The browser retries dropped streams by itself; it gives up (CLOSED)
+        // when the reconnection is refused, e.g. because the ticket expired
+        if (source.readyState === EventSource.CLOSED) {
+          source.close();
+          reopened = true;
+          retryTimer = setTimeout(connect, 3000);
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    };
+  }, [typeList]);
+}